@@ -1,27 +1,33 @@
-
-
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, Flask, abort, current_app, g, render_template, request, redirect, url_for, flash, session
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 
+import atexit
+import csv
+import functools
+import hashlib
+import math
 import os
 import datetime
 import subprocess
+import time
 import json as _json_mod
+import zlib
+
+import click
+from sqlalchemy import delete, event, func, inspect, select, text, update
+
+from cache import ResultCache
+from config import get_allowance_limits, get_registry, pin_registry, reload_registry, unpin_registry
+from database import configure_engine, engine_options
+from metrics import Registry, add_time, server_timing, start_timing, stop_timing, timed
+from writebehind import WriteBehind
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'devsecret')
-_db_url = os.environ.get('DATABASE_URL', 'sqlite:///taxes.db')
-if _db_url.startswith('postgres://'):
-    _db_url = _db_url.replace('postgres://', 'postgresql+psycopg2://', 1)
-elif _db_url.startswith('postgresql://'):
-    _db_url = _db_url.replace('postgresql://', 'postgresql+psycopg2://', 1)
-app.config['SQLALCHEMY_DATABASE_URI'] = _db_url
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+db = SQLAlchemy()
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
+bp = Blueprint('main', __name__, cli_group=None)
 
 
 # User model
@@ -57,34 +63,233 @@ class Calculation(db.Model):
   activity_opened = db.Column(db.String(10))
   expenses = db.Column(db.Float)
   status = db.Column(db.String(10))
-  result_json = db.Column(db.Text)  # Store result as JSON string
+  # Category A allowances as entered, the other inputs are the columns above
+  meal_allowance_daily = db.Column(db.Float)
+  telework_allowance_monthly = db.Column(db.Float)
+  meal_type = db.Column(db.String(4))
+  # Identical inputs of the same user share a row, see `_save_calculation_rows`
+  input_hash = db.Column(db.String(32))
+  hit_count = db.Column(db.Integer, nullable=False, default=1, server_default=db.text('1'))
+  # The result: its totals as columns, the rest compressed, and the versions it was computed with
+  income_tax = db.Column(db.Float)
+  social_security = db.Column(db.Float)
+  solidarity_tax = db.Column(db.Float)
+  total_tax = db.Column(db.Float)
+  monthly_net = db.Column(db.Float)
+  result_detail = db.Column(db.LargeBinary)
+  result_schema = db.Column(db.Integer)
+  rates_version = db.Column(db.String(16))
+  result_json = db.Column(db.Text)  # Rows saved before the compact columns, until `flask compact`
+  __table_args__ = (
+    # History pages seek along this index instead of sorting the user's rows
+    db.Index('ix_calculation_user_history', user_id, timestamp.desc(), id.desc()),
+    db.Index('ix_calculation_user_input', user_id, input_hash),
+  )
+
+def _migrate():
+  """Adds what `create_all` skips on existing tables, on SQLite as on Postgres."""
+  existing = {column['name'] for column in inspect(db.engine).get_columns(Calculation.__tablename__)}
+  with db.engine.begin() as connection:
+    for column in Calculation.__table__.columns:
+      if column.name in existing:
+        continue
+      ddl = f'{column.name} {column.type.compile(dialect=db.engine.dialect)}'
+      if column.server_default is not None:
+        ddl += f' DEFAULT {column.server_default.arg.text}'
+      if not column.nullable:
+        ddl += ' NOT NULL'
+      connection.execute(text(f'ALTER TABLE {Calculation.__tablename__} ADD COLUMN {ddl}'))
+  for index in Calculation.__table__.indexes:
+    index.create(db.engine, checkfirst=True)
+
+def _save_calculation_rows(rows):
+  """
+  Adds calculations to the session. A calculation with the same inputs as one the user already has
+  updates that row instead: its result, a newer timestamp and one more hit.
+  """
+  for row in rows:
+    calc = db.session.execute(
+      select(Calculation).filter_by(user_id=row['user_id'], input_hash=row['input_hash'])
+      .order_by(Calculation.id.desc()).limit(1)
+    ).scalar()
+    if calc is None:
+      db.session.add(Calculation(**row))
+      continue
+    for name, value in row.items():
+      setattr(calc, name, value)
+    calc.hit_count += 1
 
-with app.app_context():
+def _save_calculations(app, rows):
+  """Saves calculations queued by the write-behind in a single transaction."""
+  with app.app_context():
+    try:
+      _save_calculation_rows(rows)
+      db.session.commit()
+    except Exception:
+      db.session.rollback()
+      raise
+
+def _calculation_writer():
+  """The write-behind of the current app, None when calculations are saved synchronously."""
+  return current_app.extensions.get('write_behind')
+
+def _database_url():
+  url = os.environ.get('DATABASE_URL', 'sqlite:///taxes.db')
+  if url.startswith('postgres://'):
+    url = url.replace('postgres://', 'postgresql+psycopg2://', 1)
+  elif url.startswith('postgresql://'):
+    url = url.replace('postgresql://', 'postgresql+psycopg2://', 1)
+  return url
+
+def create_app(config=None):
+  """
+  Builds the application and sets its database schema up, once per process and not at import,
+  so that importing this module stays cheap. `config` overrides the settings read from the environment.
+  """
+  app = Flask(__name__)
+  app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'devsecret')
+  app.config['SQLALCHEMY_DATABASE_URI'] = _database_url()
+  app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+  # Optional write-behind: calculations are saved at most WRITE_BEHIND_DELAY seconds later, off the request path
+  app.config['WRITE_BEHIND_DELAY'] = float(os.environ.get('WRITE_BEHIND_DELAY', 0))
+  # Optional per-request phase timings in a Server-Timing header, aggregated for /metrics
+  app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'false').lower() == 'true'
+  # Seconds between checks of rates.json for changes, 0 to only reload after /deploy
+  app.config['RATES_RELOAD_INTERVAL'] = float(os.environ.get('RATES_RELOAD_INTERVAL', 30))
+  app.config.update(config or {})
+  app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+  db.init_app(app)
+  login_manager.init_app(app)
+  app.register_blueprint(bp)
+
+  with app.app_context():
+    configure_engine(db.engine)
     db.create_all()
+    _migrate()
+  # compiled in the gunicorn master when preloading, the forked workers share the tables
+  get_registry()
+
+  if app.config['WRITE_BEHIND_DELAY'] > 0:
+    writer = WriteBehind(functools.partial(_save_calculations, app), max_delay=app.config['WRITE_BEHIND_DELAY'])
+    app.extensions['write_behind'] = writer
+    atexit.register(writer.close)
+  _setup_rates(app)
+  if app.config['METRICS_ENABLED']:
+    _setup_metrics(app)
+  return app
+
+def _rates_reloaded(registry):
+  # results of the previous version can't be hit anymore, free them rather than wait for the LRU
+  result_cache.clear()
+  current_app.logger.info('Rates reloaded, version %s', registry.version)
+
+def _setup_rates(app):
+  """Picks up a changed rates.json between requests and pins every request to the rates it started with."""
+  checked_at = [time.monotonic()]
+
+  @app.before_request
+  def _pin_rates():
+    interval = current_app.config['RATES_RELOAD_INTERVAL']
+    if interval > 0 and time.monotonic() - checked_at[0] >= interval:
+      checked_at[0] = time.monotonic()
+      registry = reload_registry()
+      if registry is not None:
+        _rates_reloaded(registry)
+    g.rates_token = pin_registry()
+
+  @app.teardown_request
+  def _unpin_rates(exception):
+    if 'rates_token' in g:
+      unpin_registry(g.pop('rates_token'))
+
+metrics_registry = Registry()
+metrics_registry.describe('http_requests_total', 'counter', 'Requests served by route, method and status')
+metrics_registry.describe('http_request_duration_seconds', 'histogram', 'Request latency by route')
+metrics_registry.describe('http_request_phase_seconds', 'histogram', 'Time spent in each phase of a request')
+metrics_registry.describe('db_queries_total', 'counter', 'SQL statements executed')
+metrics_registry.describe('db_seconds_total', 'counter', 'Time spent executing SQL statements')
+metrics_registry.describe('calculations_total', 'counter', 'Taxpayers calculated, alternatives not included')
+
+@metrics_registry.collector
+def _collect_stores():
+  """Counters kept by the result cache and the write-behind, read at scrape time."""
+  cache = result_cache.stats()
+  samples = [
+    ('result_cache_entries', 'gauge', 'Results held by the cache', cache['size'], {}),
+  ]
+  for name in ('hits', 'misses', 'coalesced', 'evictions', 'expirations'):
+    samples.append((f'result_cache_{name}_total', 'counter', f'Result cache {name}', cache[name], {}))
+  writer = _calculation_writer()
+  if writer is not None:
+    stats = writer.stats()
+    samples.append(('write_behind_pending', 'gauge', 'Calculations waiting to be saved', stats['pending'], {}))
+    samples.append(('write_behind_written_total', 'counter', 'Calculations saved', stats['written'], {}))
+    samples.append(('write_behind_failed_total', 'counter', 'Calculations dropped', stats['failed'], {}))
+  return samples
+
+def _setup_metrics(app):
+  """Times every request by phase, database time included, and aggregates it into `metrics_registry`."""
+  @app.before_request
+  def _start_request_timing():
+    g.request_timing = (time.perf_counter(), start_timing())
+
+  @app.after_request
+  def _finish_request_timing(response):
+    start, token = g.pop('request_timing')
+    total = time.perf_counter() - start
+    timings = stop_timing(token)
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    response.headers['Server-Timing'] = server_timing(timings, total)
+    metrics_registry.inc('http_requests_total', route=route, method=request.method, status=response.status_code)
+    metrics_registry.observe('http_request_duration_seconds', total, route=route)
+    for phase, seconds in timings.items():
+      metrics_registry.observe('http_request_phase_seconds', seconds, route=route, phase=phase)
+    return response
+
+  @app.teardown_request
+  def _drop_request_timing(exception):
+    # after_request is skipped when a view raises
+    if 'request_timing' in g:
+      stop_timing(g.pop('request_timing')[1])
+
+  with app.app_context():
+    engine = db.engine
+
+  @event.listens_for(engine, 'before_cursor_execute')
+  def _start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+  @event.listens_for(engine, 'after_cursor_execute')
+  def _finish_query(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_start'].pop()
+    add_time('db', seconds)
+    metrics_registry.inc('db_queries_total')
+    metrics_registry.inc('db_seconds_total', seconds)
 
 @login_manager.user_loader
 def load_user(user_id):
-  return db.session.get(User, int(user_id))
+  with timed('load_user'):
+    return db.session.get(User, int(user_id))
 
 # Registration route
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
   if request.method == 'POST':
     email = request.form['email'].lower()
     password = request.form['password']
     if User.query.filter_by(email=email).first():
       flash('Email already registered.', 'danger')
-      return redirect(url_for('register'))
+      return redirect(url_for('.register'))
     user = User(email=email)
     user.set_password(password)
     db.session.add(user)
     db.session.commit()
     flash('Registration successful. Please log in.', 'success')
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
   return render_template('register.html')
 
 # Login route
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
   if request.method == 'POST':
     email = request.form['email'].lower()
@@ -92,20 +297,20 @@ def login():
     user = User.query.filter_by(email=email).first()
     if user and user.check_password(password):
       login_user(user)
-      return redirect(url_for('profile'))
+      return redirect(url_for('.profile'))
     flash('Invalid email or password.', 'danger')
   return render_template('login.html')
 
 # Logout route
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
   logout_user()
   flash('Logged out.', 'info')
-  return redirect(url_for('login'))
+  return redirect(url_for('.login'))
 
 # Profile page for dimensions
-@app.route('/profile', methods=['GET', 'POST'])
+@bp.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
   if request.method == 'POST':
@@ -128,15 +333,205 @@ def profile():
       current_user.activity_opened = ''
     db.session.commit()
     flash('Profile updated. You can now calculate your taxes!', 'success')
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
   return render_template('profile.html')
 
 
+# Identical profiles are common, share their results between requests (and threads)
+result_cache = ResultCache(
+  maxsize=int(os.environ.get('RESULT_CACHE_SIZE', 1024)),
+  ttl=float(os.environ.get('RESULT_CACHE_TTL', 0)) or None,
+)
+
+def _input_key(kwargs, meal_daily, telework_monthly):
+  """The inputs of a calculation normalized, so that 50000 and 50000.0 are the same calculation."""
+  return (
+    tuple(sorted((name, float(value) if isinstance(value, (int, float)) else value) for name, value in kwargs.items())),
+    float(meal_daily),
+    float(telework_monthly),
+  )
+
+def _input_hash(kwargs, meal_daily, telework_monthly):
+  key = _json_mod.dumps(_input_key(kwargs, meal_daily, telework_monthly))
+  return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+def _calculate(kwargs, meal_daily, telework_monthly):
+  """Cached `_build_result`, keyed by the normalized inputs and the rates version."""
+  key = (get_registry().version, *_input_key(kwargs, meal_daily, telework_monthly))
+  # the cached dict is shared, hand out a copy
+  return dict(result_cache.get_or_compute(key, lambda: _build_result(kwargs, meal_daily, telework_monthly)))
+
+def _build_result(kwargs, meal_daily, telework_monthly):
+  """Builds the result shown on the calculator page, alternative scenarios included."""
+  metrics_registry.inc('calculations_total', source='page')
+  return _income_result(kwargs, meal_daily, telework_monthly)
+
+def _income_result(kwargs, meal_daily, telework_monthly):
+  """`_build_result` without counting it as page traffic, for the offline jobs."""
+  from model import Income, alternative_scenarios, compare_scenarios
+  with timed('calculate'):
+    inc = Income(**kwargs)
+    breakdown = inc.breakdown
+  with timed('alternatives'):
+    scenarios = alternative_scenarios(kwargs['residence'], kwargs['status'], kwargs['kids'])
+    _, alternatives = compare_scenarios(inc, scenarios)
+  taxes = {
+    'income_tax': breakdown.income_tax,
+    'social_security': breakdown.social_security_tax,
+    'solidarity_tax': breakdown.solidarity_tax,
+  }
+  return _page_result(kwargs, meal_daily, telework_monthly, str(inc), taxes, alternatives)
+
+def _page_result(kwargs, meal_daily, telework_monthly, desc, taxes, alternatives):
+  """The result of the calculator page from the taxes of a taxpayer, however they were calculated."""
+  i = kwargs['income']
+  it = taxes['income_tax']
+  sst = taxes['social_security']
+  st = taxes['solidarity_tax']
+  desc = desc.replace('Portuguese ', '')
+
+  tel_annual = kwargs['telework_allowance']
+  meal_annual = kwargs['meal_allowance']
+  meal_type = kwargs['meal_type']
+  limits = get_allowance_limits(kwargs['year'])
+  tel_exempt = round(min(tel_annual, 264 * limits['telework_daily']), 2)
+  meal_cap = limits['meal_card_daily'] if meal_type == 'card' else limits['meal_cash_daily']
+  meal_exempt = round(min(meal_annual, 264 * meal_cap), 2)
+  net = i + tel_annual + meal_annual - (it + sst + st)
+  return {
+    'desc': desc,
+    'wages': i,
+    'income_tax': it,
+    'social_security': sst,
+    'solidarity_tax': st,
+    'total_tax': it + sst + st,
+    'effective_rate': (it + sst + st)/i if i else 0,
+    'monthly_net': net / 12,
+    'status': kwargs['status'],
+    'kids': kwargs['kids'],
+    'opened_at': kwargs['opened_at'],
+    'expenses': kwargs['expenses'],
+    'meal_allowance': meal_annual,
+    'meal_allowance_exempt': meal_exempt,
+    'meal_allowance_daily': meal_daily,
+    'telework_allowance': tel_annual,
+    'telework_exempt': tel_exempt,
+    'telework_allowance_monthly': telework_monthly,
+    'meal_type': meal_type,
+    'alternatives': alternatives,
+  }
+
+
+HISTORY_PAGE_SIZE = 20
+MAX_HISTORY_PAGE_SIZE = 100
+
+def _history_page(user_id, limit, before=None):
+  """
+  A page of the user's calculations, newest first, and the cursor of the next page if there is one.
+  Pages seek past the `before` calculation along the history index instead of using an OFFSET,
+  so deep pages cost as much as the first one.
+  """
+  with timed('history'):
+    return _seek_history(user_id, limit, before)
+
+def _seek_history(user_id, limit, before):
+  query = Calculation.query.filter(Calculation.user_id == user_id)
+  if before is not None:
+    # compare with the stored timestamp itself, its format differs between the backends
+    seek = db.select(Calculation.timestamp).where(Calculation.id == before).scalar_subquery()
+    query = query.filter(db.or_(
+      Calculation.timestamp < seek,
+      db.and_(Calculation.timestamp == seek, Calculation.id < before),
+    ))
+  calcs = query.order_by(Calculation.timestamp.desc(), Calculation.id.desc()).limit(limit + 1).all()
+  return calcs[:limit], calcs[limit - 1].id if len(calcs) > limit else None
+
+
+# Version of the stored result layout, bump it whenever `_build_result` or `_result_columns` change
+RESULT_SCHEMA = 3
+_TOTAL_COLUMNS = ('income_tax', 'social_security', 'solidarity_tax', 'total_tax', 'monthly_net')
+# Result keys stored as columns or derived from them, the other ones go to `result_detail`
+_COLUMN_KEYS = set(_TOTAL_COLUMNS) | {
+  'wages', 'effective_rate', 'status', 'kids', 'opened_at', 'expenses', 'meal_allowance', 'meal_allowance_daily',
+  'telework_allowance', 'telework_allowance_monthly', 'meal_type',
+}
+
+def _result_columns(result):
+  """The columns storing a result of `_build_result`, tagged with the versions it was computed with."""
+  detail = {key: value for key, value in result.items() if key not in _COLUMN_KEYS}
+  return {
+    **{name: result[name] for name in _TOTAL_COLUMNS},
+    'meal_allowance_daily': result['meal_allowance_daily'],
+    'telework_allowance_monthly': result['telework_allowance_monthly'],
+    'meal_type': result['meal_type'],
+    'result_detail': zlib.compress(_json_mod.dumps(detail, separators=(',', ':')).encode()),
+    'result_schema': RESULT_SCHEMA,
+    'rates_version': get_registry().version,
+    'result_json': None,
+  }
+
+def _stored_result(calc):
+  """The result stored by `_result_columns`, None when it predates the current schema or rates."""
+  if calc.result_schema != RESULT_SCHEMA or calc.rates_version != get_registry().version or not calc.result_detail:
+    return None
+  meal_daily, telework_monthly = calc.meal_allowance_daily, calc.telework_allowance_monthly
+  return {
+    **_json_mod.loads(zlib.decompress(calc.result_detail)),
+    **{name: getattr(calc, name) for name in _TOTAL_COLUMNS},
+    'wages': calc.income,
+    'effective_rate': calc.total_tax / calc.income if calc.income else 0,
+    'status': calc.status,
+    'kids': calc.kids,
+    'opened_at': calc.activity_opened,
+    'expenses': calc.expenses,
+    'meal_allowance': meal_daily * 264,
+    'meal_allowance_daily': meal_daily,
+    'telework_allowance': telework_monthly * 12,
+    'telework_allowance_monthly': telework_monthly,
+    'meal_type': calc.meal_type,
+  }
+
+def _legacy_result(calc):
+  """The result of a row saved as `result_json`, before the compact columns."""
+  try:
+    return _json_mod.loads(calc.result_json) if calc.result_json else {}
+  except ValueError:
+    return {}
+
+def _calculation_arguments(calc):
+  """`Income` arguments of a stored calculation, with the allowances as entered."""
+  if calc.meal_type is not None:
+    meal_daily, telework_monthly, meal_type = calc.meal_allowance_daily, calc.telework_allowance_monthly, calc.meal_type
+  else:
+    # Restore daily meal and monthly telework from saved JSON
+    saved = _legacy_result(calc)
+    meal_daily = saved.get('meal_allowance_daily', 0) or 0
+    telework_monthly = saved.get('telework_allowance_monthly', 0) or 0
+    meal_type = saved.get('meal_type', 'card')
+  kwargs = {
+    'year': calc.year,
+    'income': calc.income,
+    'residence': calc.residence,
+    'region': calc.region,
+    'opened_at': calc.activity_opened if calc.category == 'B' else None,
+    'expenses': calc.expenses,
+    'status': calc.status,
+    'kids': calc.kids,
+    'telework_allowance': telework_monthly * 12,
+    'meal_allowance': meal_daily * 264,
+    'meal_type': meal_type,
+  }
+  return kwargs, meal_daily, telework_monthly
+
+def _recalculate(calc):
+  """Calculates a stored calculation again."""
+  return _calculate(*_calculation_arguments(calc))
+
+
 # Calculation page (measures)
-@app.route('/', methods=['GET', 'POST'])
+@bp.route('/', methods=['GET', 'POST'])
 @login_required
 def index():
-  from model import Income
   result = None
   error = None
   just_calculated = False
@@ -147,133 +542,18 @@ def index():
   if load_id:
     calc = Calculation.query.filter_by(id=load_id, user_id=current_user.id).first()
     if calc:
-      # Use calculation's dimensions
-      year = calc.year
-      income = calc.income
-      expenses = calc.expenses
-      status = calc.status
-      residence = calc.residence
-      region = calc.region
-      category = calc.category
-      kids = calc.kids
-      opened_at = calc.activity_opened if category == 'B' else None
       try:
-        from config import get_allowance_limits
-        # Retrieve stored allowances from saved result JSON
-        saved = {}
-        if calc.result_json:
-          try:
-            saved = _json_mod.loads(calc.result_json)
-          except Exception:
-            pass
-        # Restore daily meal and monthly telework from saved JSON
-        meal_daily = saved.get('meal_allowance_daily', 0) or 0
-        telework_monthly = saved.get('telework_allowance_monthly', 0) or 0
-        meal_type = saved.get('meal_type', 'card')
-        meal_annual = meal_daily * 264
-        tel_annual = telework_monthly * 12
-
-        kwargs = {
-          'year': year,
-          'income': income,
-          'residence': residence,
-          'region': region,
-          'opened_at': opened_at,
-          'expenses': expenses,
-          'status': status,
-          'kids': kids,
-          'telework_allowance': tel_annual,
-          'meal_allowance': meal_annual,
-          'meal_type': meal_type,
-        }
-        inc = Income(**kwargs)
-        i = inc.income
-        it = inc.income_tax
-        sst = inc.social_security_tax
-        st = inc.solidarity_tax
-        desc = str(inc).replace('Portuguese ', '')
-
-        limits = get_allowance_limits(year)
-        tel_exempt = round(min(tel_annual, 264 * limits['telework_daily']), 2)
-        meal_cap = limits['meal_card_daily'] if meal_type == 'card' else limits['meal_cash_daily']
-        meal_exempt = round(min(meal_annual, 264 * meal_cap), 2)
-        net = i + tel_annual + meal_annual - (it + sst + st)
-        result = {
-          'desc': desc,
-          'wages': i,
-          'income_tax': it,
-          'social_security': sst,
-          'solidarity_tax': st,
-          'total_tax': it + sst + st,
-          'effective_rate': (it + sst + st)/i if i else 0,
-          'monthly_net': net / 12,
-          'status': status,
-          'kids': kids,
-          'opened_at': opened_at,
-          'expenses': expenses,
-          'meal_allowance': meal_annual,
-          'meal_allowance_exempt': meal_exempt,
-          'meal_allowance_daily': meal_daily,
-          'telework_allowance': tel_annual,
-          'telework_exempt': tel_exempt,
-          'telework_allowance_monthly': telework_monthly,
-          'meal_type': meal_type,
-        }
-        # Alternative scenarios (reuse logic from POST)
-        alternatives = []
-        if residence != 'nhr':
-          alt_kwargs = kwargs.copy()
-          alt_kwargs['residence'] = 'nhr'
-          alt_kwargs['region'] = 'Mainland'
-          try:
-            alt_inc = Income(**alt_kwargs)
-            alt_total = alt_inc.income_tax + alt_inc.social_security_tax + alt_inc.solidarity_tax
-            gain = (it + sst + st) - alt_total
-            alternatives.append({
-              'desc': 'Non-Habitual Resident',
-              'total_tax': alt_total,
-              'monthly_net': (i - alt_total)/12,
-              'gain': gain
-            })
-          except Exception:
-            pass
-        if residence not in ['nhr', 'nr']:
-          alt_kwargs = kwargs.copy()
-          alt_kwargs['status'] = 'joint' if status == 'single' else 'single'
-          try:
-            alt_inc = Income(**alt_kwargs)
-            alt_total = alt_inc.income_tax + alt_inc.social_security_tax + alt_inc.solidarity_tax
-            gain = (it + sst + st) - alt_total
-            alternatives.append({
-              'desc': f"{'Joint' if status == 'single' else 'Single'} Declaration",
-              'total_tax': alt_total,
-              'monthly_net': (i - alt_total)/12,
-              'gain': gain
-            })
-          except Exception:
-            pass
-        if kids:
-          alt_kwargs = kwargs.copy()
-          alt_kwargs['kids'] = ''
-          try:
-            alt_inc = Income(**alt_kwargs)
-            alt_total = alt_inc.income_tax + alt_inc.social_security_tax + alt_inc.solidarity_tax
-            gain = (it + sst + st) - alt_total
-            alternatives.append({
-              'desc': 'No Kids',
-              'total_tax': alt_total,
-              'monthly_net': (i - alt_total)/12,
-              'gain': gain
-            })
-          except Exception:
-            pass
-        result['alternatives'] = alternatives
+        # Render the stored result, unless it predates the current schema or rates. A stale row is
+        # recalculated for display only, `flask reevaluate` rewrites the rows outside of the requests
+        result = _stored_result(calc)
+        if result is None:
+          result = _calculate(*_calculation_arguments(calc))
       except Exception as e:
         error = str(e)
-      recent_calcs = Calculation.query.filter_by(user_id=current_user.id).order_by(Calculation.timestamp.desc()).limit(5).all()
+      recent_calcs, _ = _history_page(current_user.id, 5)
       current_year = datetime.datetime.now().year
-      return render_template('index.html', result=result, error=error, profile=profile, recent_calcs=recent_calcs, current_year=current_year)
-
+      with timed('render'):
+        return render_template('index.html', result=result, error=error, profile=profile, recent_calcs=recent_calcs, current_year=current_year)
   if request.method == 'POST':
     try:
       year = int(request.form.get('year', 2025))
@@ -299,7 +579,6 @@ def index():
         telework_monthly = float(telework_m) if telework_m else 0.0
         meal_type = request.form.get('meal_type', 'card')
 
-      from config import get_allowance_limits
       meal_annual = meal_daily * 264        # 264 working days/year
       tel_annual = telework_monthly * 12
       kwargs = {
@@ -315,41 +594,9 @@ def index():
         'meal_allowance': meal_annual,
         'meal_type': meal_type,
       }
-      inc = Income(**kwargs)
-      i = inc.income
-      it = inc.income_tax
-      sst = inc.social_security_tax
-      st = inc.solidarity_tax
-      desc = str(inc).replace('Portuguese ', '')
-
-      limits = get_allowance_limits(year)
-      tel_exempt = round(min(tel_annual, 264 * limits['telework_daily']), 2)
-      meal_cap = limits['meal_card_daily'] if meal_type == 'card' else limits['meal_cash_daily']
-      meal_exempt = round(min(meal_annual, 264 * meal_cap), 2)
-      net = i + tel_annual + meal_annual - (it + sst + st)
-      result = {
-        'desc': desc,
-        'wages': i,
-        'income_tax': it,
-        'social_security': sst,
-        'solidarity_tax': st,
-        'total_tax': it + sst + st,
-        'effective_rate': (it + sst + st)/i if i else 0,
-        'monthly_net': net / 12,
-        'status': status,
-        'kids': kids,
-        'opened_at': opened_at,
-        'expenses': expenses,
-        'meal_allowance': meal_annual,
-        'meal_allowance_exempt': meal_exempt,
-        'meal_allowance_daily': meal_daily,
-        'telework_allowance': tel_annual,
-        'telework_exempt': tel_exempt,
-        'telework_allowance_monthly': telework_monthly,
-        'meal_type': meal_type,
-      }
+      result = _calculate(kwargs, meal_daily, telework_monthly)
       just_calculated = True
-      calc = Calculation(
+      row = dict(
         user_id=current_user.id,
         year=year,
         income=income,
@@ -360,73 +607,198 @@ def index():
         activity_opened=opened_at,
         expenses=expenses,
         status=status,
-        result_json=_json_mod.dumps(result)
+        input_hash=_input_hash(kwargs, meal_daily, telework_monthly),
+        # stamped now, not when a write-behind queue gets written, and again on every repeat
+        timestamp=datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None),
+        **_result_columns(result),
       )
-      db.session.add(calc)
-      db.session.commit()
-
-      # Alternative scenarios
-      alternatives = []
-      # Try NHR if not already
-      if residence != 'nhr':
-        alt_kwargs = kwargs.copy()
-        alt_kwargs['residence'] = 'nhr'
-        alt_kwargs['region'] = 'Mainland'
-        try:
-          alt_inc = Income(**alt_kwargs)
-          alt_total = alt_inc.income_tax + alt_inc.social_security_tax + alt_inc.solidarity_tax
-          gain = (it + sst + st) - alt_total
-          alternatives.append({
-            'desc': 'Non-Habitual Resident',
-            'total_tax': alt_total,
-            'monthly_net': (i - alt_total)/12,
-            'gain': gain
-          })
-        except Exception:
-          pass
-      # Try joint/single (only relevant for residents with progressive tax brackets)
-      if residence not in ['nhr', 'nr']:
-        alt_kwargs = kwargs.copy()
-        alt_kwargs['status'] = 'joint' if status == 'single' else 'single'
-        try:
-          alt_inc = Income(**alt_kwargs)
-          alt_total = alt_inc.income_tax + alt_inc.social_security_tax + alt_inc.solidarity_tax
-          gain = (it + sst + st) - alt_total
-          alternatives.append({
-            'desc': f"{'Joint' if status == 'single' else 'Single'} Declaration",
-            'total_tax': alt_total,
-            'monthly_net': (i - alt_total)/12,
-            'gain': gain
-          })
-        except Exception:
-          pass
-      # Try with/without kids
-      if kids:
-        alt_kwargs = kwargs.copy()
-        alt_kwargs['kids'] = ''
-        try:
-          alt_inc = Income(**alt_kwargs)
-          alt_total = alt_inc.income_tax + alt_inc.social_security_tax + alt_inc.solidarity_tax
-          gain = (it + sst + st) - alt_total
-          alternatives.append({
-            'desc': 'No Kids',
-            'total_tax': alt_total,
-            'monthly_net': (i - alt_total)/12,
-            'gain': gain
-          })
-        except Exception:
-          pass
-      result['alternatives'] = alternatives
+      writer = _calculation_writer()
+      with timed('save'):
+        if writer is not None:
+          writer.put(row)
+        else:
+          _save_calculation_rows([row])
+          db.session.commit()
     except Exception as e:
       error = str(e)
   # Show recent calculations
-  from config import get_allowance_limits
-  recent_calcs = Calculation.query.filter_by(user_id=current_user.id).order_by(Calculation.timestamp.desc()).limit(5).all()
+  recent_calcs, _ = _history_page(current_user.id, 5)
   current_year = datetime.datetime.now().year
   allowance_limits_json = _json_mod.dumps({str(y): get_allowance_limits(y) for y in [2023, 2024, 2025, 2026]})
-  return render_template('index.html', result=result, error=error, profile=profile, recent_calcs=recent_calcs, current_year=current_year, just_calculated=just_calculated, allowance_limits_json=allowance_limits_json)
+  with timed('render'):
+    return render_template('index.html', result=result, error=error, profile=profile, recent_calcs=recent_calcs, current_year=current_year, just_calculated=just_calculated, allowance_limits_json=allowance_limits_json)
+
+# Full calculation history, one page at a time
+@bp.route('/history')
+@login_required
+def history():
+  calcs, next_before = _history_page(current_user.id, HISTORY_PAGE_SIZE, request.args.get('before', type=int))
+  return render_template('history.html', calcs=calcs, next_before=next_before)
+
+MAX_CURVE_POINTS = 100_000
+
+def _profile_arguments(profile, args):
+  """`Income` arguments other than the income for the saved profile and the query string measures."""
+  return {
+    'year': int(args.get('year', 2025)),
+    'residence': profile.residence,
+    'region': profile.region,
+    'opened_at': profile.activity_opened if profile.category == 'B' else None,
+    'expenses': float(args.get('expenses', 0)) if profile.category == 'B' else 0,
+    'status': args.get('status', 'single'),
+    'kids': profile.kids or None,
+  }
+
+# Gross-to-net curve for the current profile (JSON)
+@bp.route('/curve')
+@login_required
+def curve():
+  from model import income_curve
+  try:
+    start = float(request.args.get('start', 0))
+    stop = float(request.args.get('stop', 500000))
+    step = float(request.args.get('step', 10))
+    if step > 0 and (stop - start) / step >= MAX_CURVE_POINTS:
+      return {'error': f'A curve is limited to {MAX_CURVE_POINTS} points, increase the step'}, 400
+    data = income_curve(_profile_arguments(current_user, request.args), start, stop, step)
+  except ValueError as e:
+    return {'error': str(e)}, 400
+  # the tax components triple the payload, only send them on request
+  columns = ['gross', 'net_income', 'total_tax', 'effective_rate', 'marginal_rate']
+  if request.args.get('components'):
+    columns += ['income_tax', 'social_security', 'solidarity_tax']
+  rates = ('effective_rate', 'marginal_rate')
+  return {key: data[key].round(4 if key in rates else 2).tolist() for key in columns}
+
+# Gross income required for one or more target monthly net salaries (JSON)
+@bp.route('/net-to-gross')
+@login_required
+def net_to_gross():
+  from model import gross_for_net
+  try:
+    monthly_net = [float(value) for value in request.args.getlist('monthly_net')]
+    if not monthly_net:
+      return {'error': 'Specify at least one monthly_net'}, 400
+    gross = gross_for_net(_profile_arguments(current_user, request.args), [net * 12 for net in monthly_net])
+  except ValueError as e:
+    return {'error': str(e)}, 400
+  return {'monthly_net': monthly_net, 'gross': gross.tolist()}
+
+API_MAX_BATCH = 1000
+# JSON types of the `Income` arguments, checked before they reach the vectorized engine
+_API_FIELDS = {
+  'year': int, 'income': float, 'residence': str, 'region': str, 'opened_at': str, 'expenses': float,
+  'status': str, 'kids': str, 'telework_allowance': float, 'meal_allowance': float, 'meal_type': str,
+}
+
+def _api_authorized():
+  """A logged in session or the `API_TOKEN` bearer token."""
+  if current_user.is_authenticated:
+    return True
+  token = os.environ.get('API_TOKEN', '')
+  return bool(token) and request.headers.get('Authorization', '') == f'Bearer {token}'
+
+def _api_profile_error(profile):
+  """Why the values of a profile have the wrong JSON type, None when they are all right."""
+  for key, value in profile.items():
+    kind = _API_FIELDS.get(key)
+    if value is None or kind is None:
+      continue  # the defaults, unknown arguments are reported by the model
+    if kind is str:
+      if not isinstance(value, str):
+        return f'{key} must be a string'
+    elif kind is int:
+      if isinstance(value, bool) or not isinstance(value, int):
+        return f'{key} must be an integer'
+    elif isinstance(value, bool) or not isinstance(value, (int, float)):
+      return f'{key} must be a number'
+    elif not math.isfinite(value):
+      return f'{key} must be a finite number'
+  return None
+
+# Breakdown of one profile or of an array of profiles in a single vectorized call (JSON)
+@bp.route('/api/v1/calculate', methods=['POST'])
+def api_calculate():
+  from model import calculate_profiles
+  if not _api_authorized():
+    return {'error': 'unauthorized'}, 401
+  payload = request.get_json(silent=True)
+  profiles = [payload] if isinstance(payload, dict) else payload
+  if not isinstance(profiles, list) or not profiles or not all(isinstance(p, dict) for p in profiles):
+    return {'error': 'Send a profile object or a non-empty array of profiles'}, 400
+  if len(profiles) > API_MAX_BATCH:
+    return {'error': f'A batch is limited to {API_MAX_BATCH} profiles'}, 400
+  for k, profile in enumerate(profiles):
+    error = _api_profile_error(profile)
+    if error:
+      return {'error': error if isinstance(payload, dict) else f'Profile {k}: {error}'}, 400
+  alternatives = request.args.get('alternatives', '').lower() in ('1', 'true', 'yes')
+  metrics_registry.inc('calculations_total', len(profiles), source='api')
+  try:
+    with timed('calculate'):
+      breakdowns = calculate_profiles(profiles, alternatives=alternatives)
+  except (TypeError, ValueError) as e:
+    return {'error': str(e)}, 400
+  for breakdown in breakdowns:
+    for key, value in breakdown.items():
+      if isinstance(value, float):
+        if not math.isfinite(value):
+          return {'error': 'The amounts are too large to calculate'}, 400
+        breakdown[key] = round(value, 4 if key == 'effective_rate' else 2)
+    for row in breakdown.get('alternatives', []):
+      for key in ('total_tax', 'monthly_net', 'gain'):
+        row[key] = round(row[key], 2)
+  return breakdowns[0] if isinstance(payload, dict) else breakdowns
+
+# Calculation history of the logged in user, keyset-paginated (JSON)
+@bp.route('/api/v1/history')
+def api_history():
+  if not current_user.is_authenticated:
+    return {'error': 'unauthorized'}, 401
+  limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), MAX_HISTORY_PAGE_SIZE)
+  calcs, next_before = _history_page(current_user.id, limit, request.args.get('before', type=int))
+  items = []
+  for calc in calcs:
+    saved = _legacy_result(calc) if calc.total_tax is None else {}
+    items.append({
+      'id': calc.id,
+      'timestamp': calc.timestamp.isoformat() if calc.timestamp else None,
+      'year': calc.year,
+      'income': calc.income,
+      'residence': calc.residence,
+      'region': calc.region,
+      'category': calc.category,
+      'kids': calc.kids,
+      'expenses': calc.expenses,
+      'status': calc.status,
+      'total_tax': saved.get('total_tax', calc.total_tax),
+      'monthly_net': saved.get('monthly_net', calc.monthly_net),
+      'hit_count': calc.hit_count,
+    })
+  return {'items': items, 'next_before': next_before}
+
+# Cache counters, to size RESULT_CACHE_SIZE (JSON)
+@bp.route('/api/v1/stats')
+def api_stats():
+  if not _api_authorized():
+    return {'error': 'unauthorized'}, 401
+  stats = {'result_cache': result_cache.stats()}
+  writer = _calculation_writer()
+  if writer is not None:
+    stats['write_behind'] = writer.stats()
+  return stats
 
-@app.route('/deploy', methods=['POST'])
+# Prometheus scrape endpoint, METRICS_TOKEN as a bearer token when set
+@bp.route('/metrics')
+def metrics():
+  if not current_app.config['METRICS_ENABLED']:
+    abort(404)
+  token = os.environ.get('METRICS_TOKEN', '')
+  if token and request.headers.get('Authorization', '') != f'Bearer {token}':
+    return {'error': 'unauthorized'}, 401
+  return metrics_registry.render(), {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@bp.route('/deploy', methods=['POST'])
 def deploy():
   token = os.environ.get('DEPLOY_TOKEN', '')
   auth = request.headers.get('Authorization', '')
@@ -437,7 +809,258 @@ def deploy():
     cwd=os.path.dirname(os.path.abspath(__file__)),
     capture_output=True, text=True
   )
-  return {'stdout': result.stdout, 'stderr': result.stderr, 'returncode': result.returncode}
+  # this worker switches right away, the others on their next check of rates.json
+  registry = reload_registry(force=True) if result.returncode == 0 else None
+  if registry is not None:
+    _rates_reloaded(registry)
+  return {
+    'stdout': result.stdout, 'stderr': result.stderr, 'returncode': result.returncode,
+    # this request itself is pinned to the previous version
+    'rates_version': (registry or get_registry()).version, 'rates_reloaded': registry is not None,
+  }
+
+REEVALUATE_CHUNK_SIZE = 1000
+_REEVALUATE_COLUMNS = (
+  'id', 'user_id', 'year', 'income', 'residence', 'region', 'category', 'kids', 'activity_opened', 'expenses',
+  'status', 'meal_allowance_daily', 'telework_allowance_monthly', 'meal_type', 'total_tax', 'result_schema',
+  'rates_version', 'result_json',
+)
+_REPORT_FIELDS = ('id', 'user_id', 'year', 'region', 'income', 'old_total_tax', 'new_total_tax', 'difference')
+
+def _reevaluate_chunk(arguments):
+  """
+  Results of stored calculations, from their `_calculation_arguments`, in a single `calculate_profiles` call
+  with the alternatives. When the batch rejects a row the chunk is calculated one by one,
+  and the rows that fail get None.
+  """
+  from model import Income, calculate_profiles
+  try:
+    breakdowns = calculate_profiles([kwargs for kwargs, _, _ in arguments], alternatives=True)
+    descriptions = [str(Income(**kwargs)) for kwargs, _, _ in arguments]
+  except (ValueError, TypeError):
+    breakdowns = None
+  results = []
+  for k, (kwargs, meal_daily, telework_monthly) in enumerate(arguments):
+    if breakdowns is None:
+      try:
+        results.append(_income_result(kwargs, meal_daily, telework_monthly))
+      except (ValueError, TypeError):
+        results.append(None)
+      continue
+    breakdown = breakdowns[k]
+    results.append(_page_result(
+      kwargs, meal_daily, telework_monthly, descriptions[k], breakdown, breakdown['alternatives']
+    ))
+  return results
+
+def _reevaluate_calculations(
+  chunk_size=REEVALUATE_CHUNK_SIZE, start_after=0, everything=False, dry_run=False, report=None, checkpoint=None,
+):
+  """
+  Recalculates the stored calculations whose result predates the current schema or rates, or all of them.
+
+  The table is walked in primary key order, one chunk per query and per transaction, so memory stays
+  bounded by the chunk size. After every committed chunk its last id is written to `checkpoint`,
+  which a later run resumes from. Calculations whose total tax changed are written to the `report` CSV.
+  Returns the counts of calculations scanned, recalculated, changed and failed, and the last id done.
+  """
+  stats = {'scanned': 0, 'recalculated': 0, 'changed': 0, 'failed': 0, 'last_id': start_after}
+  columns = [getattr(Calculation, name) for name in _REEVALUATE_COLUMNS]
+  report_file = writer = None
+  if report:
+    report_file = open(report, 'a' if start_after else 'w', newline='')
+    writer = csv.writer(report_file)
+    if report_file.tell() == 0:
+      writer.writerow(_REPORT_FIELDS)
+  # the whole run uses one version of the rates, even if they are reloaded meanwhile
+  token = pin_registry()
+  try:
+    while True:
+      rows = db.session.execute(
+        select(*columns).where(Calculation.id > stats['last_id']).order_by(Calculation.id).limit(chunk_size)
+      ).all()
+      if not rows:
+        break
+      version = get_registry().version
+      stale = [
+        row for row in rows if everything or row.result_schema != RESULT_SCHEMA or row.rates_version != version
+      ]
+      arguments = [_calculation_arguments(row) for row in stale]
+      updates = []
+      for row, inputs, result in zip(stale, arguments, _reevaluate_chunk(arguments)):
+        if result is None:
+          stats['failed'] += 1
+          continue
+        old = row.total_tax if row.total_tax is not None else _legacy_result(row).get('total_tax')
+        new = result['total_tax']
+        if old is None or abs(new - old) >= 0.005:
+          stats['changed'] += 1
+          if writer:
+            writer.writerow([row.id, row.user_id, row.year, row.region, row.income, old, round(new, 2),
+                             None if old is None else round(new - old, 2)])
+        updates.append({'id': row.id, 'input_hash': _input_hash(*inputs), **_result_columns(result)})
+      if updates and not dry_run:
+        db.session.execute(update(Calculation), updates)
+        db.session.commit()
+      stats['scanned'] += len(rows)
+      stats['recalculated'] += len(updates)
+      stats['last_id'] = rows[-1].id
+      if checkpoint and not dry_run:
+        with open(f'{checkpoint}.tmp', 'w') as file:
+          file.write(str(stats['last_id']))
+        os.replace(f'{checkpoint}.tmp', checkpoint)
+      if report_file:
+        report_file.flush()
+      click.echo(
+        f"up to id {stats['last_id']}: {stats['scanned']} scanned, {stats['recalculated']} recalculated, "
+        f"{stats['changed']} changed, {stats['failed']} failed"
+      )
+  finally:
+    unpin_registry(token)
+    if report_file:
+      report_file.close()
+  return stats
+
+@bp.cli.command('reevaluate')
+@click.option(
+  '--chunk-size', default=REEVALUATE_CHUNK_SIZE, show_default=True, help='Calculations per query and transaction.'
+)
+@click.option('--start-after', type=int, help='Only calculations with a greater id, overrides the checkpoint.')
+@click.option('--checkpoint', type=click.Path(dir_okay=False), help='File keeping the last id done, read to resume.')
+@click.option('--report', type=click.Path(dir_okay=False), help='CSV of the calculations whose total tax changed.')
+@click.option('--all', 'everything', is_flag=True, help='Also recalculate the results of the current rates.')
+@click.option('--dry-run', is_flag=True, help='Report the changes without saving them.')
+def reevaluate_command(chunk_size, start_after, checkpoint, report, everything, dry_run):
+  """Recalculates the stored calculations after a change of rates.json."""
+  if start_after is None:
+    start_after = 0
+    if checkpoint and os.path.exists(checkpoint):
+      with open(checkpoint) as file:
+        start_after = int(file.read().strip() or 0)
+  stats = _reevaluate_calculations(chunk_size, start_after, everything, dry_run, report, checkpoint)
+  click.echo(f"Done: {stats['recalculated']} recalculated, {stats['changed']} with a changed total tax")
+
+# `result_json` rows of this schema hold a complete result, which converts without recalculating
+_JSON_RESULT_SCHEMA = 2
+
+def _compact_json_rows(chunk_size):
+  """Moves the `result_json` rows to the compact columns, chunk by chunk. Returns how many were converted."""
+  converted, last_id = 0, 0
+  version = get_registry().version
+  while True:
+    calcs = db.session.execute(
+      select(Calculation).where(Calculation.result_json.is_not(None), Calculation.id > last_id)
+      .order_by(Calculation.id).limit(chunk_size)
+    ).scalars().all()
+    if not calcs:
+      return converted
+    for calc in calcs:
+      saved = _legacy_result(calc)
+      arguments = _calculation_arguments(calc)
+      kwargs, meal_daily, telework_monthly = arguments
+      columns = {
+        'meal_allowance_daily': meal_daily,
+        'telework_allowance_monthly': telework_monthly,
+        'meal_type': kwargs['meal_type'],
+        # older totals are kept for the history, the result itself is recalculated when loaded
+        'total_tax': saved.get('total_tax'),
+        'monthly_net': saved.get('monthly_net'),
+        'result_json': None,
+      }
+      if saved.get('schema') == _JSON_RESULT_SCHEMA and saved.get('rates_version') == version:
+        try:
+          columns = _result_columns({k: v for k, v in saved.items() if k not in ('schema', 'rates_version')})
+        except KeyError:
+          pass
+      for name, value in columns.items():
+        setattr(calc, name, value)
+      calc.input_hash = _input_hash(*arguments)
+    last_id = calcs[-1].id
+    converted += len(calcs)
+    db.session.commit()
+
+def _merge_repeated_calculations(chunk_size):
+  """
+  Keeps one row per user and inputs, the latest, with the hits and the newest timestamp of all of them.
+  Returns how many rows were merged into another one.
+  """
+  merged = 0
+  while True:
+    groups = db.session.execute(
+      select(
+        Calculation.user_id, Calculation.input_hash, func.max(Calculation.id), func.sum(Calculation.hit_count),
+        func.max(Calculation.timestamp), func.count(),
+      )
+      .where(Calculation.input_hash.is_not(None))
+      .group_by(Calculation.user_id, Calculation.input_hash)
+      .having(func.count() > 1)
+      .limit(chunk_size)
+    ).all()
+    if not groups:
+      return merged
+    for user_id, input_hash, keep_id, hits, timestamp, count in groups:
+      db.session.execute(
+        update(Calculation).where(Calculation.id == keep_id).values(hit_count=hits, timestamp=timestamp)
+      )
+      db.session.execute(
+        delete(Calculation).where(
+          Calculation.user_id == user_id, Calculation.input_hash == input_hash, Calculation.id != keep_id
+        )
+      )
+      merged += count - 1
+    db.session.commit()
+
+def _database_bytes():
+  if db.engine.dialect.name != 'sqlite':
+    return None
+  with db.engine.connect() as connection:
+    pages = connection.exec_driver_sql('PRAGMA page_count').scalar()
+    return pages * connection.exec_driver_sql('PRAGMA page_size').scalar()
+
+def _compact_calculations(keep_days=None, chunk_size=REEVALUATE_CHUNK_SIZE, vacuum=True):
+  """
+  Shrinks the calculation table: drops the calculations older than `keep_days`, moves the rows still stored
+  as `result_json` to the compact columns, merges repeated calculations of a user and reclaims the space.
+  Returns the counts of rows deleted, converted and merged, and the SQLite file size before and after.
+  """
+  stats = {'deleted': 0, 'converted': 0, 'merged': 0, 'bytes_before': _database_bytes(), 'bytes_after': None}
+  if keep_days is not None:
+    cutoff = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(days=keep_days)
+    stats['deleted'] = db.session.execute(delete(Calculation).where(Calculation.timestamp < cutoff)).rowcount
+    db.session.commit()
+  token = pin_registry()
+  try:
+    stats['converted'] = _compact_json_rows(chunk_size)
+  finally:
+    unpin_registry(token)
+  stats['merged'] = _merge_repeated_calculations(chunk_size)
+  if vacuum:
+    # VACUUM can't run inside a transaction
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+      connection.exec_driver_sql('VACUUM')
+  stats['bytes_after'] = _database_bytes()
+  return stats
+
+@bp.cli.command('compact')
+@click.option('--keep-days', type=int, help='Delete the calculations older than this many days.')
+@click.option(
+  '--chunk-size', default=REEVALUATE_CHUNK_SIZE, show_default=True, help='Rows per query and transaction.'
+)
+@click.option('--no-vacuum', is_flag=True, help='Skip the VACUUM reclaiming the freed space.')
+def compact_command(keep_days, chunk_size, no_vacuum):
+  """Shrinks the stored calculations: retention, compact storage of old rows and merged repeats."""
+  stats = _compact_calculations(keep_days, chunk_size, not no_vacuum)
+  click.echo(f"{stats['deleted']} deleted, {stats['converted']} converted, {stats['merged']} merged")
+  if stats['bytes_before'] is not None:
+    click.echo(f"Database size: {stats['bytes_before']:,} -> {stats['bytes_after']:,} bytes")
+
+def __getattr__(name):
+  # `from app import app as application` in the WSGI files written before the factory keeps working,
+  # the app is built on that first access rather than at import
+  if name == 'app':
+    globals()['app'] = create_app()
+    return globals()['app']
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
-  app.run(debug=os.environ.get('FLASK_DEBUG', 'false').lower() == 'true', host='0.0.0.0')
+  create_app().run(debug=os.environ.get('FLASK_DEBUG', 'false').lower() == 'true', host='0.0.0.0')
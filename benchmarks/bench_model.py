@@ -0,0 +1,236 @@
+"""
+Microbenchmarks of the model and config hot paths on fixed-seed corpora.
+
+Every benchmark is timed over several repeats and reported per call. Results can be saved as JSON
+and compared against a previous run, failing when any benchmark got slower than the threshold.
+
+    python benchmarks/bench_model.py --output before.json
+    python benchmarks/bench_model.py --compare before.json --threshold 0.2
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+import config  # noqa: E402
+from model import (  # noqa: E402
+    Income, _compile_profile, alternative_scenarios, compare_scenarios, compile_profile, compute_batch,
+)
+
+SEED = 20231
+CORPUS_SIZE = 1000
+BATCH_SIZES = (1, 100, 10_000, 1_000_000)
+KIDS = (None, "3", "2,5")
+PROPERTIES = (
+    "allowance_excess", "specific_deduction", "taxable_base", "family_quotient",
+    "family_deduction", "income_tax", "solidarity_tax", "social_security_tax",
+)
+
+
+@functools.lru_cache(maxsize=None)
+def make_corpus(size: int, seed: int = SEED) -> list:
+    """Valid `Income` arguments drawn from a fixed seed, the same list on every run and machine."""
+    rng = random.Random(seed)
+    corpus = []
+    while len(corpus) < size:
+        year = rng.choice([2023, 2024, 2025])
+        profile = {
+            "year": year,
+            "income": round(rng.lognormvariate(10.4, 0.7), 2),
+            "residence": rng.choices(["r", "nr", "nhr"], [8, 1, 1])[0],
+            "region": rng.choice(["Mainland", "Madeira", "Azores"]),
+            "status": rng.choice(["single", "joint"]),
+            "kids": rng.choice([None, None, "3", "2,5", "1,4,9"]),
+        }
+        if rng.random() < 0.3:
+            profile["opened_at"] = f"{rng.randint(1, 12):02d}/{rng.randint(year - 2003, year - 2000):02d}"
+            profile["expenses"] = round(rng.uniform(0, 0.1) * profile["income"], 2)
+        else:
+            profile["telework_allowance"] = rng.choice([0, 0, 12 * 30])
+            profile["meal_allowance"] = rng.choice([0, 264 * 8, 264 * 12])
+            profile["meal_type"] = rng.choice(["card", "cash"])
+        try:
+            Income(**profile)
+        except ValueError:
+            continue
+        corpus.append(profile)
+    return corpus
+
+
+@functools.lru_cache(maxsize=None)
+def make_batch(size: int, seed: int = SEED) -> dict:
+    """`compute_batch` columns of `size` Mainland residents in 2025 with fixed-seed incomes."""
+    rng = np.random.default_rng(seed)
+    return {
+        "income": np.round(rng.lognormal(10.4, 0.7, size), 2),
+        "year": 2025,
+        "status": rng.choice(["single", "joint"], size),
+        "kids": rng.choice(["", "3", "2,5"], size),
+    }
+
+
+def setup_over_corpus(run):
+    """Setup of a benchmark timing `run(corpus)`, reported per profile."""
+    def setup():
+        corpus = make_corpus(CORPUS_SIZE)
+        return (lambda: run(corpus)), len(corpus)
+    return setup
+
+
+def setup_progressive_taxation():
+    table = config.get_tax_table(2025, "Mainland")
+    thresholds, rates = list(table.schedule.thresholds), list(table.schedule.rates)
+    incomes = [profile["income"] for profile in make_corpus(CORPUS_SIZE)]
+    return (lambda: [Income.progressive_taxation(income, thresholds, rates) for income in incomes]), len(incomes)
+
+
+def setup_compare_scenarios():
+    corpus = make_corpus(CORPUS_SIZE)
+    alternatives = [
+        alternative_scenarios(p.get("residence", "r"), p.get("status", "single"), p.get("kids")) for p in corpus
+    ]
+    return (lambda: [compare_scenarios(p, s) for p, s in zip(corpus, alternatives)]), len(corpus)
+
+
+def setup_compile_profile():
+    # uncached, the cost of a first request for a profile
+    version = config.get_registry().version
+    return (lambda: [_compile_profile.__wrapped__(version, (("kids", kids), ("year", 2025))) for kids in KIDS]), len(KIDS)
+
+
+def setup_rates_load():
+    # the path of a worker start: hash rates.json and map the snapshot compiled from it
+    if config._load_registry() is None or not os.path.exists(config.SNAPSHOT_PATH):
+        raise RuntimeError(f"no rates snapshot at {config.SNAPSHOT_PATH}, run `python config.py`")
+    return config._load_registry, 1
+
+
+def setup_rates_load_json():
+    # the fallback when the snapshot is missing or stale
+    return (lambda: config.RateRegistry(config.load_tax_data_from_json(config.RATES_PATH))), 1
+
+
+def setup_batch(size: int, compiled: bool):
+    def setup():
+        columns = make_batch(size)
+        if compiled:
+            profile = compile_profile({"year": 2025})
+            return (lambda: profile.evaluate(columns["income"])), 1
+        return (lambda: compute_batch(**columns)), 1
+    return setup
+
+
+def benchmarks() -> dict:
+    """
+    Benchmark name -> setup returning the function timed and the calls it makes per run.
+    The inputs are only built by the setups of the benchmarks that run.
+    """
+    suite = {
+        "income_init": setup_over_corpus(lambda corpus: [Income(**profile) for profile in corpus]),
+        "income_breakdown": setup_over_corpus(lambda corpus: [Income(**profile).breakdown for profile in corpus]),
+        "progressive_taxation": setup_progressive_taxation,
+        "compare_scenarios": setup_compare_scenarios,
+        "compile_profile": setup_compile_profile,
+        "rates_load": setup_rates_load,
+        "rates_load_json": setup_rates_load_json,
+        "rates_lookup": setup_over_corpus(lambda corpus: [config.get_tax_table(p["year"], p["region"]) for p in corpus]),
+    }
+    for name in PROPERTIES:
+        suite[f"property_{name}"] = setup_over_corpus(
+            lambda corpus, name=name: [getattr(Income(**profile), name) for profile in corpus]
+        )
+    for size in BATCH_SIZES:
+        suite[f"compute_batch_{size}"] = setup_batch(size, compiled=False)
+        suite[f"compiled_profile_{size}"] = setup_batch(size, compiled=True)
+    return suite
+
+
+def measure(function, calls: int, min_time: float, repeat: int) -> dict:
+    """Best and median time per call, each repeat running the function for at least `min_time` seconds."""
+    function()  # warm up caches and lazy imports
+    runs = []
+    for _ in range(repeat):
+        loops, start = 0, time.perf_counter()
+        while True:
+            function()
+            loops += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        runs.append(elapsed / (loops * calls))
+    runs.sort()
+    return {"best_us": runs[0] * 1e6, "median_us": runs[len(runs) // 2] * 1e6, "calls": calls}
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "seed": SEED,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Benchmarks whose best time per call grew by more than `threshold` (a fraction) over the baseline."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before and result["best_us"] > before["best_us"] * (1 + threshold):
+            regressions.append((name, before["best_us"], result["best_us"]))
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("-k", "--filter", help="only run the benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5, help="timed repeats per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per repeat")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 for 20%%")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, setup in benchmarks().items():
+        if args.filter and args.filter not in name:
+            continue
+        function, calls = setup()
+        results[name] = measure(function, calls, args.min_time, args.repeat)
+        print(f"{name:>36}: {results[name]['best_us']:12.2f} µs/call  (median {results[name]['median_us']:.2f})")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"meta": metadata(), "results": results}, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline["results"], args.threshold)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before:.2f} -> {after:.2f} µs/call (+{after / before - 1:.0%})")
+        if regressions:
+            return 1
+        print(f"No regression above {args.threshold:.0%} against {baseline['meta'].get('commit')}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+HTTP load test of the web app: starts gunicorn on a temporary SQLite database, registers synthetic users,
+then drives the calculator (POST /), history loads (GET /?load=) and the profile page at a fixed concurrency.
+Reports throughput and p50/p95/p99 latency per route, for every worker class and count asked for.
+
+    python benchmarks/loadtest.py --users 20 --concurrency 8 --duration 20
+    python benchmarks/loadtest.py --worker-class sync gthread --workers 1 2 --threads 4
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED = 20231
+ROUTES = ("calculate", "load", "profile")
+
+
+class Session:
+    """A logged in synthetic user with its own cookies."""
+
+    def __init__(self, base: str, email: str) -> None:
+        self.base = base
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.calculation_ids = []
+        password = "loadtest-password"
+        self.post("/register", {"email": email, "password": password})
+        self.post("/login", {"email": email, "password": password})
+        self.post("/profile", {"residence": "r", "region": "Mainland", "category": "A", "kids": ""})
+
+    def request(self, path: str, data: dict = None) -> bytes:
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        with self.opener.open(self.base + path, body, timeout=60) as response:
+            return response.read()
+
+    def post(self, path: str, data: dict) -> bytes:
+        return self.request(path, data)
+
+    def refresh_history(self) -> None:
+        items = json.loads(self.request("/api/v1/history?limit=20"))["items"]
+        self.calculation_ids = [item["id"] for item in items]
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(directory: str, worker_class: str, workers: int, threads: int) -> tuple:
+    port = free_port()
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{os.path.join(directory, 'loadtest.db')}",
+        "SECRET_KEY": "loadtest",
+    }
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+            "--worker-class", worker_class, "--workers", str(workers), "--threads", str(threads),
+            "--log-level", "warning",
+        ],
+        cwd=ROOT, env=env,
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base + "/login", timeout=1).read()
+            return server, base
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError("gunicorn exited during startup")
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("gunicorn didn't start within 30 seconds")
+
+
+def run(args: argparse.Namespace, worker_class: str, workers: int) -> dict:
+    mix = [args.mix.get(route, 0) for route in ROUTES]
+    # gunicorn turns a sync worker with threads into a gthread one
+    threads = args.threads if worker_class == "gthread" else 1
+    with tempfile.TemporaryDirectory() as directory:
+        server, base = start_server(directory, worker_class, workers, threads)
+        try:
+            rng = random.Random(SEED)
+            sessions = [Session(base, f"user{k}@loadtest.invalid") for k in range(args.users)]
+            # a little history to load
+            for session in sessions:
+                for _ in range(3):
+                    session.post("/", {"year": "2025", "income": str(rng.randrange(15, 150) * 1000)})
+                session.refresh_history()
+
+            latencies = {route: [] for route in ROUTES}
+            errors = {route: 0 for route in ROUTES}
+            lock = threading.Lock()
+            stop_at = time.monotonic() + args.duration
+
+            def drive(index: int) -> None:
+                local = random.Random(SEED + index)
+                while time.monotonic() < stop_at:
+                    session = local.choice(sessions)
+                    route = local.choices(ROUTES, mix)[0]
+                    start = time.perf_counter()
+                    try:
+                        if route == "calculate":
+                            income = local.randrange(15, 150) * 1000
+                            session.post("/", {"year": "2025", "income": str(income), "status": "single"})
+                        elif route == "load":
+                            session.request(f"/?load={local.choice(session.calculation_ids)}")
+                        else:
+                            session.request("/profile")
+                        elapsed = time.perf_counter() - start
+                        with lock:
+                            latencies[route].append(elapsed)
+                    except OSError:
+                        with lock:
+                            errors[route] += 1
+
+            start = time.monotonic()
+            clients = [threading.Thread(target=drive, args=(k,)) for k in range(args.concurrency)]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            elapsed = time.monotonic() - start
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report = {"worker_class": worker_class, "workers": workers, "threads": threads, "routes": {}}
+    total = 0
+    for route in ROUTES:
+        values = sorted(latencies[route])
+        total += len(values)
+        report["routes"][route] = {
+            "requests": len(values),
+            "errors": errors[route],
+            "rps": len(values) / elapsed,
+            **{f"p{q}_ms": percentile(values, q) * 1000 for q in (50, 95, 99)},
+        }
+    report["rps"] = total / elapsed
+    return report
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        route, _, weight = part.partition("=")
+        if route not in ROUTES:
+            raise argparse.ArgumentTypeError(f"unknown route {route!r}, use {', '.join(ROUTES)}")
+        mix[route] = float(weight)
+    return mix
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=20, help="synthetic users registered before the test")
+    parser.add_argument("--concurrency", type=int, default=8, help="client threads sending requests")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load per configuration")
+    parser.add_argument("--mix", type=parse_mix, default="calculate=6,load=3,profile=1", help="route weights")
+    parser.add_argument("--worker-class", nargs="+", default=["sync"], help="gunicorn worker classes to compare")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1], help="gunicorn worker counts to compare")
+    parser.add_argument("--threads", type=int, default=1, help="threads per gthread worker")
+    parser.add_argument("--output", help="save the reports to this JSON file")
+    args = parser.parse_args(argv)
+
+    reports = []
+    for worker_class in args.worker_class:
+        for workers in args.workers:
+            report = run(args, worker_class, workers)
+            reports.append(report)
+            print(f"\n{worker_class} × {workers} (threads {report['threads']}): {report['rps']:.1f} req/s")
+            print(f"{'route':>10} {'req':>7} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+            for route, stats in report["routes"].items():
+                print(
+                    f"{route:>10} {stats['requests']:>7} {stats['errors']:>5} {stats['rps']:>8.1f} "
+                    f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f}"
+                )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(reports, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Concurrency benchmark of the SQLite setup: N writer threads insert calculation-sized rows,
+one transaction per row as the calculator page does, while reader threads keep querying the history.
+
+Runs the same workload on a fresh database with the default connection settings
+and with the pragmas of `database.configure_engine`, and reports throughput and lock errors.
+
+    python benchmarks/sqlite_writers.py --writers 1 4 8 --rows 200
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import configure_engine  # noqa: E402
+
+PAYLOAD = json.dumps({"wages": 50000.0, "income_tax": 8000.0, "alternatives": []} | {f"k{k}": k for k in range(30)})
+
+
+def run(tuned: bool, writers: int, readers: int, rows: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}", pool_size=writers + readers)
+        if tuned:
+            configure_engine(engine)
+        with engine.begin() as connection:
+            connection.execute(text(
+                "CREATE TABLE calculation (id INTEGER PRIMARY KEY, user_id INTEGER, "
+                "timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, income FLOAT, result_json TEXT)"
+            ))
+            connection.execute(text("CREATE INDEX ix_history ON calculation (user_id, timestamp DESC, id DESC)"))
+
+        errors = []
+        done = threading.Event()
+
+        def write(user_id):
+            for k in range(rows):
+                try:
+                    with engine.begin() as connection:
+                        connection.execute(
+                            text("INSERT INTO calculation (user_id, income, result_json) VALUES (:u, :i, :r)"),
+                            {"u": user_id, "i": 1000.0 * k, "r": PAYLOAD},
+                        )
+                except OperationalError as e:
+                    errors.append(str(e.orig))
+
+        def read():
+            while not done.is_set():
+                try:
+                    with engine.connect() as connection:
+                        connection.execute(text(
+                            "SELECT * FROM calculation WHERE user_id = 1 ORDER BY timestamp DESC, id DESC LIMIT 5"
+                        )).fetchall()
+                except OperationalError as e:
+                    errors.append(str(e.orig))
+
+        reader_threads = [threading.Thread(target=read) for _ in range(readers)]
+        writer_threads = [threading.Thread(target=write, args=(k,)) for k in range(writers)]
+        for thread in reader_threads:
+            thread.start()
+        start = time.perf_counter()
+        for thread in writer_threads:
+            thread.start()
+        for thread in writer_threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        for thread in reader_threads:
+            thread.join()
+        with engine.connect() as connection:
+            written = connection.execute(text("SELECT count(*) FROM calculation")).scalar()
+        engine.dispose()
+    return {
+        "setup": "tuned" if tuned else "default",
+        "writers": writers,
+        "rows_per_s": round(written / elapsed),
+        "written": written,
+        "lock_errors": len(errors),
+    }
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 4, 8], help="writer thread counts")
+    parser.add_argument("--readers", type=int, default=2, help="history reader threads")
+    parser.add_argument("--rows", type=int, default=200, help="rows inserted by each writer")
+    args = parser.parse_args(argv)
+
+    print(f"{'setup':>8} {'writers':>8} {'rows/s':>8} {'written':>8} {'errors':>8}")
+    for writers in args.writers:
+        for tuned in (False, True):
+            result = run(tuned, writers, args.readers, args.rows)
+            print(
+                f"{result['setup']:>8} {result['writers']:>8} {result['rows_per_s']:>8} "
+                f"{result['written']:>8} {result['lock_errors']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
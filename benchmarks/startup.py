@@ -0,0 +1,66 @@
+"""
+Cold start measurement: each run is a fresh interpreter that imports the app, builds it with `create_app`
+against an empty SQLite database, then serves a first page and a first calculation.
+
+    python benchmarks/startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter, prints one JSON line of timings in milliseconds
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+client = application.test_client()
+client.get("/login")
+first_request = time.perf_counter()
+client.post("/register", data={"email": "a@b.c", "password": "password"})
+client.post("/login", data={"email": "a@b.c", "password": "password"})
+logged_in = time.perf_counter()
+client.post("/", data={"income": "50000", "year": "2025"})
+calculated = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (first_request - created) * 1000,
+    "first_calculation_ms": (calculated - logged_in) * 1000,
+    "numpy_loaded": "numpy" in sys.modules,
+}))
+"""
+
+
+def run_once() -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{os.path.join(directory, 'startup.db')}"}
+        env.pop("WRITE_BEHIND_DELAY", None)
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to start")
+    args = parser.parse_args(argv)
+
+    runs = [run_once() for _ in range(args.runs)]
+    for key in ("import_ms", "create_app_ms", "first_request_ms", "first_calculation_ms"):
+        values = [run[key] for run in runs]
+        print(f"{key:>22}: median {statistics.median(values):8.1f}  max {max(values):8.1f}")
+    print(f"{'numpy_loaded':>22}: {any(run['numpy_loaded'] for run in runs)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class _Flight:
+    """A computation in progress that the concurrent callers of the same key wait on."""
+
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    """
+    Thread-safe, size-bounded LRU cache of computed results with an optional time to live.
+
+    Concurrent misses on the same key are single-flighted: the first caller computes,
+    the others wait for its result (or its exception) instead of computing it again.
+
+    Args:
+        maxsize (int): Number of results kept, the least recently used ones are evicted first.
+            Zero disables caching but keeps the single-flight.
+        ttl (float | None): Seconds a result stays valid, forever if None.
+        clock (Callable): Monotonic time source, for tests.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None, clock: Callable = time.monotonic) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expiry or None, value)
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Returns the cached result for `key`, calling `compute` on a miss.
+
+        Args:
+            key (Hashable): Normalized inputs the result depends on.
+            compute (Callable): Produces the result, its exceptions are raised to every waiting caller
+                and nothing is cached.
+
+        Returns:
+            Any: The result, shared between callers, so it must not be mutated.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expiry, value = entry
+                if expiry is None or expiry > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.error is None:
+                    self._store(key, flight.value)
+            flight.done.set()
+        return flight.value
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        expiry = None if self.ttl is None else self._clock() + self.ttl
+        self._entries[key] = (expiry, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Drops every cached result, the counters are kept."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Size, capacity and the hit/miss/eviction counters since start.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -1,46 +1,435 @@
+import hashlib
 import json
+import mmap
 import os
-from typing import Any
+import struct
+import sys
+import threading
+import zlib
+from contextvars import ContextVar, Token
+from types import MappingProxyType
+from typing import Any, NamedTuple
 
 _DIR = os.path.dirname(os.path.abspath(__file__))
+RATES_PATH = os.path.join(_DIR, "rates.json")
+# Compiled from rates.json by `python config.py` at build time, or on the first load otherwise
+SNAPSHOT_PATH = os.path.join(_DIR, "rates.bin")
 
 # Tax brackets are always the same between the regions
 # However progressive rates are different -> store them separately
 
+_ALLOWANCES_FALLBACK = MappingProxyType(
+    {"meal_cash_daily": 6.00, "meal_card_daily": 10.20, "telework_daily": 1.00}
+)
+_ALLOWANCE_KEYS = tuple(_ALLOWANCES_FALLBACK)
+
+# Snapshot layout, little-endian: header, then per year its allowances and regions,
+# per region its name, IAS and the thresholds, rates and cumulative taxes of its schedule
+_SNAPSHOT_MAGIC = b"PTRATES1"
+_SNAPSHOT_HEADER = struct.Struct("<8s32s16sI")  # magic, sha256 of rates.json, registry version, crc32 of the rest
+_SNAPSHOT_YEAR = struct.Struct("<H3dH")  # year, allowances in _ALLOWANCE_KEYS order, number of regions
+_SNAPSHOT_REGION = struct.Struct("<BdH")  # name length, ias, number of thresholds
+
+
+class Schedule(NamedTuple):
+    """
+    Progressive schedule compiled once from a list of thresholds and rates.
+
+    Attributes:
+        thresholds (tuple): Upper bounds of every bracket but the last one.
+        rates (tuple): rates[i] applies between thresholds[i - 1] and thresholds[i].
+        cumulative (tuple): cumulative[i] is the tax due on exactly thresholds[i - 1],
+            cumulative[0] is always zero.
+    """
+    thresholds: tuple
+    rates: tuple
+    cumulative: tuple
+
+
+class TaxTable(NamedTuple):
+    """
+    Immutable IRS table for a single fiscal year and region.
+
+    Attributes:
+        year (int): The tax year.
+        region (str): The geographical region.
+        schedule (Schedule): Compiled progressive IRS brackets.
+        ias (float): Indexante de Apoios Sociais for the year.
+        allowances (MappingProxyType): Daily IRS/SS-exempt allowance limits.
+    """
+    year: int
+    region: str
+    schedule: Schedule
+    ias: float
+    allowances: MappingProxyType
+
+
+def compile_schedule(thresholds: list, rates: list) -> Schedule:
+    """
+    Precomputes the tax accumulated at every bracket boundary.
+
+    The running sum is built in the same order the brackets are applied,
+    so evaluating a schedule gives bit-identical results to summing the brackets.
+
+    Args:
+        thresholds (list): Bracket upper bounds in ascending order.
+        rates (list): One rate per bracket, i.e. len(thresholds) + 1 values.
+
+    Returns:
+        Schedule: The compiled schedule.
+    """
+    if len(rates) != len(thresholds) + 1:
+        raise ValueError("A progressive schedule needs exactly one rate more than thresholds")
+    cumulative = [0]
+    lower = 0
+    for threshold, rate in zip(thresholds, rates):
+        cumulative.append(cumulative[-1] + (threshold - lower) * rate)
+        lower = threshold
+    return Schedule(tuple(thresholds), tuple(rates), tuple(cumulative))
+
+
+class RateRegistry:
+    """
+    Every rate table from a parsed rates file, compiled once.
+
+    Args:
+        tax_data (dict): The decoded content of `rates.json`.
+
+    Attributes:
+        version (str): Short content hash of the rates, changes whenever any rate does.
+    """
+
+    def __init__(self, tax_data: dict) -> None:
+        self.version = hashlib.sha256(
+            json.dumps(tax_data, sort_keys=True).encode()
+        ).hexdigest()[:16]
+        tables = {}
+        allowances = {}
+        for year_str, year_data in tax_data.items():
+            year = int(year_str)
+            allowances[year] = MappingProxyType(
+                dict(year_data.get("allowances", _ALLOWANCES_FALLBACK))
+            )
+            for region, region_data in year_data.items():
+                if region == "allowances":
+                    continue
+                tables[(year, region)] = TaxTable(
+                    year=year,
+                    region=region,
+                    schedule=compile_schedule(region_data["brackets"], region_data["rates"]),
+                    ias=region_data["ias"],
+                    allowances=allowances[year],
+                )
+        self.tables = MappingProxyType(tables)
+        self.allowances = MappingProxyType(allowances)
+
+    @classmethod
+    def from_tables(cls, version: str, tables: dict, allowances: dict) -> "RateRegistry":
+        """Builds a registry from tables that are already compiled, e.g. read from a snapshot."""
+        registry = cls.__new__(cls)
+        registry.version = version
+        registry.tables = MappingProxyType(tables)
+        registry.allowances = MappingProxyType(allowances)
+        return registry
+
+    def table(self, year: int, region: str) -> TaxTable | None:
+        return self.tables.get((int(year), region))
+
+    def allowance_limits(self, year: int) -> MappingProxyType:
+        return self.allowances.get(int(year), _ALLOWANCES_FALLBACK)
+
+
+_registry: RateRegistry | None = None
+_registry_stamp: tuple | None = None  # mtime and size of the rates file it was loaded from
+_registry_lock = threading.Lock()
+# The registry a request started with, so that it finishes on the same version across a reload
+_pinned_registry: ContextVar[RateRegistry | None] = ContextVar("rates", default=None)
+
 
 def load_tax_data_from_json(file_path: str) -> Any | None:
     """
     Loads tax data from a JSON file.
-    
+
     Args:
         file_path (str): The path to the JSON file.
-    
+
     Returns:
         dict: A dictionary containing the tax data.
     """
     try:
-        with open(file_path, "r") as file:
-            tax_data_json = json.load(file)
-        return tax_data_json
+        with open(file_path, "rb") as file:
+            source = file.read()
     except FileNotFoundError:
         print(f"Error: The file '{file_path}' was not found.")
         return None
-    except json.JSONDecodeError:
+    return decode_tax_data(source)
+
+
+def decode_tax_data(source: bytes) -> Any | None:
+    """
+    Decodes tax data already read from a JSON file.
+
+    Args:
+        source (bytes): The contents of the JSON file.
+
+    Returns:
+        dict: A dictionary containing the tax data.
+    """
+    try:
+        return json.loads(source)
+    except (json.JSONDecodeError, UnicodeDecodeError):
         print(f"Error: Failed to decode the JSON file. Please check for syntax errors.")
         return None
 
 
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_tax_data(tax_data) -> None:
+    """
+    Checks the shape of the decoded `rates.json` before anything is compiled from it.
+
+    Args:
+        tax_data: The decoded content of `rates.json`.
+
+    Raises:
+        ValueError: Listing every problem found, one per line.
+    """
+    problems = []
+    if not isinstance(tax_data, dict):
+        raise ValueError("rates.json must be an object keyed by year")
+    for year, year_data in tax_data.items():
+        if not year.isdigit():
+            problems.append(f"{year}: the keys must be years")
+            continue
+        if not isinstance(year_data, dict):
+            problems.append(f"{year}: must be an object keyed by region")
+            continue
+        for region, data in year_data.items():
+            where = f"{year}/{region}"
+            if region == "allowances":
+                if not isinstance(data, dict) or set(data) != set(_ALLOWANCE_KEYS):
+                    problems.append(f"{where}: must hold exactly {', '.join(_ALLOWANCE_KEYS)}")
+                elif not all(_is_number(value) and value >= 0 for value in data.values()):
+                    problems.append(f"{where}: the limits must be non-negative numbers")
+                continue
+            if not isinstance(data, dict) or not {"brackets", "rates", "ias"} <= set(data):
+                problems.append(f"{where}: must hold brackets, rates and ias")
+                continue
+            brackets, rates = data["brackets"], data["rates"]
+            if not isinstance(brackets, list) or not all(_is_number(value) for value in brackets):
+                problems.append(f"{where}: brackets must be a list of numbers")
+            elif any(upper <= lower for lower, upper in zip([0] + brackets, brackets)):
+                problems.append(f"{where}: brackets must be positive and increasing")
+            if not isinstance(rates, list) or not all(_is_number(value) and 0 <= value < 1 for value in rates):
+                problems.append(f"{where}: rates must be a list of fractions between 0 and 1")
+            elif isinstance(brackets, list) and len(rates) != len(brackets) + 1:
+                problems.append(f"{where}: rates must have exactly one value more than brackets")
+            if not _is_number(data["ias"]) or data["ias"] <= 0:
+                problems.append(f"{where}: ias must be a positive number")
+    if problems:
+        raise ValueError("Invalid rates.json:\n" + "\n".join(problems))
+
+
+def write_snapshot(registry: RateRegistry, source: bytes, path: str = SNAPSHOT_PATH) -> None:
+    """
+    Writes the compiled tables of a registry to a binary snapshot, replacing any previous one atomically.
+
+    Args:
+        registry (RateRegistry): Registry compiled from `source`.
+        source (bytes): The raw content of `rates.json`, the snapshot is only valid for it.
+        path (str): Where to write the snapshot.
+    """
+    body = [struct.pack("<H", len(registry.allowances))]
+    for year, allowances in registry.allowances.items():
+        regions = [table for (table_year, _), table in registry.tables.items() if table_year == year]
+        body.append(_SNAPSHOT_YEAR.pack(year, *(allowances[key] for key in _ALLOWANCE_KEYS), len(regions)))
+        for table in regions:
+            name = table.region.encode()
+            schedule = table.schedule
+            count = len(schedule.thresholds)
+            body.append(_SNAPSHOT_REGION.pack(len(name), table.ias, count))
+            body.append(name)
+            body.append(struct.pack(f"<{3 * count + 2}d", *schedule.thresholds, *schedule.rates, *schedule.cumulative))
+    body = b"".join(body)
+    header = _SNAPSHOT_HEADER.pack(
+        _SNAPSHOT_MAGIC, hashlib.sha256(source).digest(), registry.version.encode(), zlib.crc32(body)
+    )
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(header + body)
+    os.replace(temporary, path)
+
+
+def read_snapshot(source: bytes, path: str = SNAPSHOT_PATH) -> RateRegistry | None:
+    """
+    Loads a registry from a binary snapshot without decoding any JSON.
+    The file is memory-mapped, so workers reading the same snapshot share its pages.
+
+    Args:
+        source (bytes): The raw content of `rates.json` the snapshot must have been built from.
+        path (str): The snapshot to read.
+
+    Returns:
+        RateRegistry: The registry, or None when the snapshot is missing, corrupt or built from other rates.
+    """
+    try:
+        with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, checksum, version, crc = _SNAPSHOT_HEADER.unpack_from(data)
+            if (
+                magic != _SNAPSHOT_MAGIC
+                or checksum != hashlib.sha256(source).digest()
+                or crc != zlib.crc32(data[_SNAPSHOT_HEADER.size:])
+            ):
+                return None
+            offset = _SNAPSHOT_HEADER.size
+            (years,) = struct.unpack_from("<H", data, offset)
+            offset += 2
+            tables, allowances = {}, {}
+            for _ in range(years):
+                year, *limits, regions = _SNAPSHOT_YEAR.unpack_from(data, offset)
+                offset += _SNAPSHOT_YEAR.size
+                allowances[year] = MappingProxyType(dict(zip(_ALLOWANCE_KEYS, limits)))
+                for _ in range(regions):
+                    length, ias, count = _SNAPSHOT_REGION.unpack_from(data, offset)
+                    offset += _SNAPSHOT_REGION.size
+                    region = data[offset:offset + length].decode()
+                    offset += length
+                    values = struct.unpack_from(f"<{3 * count + 2}d", data, offset)
+                    offset += 8 * len(values)
+                    schedule = Schedule(values[:count], values[count:2 * count + 1], values[2 * count + 1:])
+                    tables[(year, region)] = TaxTable(year, region, schedule, ias, allowances[year])
+    except (OSError, ValueError, struct.error):
+        return None
+    return RateRegistry.from_tables(version.decode(), tables, allowances)
+
+
+def _load_registry() -> RateRegistry | None:
+    """
+    Reads the registry from the snapshot when it matches `rates.json`, otherwise parses and validates
+    the JSON and writes a fresh snapshot for the next process. None when `rates.json` can't be read.
+    """
+    try:
+        with open(RATES_PATH, "rb") as file:
+            source = file.read()
+    except OSError:
+        print(f"Error: The file '{RATES_PATH}' was not found.")
+        return None
+    registry = read_snapshot(source, SNAPSHOT_PATH)
+    if registry is not None:
+        return registry
+    # the same bytes the snapshot is keyed on, so that a concurrent edit can't get the old hash
+    tax_data = decode_tax_data(source)
+    if tax_data is None:
+        return None
+    validate_tax_data(tax_data)
+    registry = RateRegistry(tax_data)
+    try:
+        write_snapshot(registry, source, SNAPSHOT_PATH)
+    except OSError:
+        pass  # e.g. a read-only file system, the JSON is parsed by every process then
+    return registry
+
+
+def _rates_stamp() -> tuple | None:
+    try:
+        stat = os.stat(RATES_PATH)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_registry() -> RateRegistry:
+    """
+    Returns the rate registry pinned to the current request if any, otherwise the process-wide one,
+    parsing `rates.json` on first use only.
+    """
+    global _registry, _registry_stamp
+    pinned = _pinned_registry.get()
+    if pinned is not None:
+        return pinned
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry_stamp = _rates_stamp()
+                _registry = _load_registry() or RateRegistry({})
+    return _registry
+
+
+def reload_registry(force: bool = False) -> RateRegistry | None:
+    """
+    Replaces the process-wide registry when `rates.json` changed since it was loaded.
+
+    The file is only loaded again when its modification time or size changed, or when forced
+    (e.g. right after a deploy), and the registry is only replaced when the content hash differs.
+    The swap is a single reference assignment: requests pinned to the previous registry finish on it.
+    A file that can't be read, parsed or validated leaves the current registry in place.
+
+    Args:
+        force (bool): Parse the file even if it looks unchanged.
+
+    Returns:
+        RateRegistry: The new registry if one with a new version was swapped in, otherwise None.
+    """
+    global _registry, _registry_stamp
+    with _registry_lock:
+        stamp = _rates_stamp()
+        if not force and _registry is not None and stamp == _registry_stamp:
+            return None
+        try:
+            registry = _load_registry()
+        except ValueError as e:
+            print(f"Error: {e}")
+            return None
+        if not registry or not registry.tables:
+            return None
+        _registry_stamp = stamp
+        if _registry is not None and registry.version == _registry.version:
+            return None
+        _registry = registry
+        return registry
+
+
+def pin_registry() -> Token:
+    """
+    Makes `get_registry` return the current registry in this context until `unpin_registry`,
+    so that a calculation started before a reload doesn't mix rates of two versions.
+
+    Returns:
+        Token: To pass to `unpin_registry`.
+    """
+    return _pinned_registry.set(get_registry())
+
+
+def unpin_registry(token: Token) -> None:
+    _pinned_registry.reset(token)
+
+
+def get_tax_table(year: int, region: str) -> TaxTable | None:
+    """
+    Retrieves the compiled tax table for a given year and region.
+
+    Args:
+        year (int): The tax year (e.g., 2023, 2024, 2025).
+        region (Region): The geographical region (e.g., 'Madeira').
+
+    Returns:
+        TaxTable: The compiled brackets, IAS and allowance limits.
+                  Returns None if the data is not found.
+    """
+    table = get_registry().table(year, region)
+    if table is None:
+        print(f"Error: No tax data found for year {year} and region {region}.")
+    return table
+
+
 def get_allowance_limits(year: int) -> dict:
     """
     Returns the daily IRS/SS-exempt limits for meal and telework allowances for the given year.
     Both IRS and Social Security share the same thresholds.
     """
-    _FALLBACK = {"meal_cash_daily": 6.00, "meal_card_daily": 10.20, "telework_daily": 1.00}
-    tax_data = load_tax_data_from_json(os.path.join(_DIR, "rates.json"))
-    year_str = str(year)
-    if tax_data and year_str in tax_data and "allowances" in tax_data[year_str]:
-        return tax_data[year_str]["allowances"]
-    return _FALLBACK
+    return dict(get_registry().allowance_limits(year))
 
 
 def get_tax_data(year: int, region: str) -> Any | None:
@@ -55,10 +444,30 @@ def get_tax_data(year: int, region: str) -> Any | None:
         dict: A dictionary containing the tax brackets, rates, and IAS value.
               Returns None if the data is not found.
     """
-    year = str(year)
-    tax_data = load_tax_data_from_json(os.path.join(_DIR, "rates.json"))
-    if tax_data and year in tax_data and region in tax_data[year]:
-        return tax_data[year][region]
-    else:
-        print(f"Error: No tax data found for year {year} and region {region}.")
-        return None
\ No newline at end of file
+    table = get_tax_table(year, region)
+    if table is None:
+        return None
+    return {
+        "brackets": list(table.schedule.thresholds),
+        "rates": list(table.schedule.rates),
+        "ias": table.ias,
+    }
+
+
+if __name__ == "__main__":
+    # Build step: validates rates.json and compiles it into the snapshot the workers load
+    try:
+        with open(RATES_PATH, "rb") as file:
+            source = file.read()
+    except OSError as e:
+        sys.exit(f"Error: {e}")
+    tax_data = decode_tax_data(source)
+    if tax_data is None:
+        sys.exit(1)
+    try:
+        validate_tax_data(tax_data)
+    except ValueError as e:
+        sys.exit(str(e))
+    registry = RateRegistry(tax_data)
+    write_snapshot(registry, source)
+    print(f"Wrote {SNAPSHOT_PATH} for rates version {registry.version}")
@@ -0,0 +1,52 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+# Applied to every new SQLite connection:
+# WAL lets readers run next to the writer, the busy timeout makes writers queue instead of failing
+# with "database is locked", and NORMAL synchronous only fsyncs the WAL at checkpoints
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)),
+    "synchronous": "NORMAL",
+    "cache_size": -16000,  # KiB, i.e. 16 MB per connection
+}
+
+
+def engine_options(url: str) -> dict:
+    """
+    SQLAlchemy engine options for a database URL.
+
+    Args:
+        url (str): The database URL.
+
+    Returns:
+        dict: Pooling options for Postgres, nothing for the other backends.
+    """
+    if make_url(url).get_backend_name() != "postgresql":
+        return {}
+    return {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_pre_ping": True,
+        "pool_recycle": 1800,
+    }
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def configure_engine(engine: Engine) -> None:
+    """
+    Hooks the connection pragmas into a SQLite engine, before it opens its first connection.
+
+    Args:
+        engine (Engine): The engine, other backends are left as they are.
+    """
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _set_sqlite_pragmas)
@@ -0,0 +1,16 @@
+"""Gunicorn settings, picked up by `gunicorn -c gunicorn.conf.py` (see the Dockerfile)."""
+import os
+
+wsgi_app = "app:create_app()"
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+# Build the app, its schema and the rate tables once in the master,
+# the workers are forked with them already in memory (copy-on-write)
+preload_app = True
+
+
+def post_fork(server, worker):
+    # connections opened by the schema setup in the master can't be shared with the workers
+    from app import db
+
+    with server.app.wsgi().app_context():
+        db.engine.dispose(close=False)
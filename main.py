@@ -1,6 +1,29 @@
 import argparse
+import csv
+import functools
+import io
+import itertools
+import json
+import os
+import sys
 
-from model import Income
+from model import Income, batch_columns, compute_batch, gross_for_net, map_batches
+
+# Columns of a --batch file, named as the `Income` arguments
+BATCH_FIELDS = {
+    "income": float,
+    "year": int,
+    "residence": str,
+    "region": str,
+    "opened_at": str,
+    "expenses": float,
+    "status": str,
+    "kids": str,
+    "telework_allowance": float,
+    "meal_allowance": float,
+    "meal_type": str,
+}
+BATCH_OUTPUT = ["income_tax", "social_security", "solidarity_tax", "total_tax", "net_income"]
 
 parser = argparse.ArgumentParser(
     description="Portugal net income calculator (valid for 2023-2025)"
@@ -9,11 +32,21 @@ parser = argparse.ArgumentParser(
 parser.add_argument(
     "income",
     action="store",
+    nargs="?",
     help="gross annual income",
     metavar="<income>",
     type=float,
 )
 
+parser.add_argument(
+    "-t",
+    "--target-net",
+    action="store",
+    help="find the gross annual income that results in this monthly net salary",
+    metavar="<monthly net>",
+    type=float,
+)
+
 parser.add_argument(
     "-y",
     "--year",
@@ -24,6 +57,13 @@ parser.add_argument(
     default=2023,
 )
 
+parser.add_argument(
+    "-x",
+    "--explain",
+    action="store_true",
+    help="also print every step of the calculation with its value and time",
+)
+
 residence_group = parser.add_argument_group("residence options", "what kind of a residence status you have")
 residence_exclusive_group = residence_group.add_mutually_exclusive_group(required=False)
 
@@ -54,7 +94,8 @@ residence_exclusive_group.add_argument(
 )
 
 category_group = parser.add_argument_group("income categories", "what is the income category: A or B")
-category_exclusive_group = category_group.add_mutually_exclusive_group(required=True)
+# required unless the rows of a --batch file say it
+category_exclusive_group = category_group.add_mutually_exclusive_group(required=False)
 
 category_exclusive_group.add_argument(
     "-a",
@@ -81,6 +122,33 @@ category_group.add_argument(
     default=0,
 )
 
+batch_group = parser.add_argument_group("batch mode", "calculate every row of a CSV or JSON lines file")
+
+batch_group.add_argument(
+    "--batch",
+    action="store",
+    help="file with one taxpayer per row, `-` to read from stdin; the other options are used as defaults",
+    metavar="<file>",
+)
+
+batch_group.add_argument(
+    "--chunk-size",
+    action="store",
+    help="number of rows calculated at once",
+    metavar="<rows>",
+    type=int,
+    default=10_000,
+)
+
+batch_group.add_argument(
+    "--workers",
+    action="store",
+    help="number of processes calculating the chunks, 0 for one per CPU",
+    metavar="<processes>",
+    type=int,
+    default=1,
+)
+
 status_group = parser.add_argument_group("civil status", "is it a single or a joint delacration")
 
 status_group.add_argument(
@@ -99,13 +167,11 @@ status_group.add_argument(
     type=str,
 )
 
-args = parser.parse_args()
-
-if __name__ == "__main__":
 
+def profile_from_args(args: argparse.Namespace) -> dict:
+    """`Income` arguments other than the income given by the command line options."""
     kwargs = {
         "year": args.year,
-        "income": args.income,
         "opened_at": args.independent_worker,
         "expenses": args.activity_expenses,
         "status": 'joint' if args.joint else 'single',
@@ -119,15 +185,107 @@ if __name__ == "__main__":
         kwargs["region"] = args.non_habitual
     elif args.residence:
         kwargs["region"] = args.residence
+    return kwargs
+
+
+def read_rows(stream) -> iter:
+    """Yields every row of a CSV file with a header or of a JSON lines file as a dict."""
+    lines = (line for line in stream if line.strip())
+    first = next(lines, None)
+    if first is None:
+        return
+    lines = itertools.chain([first], lines)
+    if first.lstrip().startswith("{"):
+        for line in lines:
+            yield json.loads(line)
+    else:
+        for row in csv.DictReader(lines):
+            yield {key: value for key, value in row.items() if value not in ("", None)}
+
+
+def calculate_chunk(chunk: tuple, defaults: dict) -> str:
+    """
+    Calculates a chunk of rows numbered from `start` and returns its CSV lines.
+    Runs in the worker processes, so that parsing and formatting scale with them too.
+    """
+    start, rows = chunk
+    try:
+        # a field missing from a row falls back to the command line, then to the `Income` default,
+        # unknown fields are passed as they are for `batch_columns` to reject
+        columns = batch_columns(
+            [
+                {field: BATCH_FIELDS[field](value) if field in BATCH_FIELDS else value
+                 for field, value in row.items() if value is not None}
+                for row in rows
+            ],
+            defaults,
+        )
+        result = compute_batch(**columns)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"rows {start}-{start + len(rows) - 1}: {e}")
+    out = io.StringIO()
+    output = [columns["income"]] + [result[key] for key in BATCH_OUTPUT]
+    csv.writer(out, lineterminator="\n").writerows(
+        zip(*[[f"{value:.2f}" for value in column] for column in output])
+    )
+    return out.getvalue()
+
+
+def run_batch(rows: iter, defaults: dict, chunk_size: int, out, workers: int = 1) -> None:
+    """
+    Calculates the rows in chunks of fixed size and writes a CSV line per row as soon as its chunk is done,
+    so that memory stays bounded whatever the number of rows. The output keeps the input order.
+    """
+    out.write(",".join(["income"] + BATCH_OUTPUT) + "\n")
+    # (number of the first row, rows) until the rows run out
+    chunks = zip(itertools.count(1, chunk_size), iter(lambda: list(itertools.islice(rows, chunk_size)), []))
+    for lines in map_batches(functools.partial(calculate_chunk, defaults=defaults), chunks, workers):
+        out.write(lines)
+        out.flush()
+
+
+def main(argv: list = None) -> None:
+    args = parser.parse_args(argv)
+
+    if args.batch:
+        if args.chunk_size < 1:
+            parser.error("--chunk-size must be at least 1")
+        defaults = {key: value for key, value in profile_from_args(args).items() if value is not None}
+        stream = sys.stdin if args.batch == "-" else open(args.batch, newline="")
+        try:
+            workers = args.workers or os.cpu_count()
+            run_batch(read_rows(stream), defaults, args.chunk_size, sys.stdout, workers)
+        except ValueError as e:
+            parser.error(str(e))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        return
+
+    if (args.income is None) == (args.target_net is None):
+        parser.error("specify either the gross annual <income> or --target-net")
+    if not (args.regular_employee or args.independent_worker):
+        parser.error("one of the arguments -a/--regular-employee -b/--independent-worker is required")
+
+    kwargs = profile_from_args(args)
+
+    if args.target_net is not None:
+        try:
+            kwargs["income"] = gross_for_net(kwargs, args.target_net * 12)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        kwargs["income"] = args.income
 
     income = Income(**kwargs)
 
     print(f"\n{income}\n")
 
-    i = income.income
-    it = income.income_tax
-    sst = income.social_security_tax
-    st = income.solidarity_tax
+    breakdown = income.breakdown
+    i = breakdown.income
+    it = breakdown.income_tax
+    sst = breakdown.social_security_tax
+    st = breakdown.solidarity_tax
 
     print(f"Wages:{i:30,.2f}€")
     print(f"\nPersonal Income Tax:{it:15,.2f}€")
@@ -137,3 +295,10 @@ if __name__ == "__main__":
     print(f"\nTotal Tax:{it + sst + st:25,.2f}€")
     print(f"Effective Rate:{(it + sst + st)/i:21.2%}")
     print(f"\nMonthly Net Salary:{(i - (it + sst + st))/12:16,.2f}€")
+
+    if args.explain:
+        print(f"\n{income.explain()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable
+
+# Upper bounds in seconds of the latency histogram buckets, +Inf is implicit
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Phase durations of the current request, None when timing is off
+_timings = contextvars.ContextVar("timings", default=None)
+
+
+@contextmanager
+def timed(phase: str):
+    """
+    Adds the time spent in the block to a phase of the current request.
+    Outside of a timed request it does nothing, so call sites can stay in place when metrics are disabled.
+
+    Args:
+        phase (str): Phase name, a block running several times per request accumulates.
+    """
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+
+
+def add_time(phase: str, seconds: float) -> None:
+    """Adds a duration measured elsewhere (e.g. by a database hook) to a phase of the current request."""
+    timings = _timings.get()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+def start_timing() -> contextvars.Token:
+    """Starts collecting phases for the current request, returns the token for `stop_timing`."""
+    return _timings.set({})
+
+
+def stop_timing(token: contextvars.Token) -> dict:
+    """
+    Returns:
+        dict: Seconds spent in every phase since `start_timing`.
+    """
+    timings = _timings.get() or {}
+    _timings.reset(token)
+    return timings
+
+
+def server_timing(timings: dict, total: float) -> str:
+    """
+    Args:
+        timings (dict): Seconds per phase.
+        total (float): Seconds for the whole request.
+
+    Returns:
+        str: The value of a `Server-Timing` header, in milliseconds.
+    """
+    entries = [f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Registry:
+    """
+    Thread-safe counters and latency histograms, rendered in the Prometheus text format.
+    Per process: with several gunicorn workers each one serves its own numbers.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name: str, kind: str, text: str) -> None:
+        self._help[name] = (kind, text)
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+            histogram[bisect_left(BUCKETS, seconds)] += 1
+            histogram[-1] += seconds
+
+    def collector(self, collect: Callable[[], list]) -> Callable[[], list]:
+        """
+        Registers a function read at every scrape, returning (name, kind, help, value, labels dict) tuples,
+        for values that are kept elsewhere such as the cache counters. Usable as a decorator.
+        """
+        self._collectors.append(collect)
+        return collect
+
+    def render(self) -> str:
+        lines = []
+        described = set()
+
+        def header(name, kind=None, text=None):
+            if name in described:
+                return
+            described.add(name)
+            kind, text = self._help.get(name, (kind, text))
+            if text:
+                lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind or 'untyped'}")
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(value)) for key, value in self._histograms.items())
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value:g}")
+        for (name, labels), histogram in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), histogram):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram[-1]:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        for collect in self._collectors:
+            for name, kind, text, value, labels in collect():
+                header(name, kind, text)
+                lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value:g}")
+        return "\n".join(lines) + "\n"
@@ -1,8 +1,255 @@
+from __future__ import annotations
+
+from bisect import bisect_right
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
 from datetime import datetime
+from functools import cached_property, lru_cache
+from inspect import signature
+from time import perf_counter
+from typing import TYPE_CHECKING, Iterator, NamedTuple
+
+# NumPy is imported by the vectorized functions only, the scalar `Income` starts without it
+if TYPE_CHECKING:
+    import numpy as np
+
+from config import compile_schedule, get_registry, pin_registry, unpin_registry
+
+WORKING_DAYS = 264 # 22 days × 12 months
+SOLIDARITY_THRESHOLDS = [75000, 80000, 200000, 300000]
+SOLIDARITY_RATES = [0, 0.40, 0.025, 0.10, 0.05]
+_SOLIDARITY_SCHEDULE = compile_schedule(SOLIDARITY_THRESHOLDS, SOLIDARITY_RATES)
+
+
+def _parse_opened_at(opened_at: str, year: int) -> datetime:
+    try:
+        opened = datetime.strptime(opened_at, '%m/%y')
+    except ValueError:
+        raise ValueError(
+        "Incorrect activity opened month or expenses format, "
+        "should be a date in `mm/yy` and a float value respectively"
+    )
+    if opened.year > year:
+        raise ValueError(
+            "The taxes can't be estimated for the year prior to when the activity was opened. "
+            "Consider the following years or adjust your income category"
+        )
+    return opened
+
+
+def _parse_kids(kids: str) -> list | None:
+    if not kids:
+        return None
+    try:
+        return [int(age.strip()) for age in kids.split(',')]
+    except ValueError:
+        raise ValueError(
+        "Incorrect format of children ages provided, "
+        "should be integer numbers for the end of the year separated by a comma without spaces. "
+        "Example: '3,10,1'"
+    )
+
+
+def _extra_discount(opened: datetime, year: int) -> float:
+    # first two years of atividade with discount
+    return 0.5 if opened.year == year else 0.25 if opened.year == year - 1 else 0
+
+
+def _social_security_months(opened: datetime, year: int) -> tuple:
+    """Returns the months invoiced and the months paid at the fixed rate before the first declaration."""
+    tax_year_end_at = datetime.strptime(f"01/{1 + year % 100}", '%m/%y')
+    months_since_opened = tax_year_end_at.month - opened.month + 12 * (tax_year_end_at.year - opened.year)
+    # first 12 months after opening the social security is not paid
+    # then until the beginning of the new quarter it's fixed - 20€
+    # as there is no income yet declared in a quarterly decalration
+    months_to_first_declaration = 3 - (opened.month - 1) % 3
+    invoiced_months = min(12, max(0, months_since_opened - 12 - months_to_first_declaration))
+    return invoiced_months, months_to_first_declaration
+
+
+def _schedule_tax(income: float, schedule) -> float:
+    """
+    Scalar progressive tax over a compiled schedule: one bisection, no array allocation.
+    Rounds the way `np.round` does (scale, round half to even, unscale) to stay bit-identical with the batch engine.
+    """
+    index = bisect_right(schedule.thresholds, income)
+    lower = schedule.thresholds[index - 1] if index else 0
+    return round((schedule.cumulative[index] + schedule.rates[index] * (income - lower)) * 100) / 100
+
+
+def _family_quotient(status: str, ages: list | None) -> float:
+    quote = 1
+    if status == 'single':
+        return quote
+    else:
+        # joint declaration
+        quote += 1
+    # and extra for kids
+    if ages is not None:
+        # 0.5 for the first
+        quote += 0.25
+        for age in ages:
+            # 0.25 for others
+            quote += 0.25
+    return quote
+
+
+def _family_deduction(status: str, ages: list | None) -> float:
+    if ages is None:
+        return 0
+    # every dependent adds 600 euros
+    expenses = 600 * len(ages)
+    # every children under 3 get extra 126 euros
+    for age in ages:
+        if age <= 3:
+            expenses += 126
+    # the second and subsequent children under 6 get extra 300 euros
+    for age in sorted(ages)[1:]:
+        if age <= 6:
+            expenses += 300
+    # if a family submit separate declarations
+    # choldren deducations are divided equally
+    if status == 'single':
+        expenses /= 2
+    return expenses
+
+
+class TraceStep(NamedTuple):
+    """A step of a traced calculation."""
+    taxpayer: int
+    name: str
+    value: float
+    seconds: float
+    depth: int
+    shared: bool
+
+
+class Trace:
+    """
+    Every step evaluated by the `Income` calculations run inside `tracing`, in evaluation order.
+
+    Steps reused from the taxpayer a variant evolved from are listed as shared, with no time.
+    Nested steps (the progressive taxation inside the income tax) have a greater depth
+    and their time is included in their parent's.
+    """
+
+    def __init__(self) -> None:
+        self.steps = []
+        self._taxpayers = {}
+        self._depth = 0
+
+    def _taxpayer(self, income: Income) -> int:
+        # holds the taxpayer too, so that its id can't be reused by a later one
+        return self._taxpayers.setdefault(id(income), (len(self._taxpayers), income))[0]
+
+    def record(self, income: Income, name: str, compute, *args) -> float:
+        index = len(self.steps)
+        self.steps.append(None)  # the parent is listed before the steps nested in it
+        self._depth += 1
+        start = perf_counter()
+        try:
+            value = compute(*args)
+        except BaseException:
+            del self.steps[index:]
+            raise
+        finally:
+            self._depth -= 1
+        self.steps[index] = TraceStep(self._taxpayer(income), name, value, perf_counter() - start, self._depth, False)
+        return value
+
+    def reuse(self, income: Income, name: str, value: float) -> None:
+        self.steps.append(TraceStep(self._taxpayer(income), name, value, 0.0, self._depth, True))
+
+    @property
+    def counts(self) -> dict:
+        """How many times every step was computed, shared ones not included."""
+        return dict(Counter(step.name for step in self.steps if not step.shared))
+
+    @property
+    def seconds(self) -> float:
+        """Time spent in the top-level steps."""
+        return sum(step.seconds for step in self.steps if step.depth == 0)
+
+    def as_dict(self) -> dict:
+        return {
+            'steps': [step._asdict() for step in self.steps],
+            'counts': self.counts,
+            'seconds': self.seconds,
+        }
+
+    def __str__(self) -> str:
+        lines = [f"{'taxpayer':>8}  {'step':<28}{'value':>14}{'time, µs':>12}"]
+        for step in self.steps:
+            name = '  ' * step.depth + step.name
+            time = 'shared' if step.shared else f"{step.seconds * 1e6:.1f}"
+            lines.append(f"{step.taxpayer:>8}  {name:<28}{step.value:>14,.2f}{time:>12}")
+        counts = ', '.join(f"{name} ×{count}" for name, count in self.counts.items())
+        lines.append(f"\nComputed: {counts}")
+        return '\n'.join(lines)
+
+
+_active_trace: ContextVar[Trace | None] = ContextVar('trace', default=None)
+
 
-import numpy as np
+@contextmanager
+def tracing() -> Iterator[Trace]:
+    """
+    Records the steps of every `Income` calculation run in the block.
+
+    Examples
+    --------
+    >>> with tracing() as trace:
+    ...     compare_scenarios(arguments, alternative_scenarios('r', 'single', '3'))
+    >>> trace.counts
+    """
+    trace = Trace()
+    token = _active_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _active_trace.reset(token)
+
+
+def _progressive_taxation(income: Income, taxable: float, schedule) -> float:
+    """`_schedule_tax`, recorded as a step of `income` when tracing."""
+    trace = _active_trace.get()
+    if trace is None:
+        return _schedule_tax(taxable, schedule)
+    return trace.record(income, 'progressive_taxation', _schedule_tax, taxable, schedule)
+
+
+# Income arguments every reusable step of the calculation depends on
+_CATEGORY_A_ALLOWANCES = {'year', 'opened_at', 'telework_allowance', 'meal_allowance', 'meal_type'}
+_STEP_ARGUMENTS = {
+    'allowance_excess': _CATEGORY_A_ALLOWANCES,
+    'specific_deduction': {'year', 'region'},
+    'social_security_tax': _CATEGORY_A_ALLOWANCES | {'income'},
+    'taxable_base': _CATEGORY_A_ALLOWANCES | {'income', 'region', 'expenses'},
+    'solidarity_tax': {'income', 'residence'},
+}
 
-from config import get_tax_data, get_allowance_limits
+
+@dataclass(frozen=True, slots=True)
+class TaxBreakdown:
+    """
+    Result of a single `Income` calculation with all of its intermediate steps.
+
+    `total_tax` is the sum of income, social security and solidarity taxes,
+    `net_income` is the gross income plus allowances received minus `total_tax`.
+    """
+    income: float
+    allowance_excess: float
+    specific_deduction: float
+    social_security_tax: float
+    taxable_base: float
+    family_quotient: float
+    family_deduction: float
+    income_tax: float
+    solidarity_tax: float
+    total_tax: float
+    net_income: float
 
 
 class Income():
@@ -40,6 +287,15 @@ class Income():
         meal_allowance: float = 0,
         meal_type: str = 'card',
     ) -> None:
+        # kept to derive what-if variants of the same taxpayer, see `evolve`
+        self._arguments = {
+            'year': year, 'income': income, 'residence': residence, 'region': region,
+            'opened_at': opened_at, 'expenses': expenses, 'status': status, 'kids': kids,
+            'telework_allowance': telework_allowance, 'meal_allowance': meal_allowance, 'meal_type': meal_type,
+        }
+        self._shared = {}
+        # the rates the whole calculation uses, even if they are reloaded meanwhile
+        self._registry = get_registry()
         if year < 2023 or year > 2026:
             raise ValueError(
                 "Only years from 2023 to 2026 are currently supported"
@@ -77,18 +333,7 @@ class Income():
         else:
             self.category = 'B' # independent worker (TI/ENI)
             self.activity_expenses = 0 if not expenses else float(expenses)
-            try:
-                self.opened_at = datetime.strptime(opened_at, '%m/%y')
-            except ValueError:
-                raise ValueError(
-                "Incorrect activity opened month or expenses format, "
-                "should be a date in `mm/yy` and a float value respectively"
-            )
-            if self.opened_at.year > self.year:
-                raise ValueError(
-                    "The taxes can't be estimated for the year prior to when the activity was opened. "
-                    "Consider the following years or adjust your income category"
-                )
+            self.opened_at = _parse_opened_at(opened_at, self.year)
 
         if status not in {'single', 'joint'}:
             raise ValueError(
@@ -98,129 +343,169 @@ class Income():
         else:
             self.status = status
         if kids:
-            try:
-                self.ages = [int(age.strip()) for age in kids.split(',')]
-            except ValueError:
-                raise ValueError(
-                "Incorrect format of children ages provided, "
-                "should be integer numbers for the end of the year separated by a comma without spaces. "
-                "Example: '3,10,1'"
-            )
+            self.ages = _parse_kids(kids)
 
-    @property
-    def allowance_excess(self) -> float:
+    def _allowance_excess(self) -> float:
         """Annual allowance received above the IRS/SS-free daily limit (Category A only).
         Both IRS and Social Security share the same daily exemption thresholds.
         Assumes 264 working days per year (22 days × 12 months).
         """
         if self.category != 'A':
             return 0.0
-        limits = get_allowance_limits(self.year)
-        working_days = 264
-        tel_excess = max(0.0, self._telework_annual - working_days * limits['telework_daily'])
+        limits = self._registry.allowance_limits(self.year)
+        tel_excess = max(0.0, self._telework_annual - WORKING_DAYS * limits['telework_daily'])
         meal_cap = limits['meal_card_daily'] if self._meal_type == 'card' else limits['meal_cash_daily']
-        meal_excess = max(0.0, self._meal_annual - working_days * meal_cap)
+        meal_excess = max(0.0, self._meal_annual - WORKING_DAYS * meal_cap)
         return round(tel_excess + meal_excess, 2)
 
-    @property
-    def specific_deduction(self) -> float:
-        tax_data = get_tax_data(self.year, self.region)
+    def _specific_deduction(self) -> float:
         if self.year == 2023:
             return 4104 # it was a fixed amount back then
         else:
-            return 8.54 * tax_data["ias"]
+            return 8.54 * self._registry.table(self.year, self.region).ias
 
-    @property
-    def taxable_base(self) -> float:
+    def _social_security_tax(self, allowance_excess: float) -> float:
+        if self.category == "B":
+            invoiced_months, months_to_first_declaration = _social_security_months(self.opened_at, self.year)
+            return round(self.income * (invoiced_months / 12) * 0.1125 + months_to_first_declaration * 20, 2)
+        else:
+            return round((self.income + allowance_excess) * 0.11, 2)
+
+    def _taxable_base(self, allowance_excess: float, specific_deduction: float, social_security_tax: float) -> float:
         """
         Consider only TI providing services where standard taxable base - 75%
         For ENI supplies of goods the coefficient is different.
         """
         if self.category == "B":
-            # first two years of atividade with discount
-            extra_discount = (
-                0.5 if self.opened_at.year == self.year else 0.25 if self.opened_at.year == self.year - 1 else 0
-            )
+            extra_discount = _extra_discount(self.opened_at, self.year)
             # 15% are added as the discount of 75% reflects the costs for business
             # social security and other TI related costs are deducted, so it may be reduced to zero
             not_incurred_expenses = max(
-                0, self.income * 0.15 - max(self.specific_deduction, self.social_security_tax) - self.activity_expenses
+                0, self.income * 0.15 - max(specific_deduction, social_security_tax) - self.activity_expenses
             )
             return self.income * 0.75 * (1 - extra_discount) + not_incurred_expenses
         else:
-            return max(0, self.income + self.allowance_excess - max(self.specific_deduction, self.social_security_tax))
+            return max(0, self.income + allowance_excess - max(specific_deduction, social_security_tax))
+
+    def _income_tax(self, taxable_base: float, family_quotient: float, family_deduction: float) -> float:
+        if self.residence == "nr":
+           # social security payments discount is for residents only
+           return self.income * 0.25
+        elif self.residence == "nhr":
+            return taxable_base * 0.20 * (1 - (0.3 if self.region == "Azores" else 0))
+        else:
+            schedule = self._registry.table(self.year, self.region).schedule
+            return (
+                family_quotient * _progressive_taxation(self, taxable_base / family_quotient, schedule)
+                - family_deduction
+            )
+
+    def _solidarity_tax(self) -> float:
+        return _progressive_taxation(self, self.income, _SOLIDARITY_SCHEDULE) if self.residence == "r" else 0
+
+    def _step(self, name: str, compute, *args) -> float:
+        """
+        Evaluates a step of the calculation unless it was shared by the taxpayer this one evolved from,
+        recording it when tracing.
+        """
+        trace = _active_trace.get()
+        if name in self._shared:
+            if trace is not None:
+                trace.reuse(self, name, self._shared[name])
+            return self._shared[name]
+        if trace is None:
+            return compute(*args)
+        return trace.record(self, name, compute, *args)
+
+    @cached_property
+    def breakdown(self) -> TaxBreakdown:
+        """The whole calculation, every intermediate step evaluated exactly once."""
+        allowance_excess = self._step('allowance_excess', self._allowance_excess)
+        specific_deduction = self._step('specific_deduction', self._specific_deduction)
+        social_security_tax = self._step('social_security_tax', self._social_security_tax, allowance_excess)
+        taxable_base = self._step(
+            'taxable_base', self._taxable_base, allowance_excess, specific_deduction, social_security_tax
+        )
+        ages = getattr(self, "ages", None)
+        family_quotient = self._step('family_quotient', _family_quotient, self.status, ages)
+        family_deduction = self._step('family_deduction', _family_deduction, self.status, ages)
+        income_tax = self._step('income_tax', self._income_tax, taxable_base, family_quotient, family_deduction)
+        solidarity_tax = self._step('solidarity_tax', self._solidarity_tax)
+        total_tax = income_tax + social_security_tax + solidarity_tax
+        return TaxBreakdown(
+            income=self.income,
+            allowance_excess=allowance_excess,
+            specific_deduction=specific_deduction,
+            social_security_tax=social_security_tax,
+            taxable_base=taxable_base,
+            family_quotient=family_quotient,
+            family_deduction=family_deduction,
+            income_tax=income_tax,
+            solidarity_tax=solidarity_tax,
+            total_tax=total_tax,
+            net_income=self.income + self._telework_annual + self._meal_annual - total_tax,
+        )
+
+    def evolve(self, **overrides) -> 'Income':
+        """
+        Returns the same taxpayer with some of the arguments replaced.
+        The steps of the calculation the overrides can't affect are reused rather than recomputed.
+        """
+        variant = Income(**{**self._arguments, **overrides})
+        variant._registry = self._registry
+        changed = {key for key, value in overrides.items() if value != self._arguments[key]}
+        breakdown = self.breakdown
+        variant._shared = {
+            step: getattr(breakdown, step)
+            for step, arguments in _STEP_ARGUMENTS.items()
+            if not arguments & changed
+        }
+        return variant
+
+    def explain(self) -> Trace:
+        """
+        Evaluates the calculation of this taxpayer from scratch while tracing it.
+
+        Returns
+        -------
+        Trace
+            Every step with its value and time, in evaluation order
+        """
+        with tracing() as trace:
+            Income(**self._arguments).breakdown
+        return trace
+
+    @property
+    def allowance_excess(self) -> float:
+        return self.breakdown.allowance_excess
+
+    @property
+    def specific_deduction(self) -> float:
+        return self.breakdown.specific_deduction
+
+    @property
+    def taxable_base(self) -> float:
+        return self.breakdown.taxable_base
 
     @property
     def family_quotient(self) -> float:
-        quote = 1
-        if self.status == 'single':
-            return quote
-        else:
-            # joint declaration
-            quote += 1
-        # and extra for kids
-        if hasattr(self, "ages"):
-            # 0.5 for the first
-            quote += 0.25
-            for age in self.ages:
-                # 0.25 for others
-                quote += 0.25
-        return quote
+        return self.breakdown.family_quotient
 
     @property
     def family_deduction(self) -> float:
-        if not hasattr(self, "ages"):
-            return 0
-        # every dependent adds 600 euros
-        expenses = 600 * len(self.ages)
-        # every children under 3 get extra 126 euros
-        for age in self.ages:
-            if age <= 3:
-                expenses += 126
-        # the second and subsequent children under 6 get extra 300 euros
-        for age in sorted(self.ages)[1:]:
-            if age <= 6:
-                expenses += 300
-        # if a family submit separate declarations
-        # choldren deducations are divided equally
-        if self.status == 'single':
-            expenses /= 2
-        return expenses
+        return self.breakdown.family_deduction
 
     @property
     def income_tax(self) -> float:
-        if self.residence == "nr":
-           # social security payments discount is for residents only
-           return self.income * 0.25
-        elif self.residence == "nhr":
-            return self.taxable_base * 0.20 * (1 - (0.3 if self.region == "Azores" else 0))
-        else:
-            tax_data = get_tax_data(self.year, self.region)
-            return self.family_quotient * self.progressive_taxation(
-                self.taxable_base / self.family_quotient,
-                tax_data["brackets"],
-                tax_data["rates"],
-            ) - self.family_deduction
+        return self.breakdown.income_tax
 
     @property
     def solidarity_tax(self) -> float:
-        thresholds = [75000, 80000, 200000, 300000]
-        rates = [0, 0.40, 0.025, 0.10, 0.05]
-        return self.progressive_taxation(self.income, thresholds, rates) if self.residence == "r" else 0
+        return self.breakdown.solidarity_tax
 
     @property
     def social_security_tax(self) -> float:
-        if self.category == "B":
-            tax_year_end_at = datetime.strptime(f"01/{1 + self.year % 100}", '%m/%y')
-            months_since_opened = tax_year_end_at.month - self.opened_at.month + 12 * (tax_year_end_at.year - self.opened_at.year)
-            # first 12 months after opening the social security is not paid
-            # then until the beginning of the new quarter it's fixed - 20€
-            # as there is no income yet declared in a quarterly decalration
-            months_to_first_declaration = 3 - (self.opened_at.month - 1) % 3
-            invoiced_months = min(12, max(0, months_since_opened - 12 - months_to_first_declaration))
-            return round(self.income * (invoiced_months / 12) * 0.1125 + months_to_first_declaration * 20, 2)
-        else:
-            return round((self.income + self.allowance_excess) * 0.11, 2)
+        return self.breakdown.social_security_tax
 
     @staticmethod
     def progressive_taxation(income: float, thresholds: list, rates: list) -> float:
@@ -228,23 +513,7 @@ class Income():
         rates[i] correspond to taxes applied to income
         between thresholds[i - 1] and thresholds[i]
         """
-        thresholds = np.array(thresholds)
-        rates = np.array(rates)
-        difference = thresholds - np.hstack((0, thresholds[:-1]))  
-        indexes = thresholds <= income
-        return round(
-            sum(
-                [threshold * rate for threshold, rate
-                in zip(difference[indexes], rates[:-1][indexes])]
-            ) + (
-                rates[sum(indexes)] * (
-                    income - (
-                        thresholds[sum(indexes) - 1]
-                        if sum(indexes) != 0 else 0
-                    )
-                )
-            )
-        , 2)
+        return _schedule_tax(income, compile_schedule(thresholds, rates))
 
     def __repr__(self) -> str:
         type = {
@@ -258,3 +527,599 @@ class Income():
             f"from {'regular employment' if self.category == 'A' else 'independent provision of services'}",
             f"in {self.year}>"
         ])
+
+
+class Scenario(NamedTuple):
+    """An alternative to compare against: a label and the `Income` arguments it replaces."""
+    desc: str
+    overrides: dict
+
+
+def alternative_scenarios(residence: str, status: str = 'single', kids: str = None) -> list:
+    """
+    The standard what-if alternatives for a taxpayer: becoming NHR,
+    switching between joint and single declaration, and having no dependants.
+    """
+    scenarios = []
+    if residence != 'nhr':
+        scenarios.append(Scenario('Non-Habitual Resident', {'residence': 'nhr', 'region': 'Mainland'}))
+    # joint/single is only relevant for residents with progressive tax brackets
+    if residence not in ['nhr', 'nr']:
+        scenarios.append(Scenario(
+            f"{'Joint' if status == 'single' else 'Single'} Declaration",
+            {'status': 'joint' if status == 'single' else 'single'},
+        ))
+    if kids:
+        scenarios.append(Scenario('No Kids', {'kids': ''}))
+    return scenarios
+
+
+def compare_scenarios(arguments: dict, scenarios: list) -> tuple:
+    """
+    Evaluates a base taxpayer and all of its alternatives in one go.
+
+    Parameters
+    ----------
+    arguments : dict or Income
+        `Income` arguments of the base case, or the base `Income` itself
+    scenarios : list of Scenario
+        Alternatives to evaluate, the ones with invalid overrides are skipped
+
+    Returns
+    -------
+    tuple
+        The base `Income` and one row per alternative with its `desc`, `total_tax`,
+        `monthly_net` and the yearly `gain` over the base case
+    """
+    base = arguments if isinstance(arguments, Income) else Income(**arguments)
+    total_tax = base.breakdown.total_tax
+    rows = []
+    for scenario in scenarios:
+        try:
+            alternative_tax = base.evolve(**scenario.overrides).breakdown.total_tax
+        except ValueError:
+            continue
+        rows.append({
+            'desc': scenario.desc,
+            'total_tax': alternative_tax,
+            'monthly_net': (base.income - alternative_tax) / 12,
+            'gain': total_tax - alternative_tax,
+        })
+    return base, rows
+
+
+def _column(values, size: int | None = None) -> np.ndarray:
+    """Turns a scalar or an array-like into a 1-D array of the batch size."""
+    import numpy as np
+    column = np.asarray(values)
+    if size is None or column.ndim == 0:
+        return column if size is None else np.broadcast_to(column, size)
+    if column.shape != (size,):
+        raise ValueError(f"All columns must have the same length, expected {size} got {len(column)}")
+    return column
+
+
+def _factorize(values, size: int) -> tuple:
+    """Returns the distinct values of a column and the index of each row into them."""
+    import numpy as np
+    column = np.asarray(values)
+    if column.ndim == 0:
+        value = column.item()
+        return ['' if value is None else value], np.zeros(size, dtype=int)
+    column = _column(column, size)
+    if column.dtype == object:
+        column = np.where(column == None, '', column).astype(str)
+    uniques, codes = np.unique(column, return_inverse=True)
+    return uniques.tolist(), codes
+
+
+def _round_cents(values: np.ndarray) -> np.ndarray:
+    """
+    Element-wise `round(x, 2)` with the semantics of the Python builtin.
+    `np.round` scales by 100 first, so it may land on the other side of a half-cent tie.
+    """
+    import numpy as np
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    ties = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if ties.any():
+        rounded[ties] = [round(value, 2) for value in values[ties].tolist()]
+    return rounded
+
+
+def _schedule_tax_batch(income: np.ndarray, schedule) -> np.ndarray:
+    """Vectorized `_schedule_tax`."""
+    import numpy as np
+    thresholds = np.asarray(schedule.thresholds)
+    lower = np.hstack((0, thresholds))
+    index = np.searchsorted(thresholds, income, side='right')
+    return np.round(
+        np.asarray(schedule.cumulative)[index] + np.asarray(schedule.rates)[index] * (income - lower[index]), 2
+    )
+
+
+def compute_batch(
+    income,
+    year=2023,
+    residence='r',
+    region='Mainland',
+    opened_at=None,
+    expenses=0,
+    status='single',
+    kids=None,
+    telework_allowance=0,
+    meal_allowance=0,
+    meal_type='card',
+) -> dict:
+    """
+    Vectorized Portugal Taxation Calculator
+
+    Every parameter accepts either a single value shared by the whole batch
+    or an array-like with one value per taxpayer, with the same meaning as in `Income`.
+    Results match `Income` row by row.
+
+    Parameters
+    ----------
+    income : array-like of float
+        Annual gross income
+    year, residence, region, opened_at, expenses, status, kids : scalar or array-like
+        See `Income`. A non-empty `opened_at` makes the row a Category B income
+    telework_allowance, meal_allowance, meal_type : scalar or array-like
+        Category A tax-free allowances (annual amounts received)
+
+    Returns
+    -------
+    dict of np.ndarray
+        `income_tax`, `social_security`, `solidarity_tax`, `total_tax` and `net_income`
+        (gross income plus allowances received minus total tax)
+    """
+    import numpy as np
+    income = np.atleast_1d(np.asarray(income, dtype=float))
+    if income.ndim != 1:
+        raise ValueError("Specify the Annual gross income as a one-dimensional array")
+    size = len(income)
+
+    years, year_index = _factorize(year, size)
+    if any(y < 2023 or y > 2026 for y in years):
+        raise ValueError("Only years from 2023 to 2026 are currently supported")
+    residences, residence_index = _factorize(residence, size)
+    if not set(residences) <= {'r', 'nr', 'nhr'}:
+        raise ValueError(
+            "Incorrect type of residence, "
+            "should be one of the following: r, nr, nhr}"
+        )
+    regions, region_index = _factorize(region, size)
+    if not set(regions) <= {'Mainland', 'Madeira', 'Azores'}:
+        raise ValueError(
+            "Incorrect region of residence, "
+            "should be one of the following: Mainland, Madeira, Azores"
+        )
+    residence_code = np.asarray(residences)[residence_index]
+    is_resident = residence_code == 'r'
+
+    telework = np.nan_to_num(_column(telework_allowance, size).astype(float))
+    meal = np.nan_to_num(_column(meal_allowance, size).astype(float))
+    is_card = _column(meal_type, size) != 'cash'
+    expenses = np.nan_to_num(_column(expenses, size).astype(float))
+
+    # per year and per (year, region) lookups, there are only a handful of distinct tables
+    registry = get_registry()
+    telework_daily = np.empty(size)
+    meal_cap = np.empty(size)
+    for code, y in enumerate(years):
+        rows = year_index == code
+        limits = registry.allowance_limits(y)
+        telework_daily[rows] = limits['telework_daily']
+        meal_cap[rows] = np.where(is_card[rows], limits['meal_card_daily'], limits['meal_cash_daily'])
+    table_index = year_index * len(regions) + region_index
+    tables = {}
+    specific_deduction = np.empty(size)
+    for code in np.unique(table_index):
+        y, r = years[code // len(regions)], regions[code % len(regions)]
+        tables[code] = registry.table(y, r)
+        specific_deduction[table_index == code] = 4104 if y == 2023 else 8.54 * tables[code].ias
+
+    # Category B: activity opening dates drive SS exemptions and the taxable base discounts
+    opened_values, opened_index = _factorize(opened_at, size)
+    is_category_b = np.asarray([bool(value) for value in opened_values])[opened_index]
+    invoiced_months = np.zeros(size)
+    months_to_first_declaration = np.zeros(size)
+    extra_discount = np.zeros(size)
+    if is_category_b.any():
+        pairs = opened_index * len(years) + year_index
+        for code in np.unique(pairs[is_category_b]):
+            rows = pairs == code
+            y = years[code % len(years)]
+            opened = _parse_opened_at(opened_values[code // len(years)], y)
+            invoiced_months[rows], months_to_first_declaration[rows] = _social_security_months(opened, y)
+            extra_discount[rows] = _extra_discount(opened, y)
+
+    allowance_excess = np.where(
+        is_category_b,
+        0.0,
+        _round_cents(
+            np.maximum(0.0, telework - WORKING_DAYS * telework_daily)
+            + np.maximum(0.0, meal - WORKING_DAYS * meal_cap)
+        ),
+    )
+    social_security = np.where(
+        is_category_b,
+        _round_cents(income * (invoiced_months / 12) * 0.1125 + months_to_first_declaration * 20),
+        _round_cents((income + allowance_excess) * 0.11),
+    )
+    deduction = np.maximum(specific_deduction, social_security)
+    taxable_base = np.where(
+        is_category_b,
+        income * 0.75 * (1 - extra_discount) + np.maximum(0, income * 0.15 - deduction - expenses),
+        np.maximum(0, income + allowance_excess - deduction),
+    )
+
+    statuses, status_index = _factorize(status, size)
+    if not set(statuses) <= {'single', 'joint'}:
+        raise ValueError(
+            "Incorrect submit status, "
+            "should be either `single` or `joint`"
+        )
+    kids_values, kids_index = _factorize(kids, size)
+    family_index = kids_index * len(statuses) + status_index
+    family_quotient = np.ones(size)
+    family_deduction = np.zeros(size)
+    for code in np.unique(family_index):
+        rows = family_index == code
+        s, ages = statuses[code % len(statuses)], _parse_kids(kids_values[code // len(statuses)])
+        family_quotient[rows] = _family_quotient(s, ages)
+        family_deduction[rows] = _family_deduction(s, ages)
+
+    income_tax = np.where(
+        residence_code == 'nr',
+        income * 0.25,
+        taxable_base * 0.20 * (1 - np.where(np.asarray(regions)[region_index] == 'Azores', 0.3, 0)),
+    )
+    for code, table in tables.items():
+        rows = is_resident & (table_index == code)
+        if rows.any():
+            quotient = family_quotient[rows]
+            income_tax[rows] = quotient * _schedule_tax_batch(
+                taxable_base[rows] / quotient, table.schedule
+            ) - family_deduction[rows]
+
+    solidarity_tax = np.zeros(size)
+    solidarity_tax[is_resident] = _schedule_tax_batch(income[is_resident], _SOLIDARITY_SCHEDULE)
+    total_tax = income_tax + social_security + solidarity_tax
+    return {
+        'income_tax': income_tax,
+        'social_security': social_security,
+        'solidarity_tax': solidarity_tax,
+        'total_tax': total_tax,
+        'net_income': income + telework + meal - total_tax,
+    }
+
+
+def batch_columns(rows: list, defaults: dict = None) -> dict:
+    """
+    Turns a list of `Income` keyword arguments into `compute_batch` columns.
+    Arguments missing from a row are taken from `defaults`, then from the `Income` defaults.
+    """
+    parameters = signature(Income).parameters
+    defaults = {**{name: parameter.default for name, parameter in parameters.items()}, **(defaults or {})}
+    unknown = {key for row in rows for key in row} - defaults.keys()
+    if unknown:
+        raise ValueError(f"Unknown arguments: {', '.join(sorted(unknown))}")
+    columns = {
+        name: [default if row.get(name) is None else row[name] for row in rows]
+        for name, default in defaults.items()
+    }
+    if None in columns['income']:
+        raise ValueError("Specify the Annual gross income")
+    return columns
+
+
+def calculate_profiles(profiles: list, alternatives: bool = False) -> list:
+    """
+    Breakdowns of many taxpayers in a single `compute_batch` call.
+
+    Parameters
+    ----------
+    profiles : list of dict
+        `Income` keyword arguments of every taxpayer
+    alternatives : bool, default=False
+        Whether to add the `alternative_scenarios` of every taxpayer, evaluated in the same call
+
+    Returns
+    -------
+    list of dict
+        One breakdown per profile: `income`, the `compute_batch` columns, `monthly_net` and `effective_rate`,
+        plus the `alternatives` rows as in `compare_scenarios` when requested
+    """
+    columns = batch_columns(profiles)
+    owners = []
+    if alternatives:
+        rows = list(profiles)
+        for owner, profile in enumerate(profiles):
+            # from the resolved columns, a None in the profile stands for the default
+            for scenario in alternative_scenarios(
+                columns['residence'][owner], columns['status'][owner], columns['kids'][owner]
+            ):
+                rows.append({**profile, **scenario.overrides})
+                owners.append((owner, scenario.desc))
+        columns = batch_columns(rows)
+    result = compute_batch(**columns)
+    income = [float(value) for value in columns['income']]
+    breakdowns = []
+    for k in range(len(profiles)):
+        total_tax = float(result['total_tax'][k])
+        breakdowns.append({
+            'income': income[k],
+            **{key: float(values[k]) for key, values in result.items()},
+            'monthly_net': float(result['net_income'][k]) / 12,
+            'effective_rate': total_tax / income[k] if income[k] else 0,
+        })
+        if alternatives:
+            breakdowns[k]['alternatives'] = []
+    for k, (owner, desc) in enumerate(owners, start=len(profiles)):
+        alternative_tax = float(result['total_tax'][k])
+        breakdowns[owner]['alternatives'].append({
+            'desc': desc,
+            'total_tax': alternative_tax,
+            'monthly_net': (income[owner] - alternative_tax) / 12,
+            'gain': breakdowns[owner]['total_tax'] - alternative_tax,
+        })
+    return breakdowns
+
+
+def _start_worker() -> None:
+    # compile the rate tables once per worker process instead of once per chunk
+    get_registry()
+
+
+def map_batches(function, chunks, workers: int = 1):
+    """
+    Applies a batch function, `compute_batch` or a wrapper of it, to a stream of chunks
+    spread over worker processes.
+
+    Parameters
+    ----------
+    function : callable
+        Picklable function taking a chunk
+    chunks : iterable
+        The chunks, e.g. dicts of `compute_batch` keyword arguments
+    workers : int, default=1
+        Number of worker processes, the chunks are computed in this process when 1
+
+    Yields
+    ------
+    object
+        The result of every chunk, in the order of the chunks.
+        At most two chunks per worker are read ahead, so memory stays bounded on endless streams
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield function(chunk)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers, initializer=_start_worker) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(function, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def income_curve(profile: dict, start: float, stop: float, step: float) -> dict:
+    """
+    Gross-to-net curve of a taxpayer over an income grid, evaluated in one vectorized pass.
+
+    Parameters
+    ----------
+    profile : dict
+        `Income` arguments other than `income`
+    start, stop, step : float
+        The gross income grid, `stop` included
+
+    Returns
+    -------
+    dict of np.ndarray
+        The `compute_batch` columns plus `gross`, `effective_rate` (total tax over gross income)
+        and `marginal_rate` (total tax on the next euro, from the compiled profile)
+    """
+    import numpy as np
+    if step <= 0 or stop < start:
+        raise ValueError("The income grid needs a positive step and a stop not below the start")
+    gross = np.arange(start, stop + step / 2, step, dtype=float)
+    curve = compute_batch(gross, **profile)
+    total_tax = curve['total_tax']
+    curve['gross'] = gross
+    curve['effective_rate'] = np.divide(total_tax, gross, out=np.zeros_like(gross), where=gross != 0)
+    curve['marginal_rate'] = compile_profile(profile).marginal_rate(gross)
+    return curve
+
+
+def _invert_increasing(x: np.ndarray, y: np.ndarray, levels) -> np.ndarray:
+    """Where a piecewise-linear non-decreasing function through (x, y) first reaches each level."""
+    import numpy as np
+    index = np.clip(np.searchsorted(y, levels, side='left'), 1, len(y) - 1)
+    rise = y[index] - y[index - 1]
+    slope = np.divide(x[index] - x[index - 1], rise, out=np.zeros_like(rise), where=rise != 0)
+    return x[index - 1] + (levels - y[index - 1]) * slope
+
+
+def _gross_breakpoints(profile: dict) -> np.ndarray:
+    """
+    Gross incomes where the total tax of a taxpayer changes slope.
+    Between two consecutive ones (and past the last) the tax is linear in the gross income.
+    """
+    import numpy as np
+    reference = Income(income=0, **profile)
+    base = reference.breakdown
+    if reference.category == 'B':
+        invoiced_months, months_to_first_declaration = _social_security_months(reference.opened_at, reference.year)
+        ss_rate, ss_fixed = invoiced_months / 12 * 0.1125, months_to_first_declaration * 20
+        expenses = reference.activity_expenses
+        # not incurred expenses start counting once 15% of the income exceeds the deductions
+        points = [
+            (base.specific_deduction + expenses) / 0.15,
+            (ss_fixed + expenses) / (0.15 - ss_rate),
+        ]
+        if ss_rate:
+            points.append((base.specific_deduction - ss_fixed) / ss_rate)
+        min_base_slope = 0.75 * (1 - _extra_discount(reference.opened_at, reference.year))
+    else:
+        # the taxable base becomes positive, then social security overtakes the specific deduction
+        points = [
+            base.specific_deduction - base.allowance_excess,
+            base.specific_deduction / 0.11 - base.allowance_excess,
+        ]
+        min_base_slope = 0.89
+    points = [point for point in points if point > 0] if reference.residence != 'nr' else []
+
+    if reference.residence == 'r':
+        thresholds = np.asarray(reference._registry.table(reference.year, reference.region).schedule.thresholds)
+        levels = base.family_quotient * thresholds
+        # far enough for the taxable base to be past the last bracket
+        grid = np.unique([0.0, *points, max(points, default=0) + levels[-1] / min_base_slope + 1])
+        taxable_base = np.array([reference.evolve(income=gross).taxable_base for gross in grid])
+        points.extend(_invert_increasing(grid, taxable_base, levels))
+        points.extend(SOLIDARITY_THRESHOLDS)
+
+    # far past the last breakpoint, so the slope of the last segment isn't skewed
+    # by the rounding to the cent of the taxes at its ends (non-residents have no breakpoint at all)
+    upper = max(points, default=0) + 1e6
+    return np.unique([0.0, *points, upper])
+
+
+class CompiledProfile:
+    """
+    Taxes of one taxpayer profile as piecewise-linear functions of the gross income.
+
+    Compiled once by `compile_profile`, after which evaluating an income is a binary search
+    for its segment and a multiply-add, for one income or millions of them.
+    Values match `compute_batch` at the breakpoints and up to the rounding of each tax
+    to the cent in between.
+
+    Attributes
+    ----------
+    gross : np.ndarray
+        Gross incomes where any tax changes slope, starting at 0
+    values : dict of np.ndarray
+        The `compute_batch` columns at every breakpoint
+    slopes : dict of np.ndarray
+        Slope of every column on the segment starting at each breakpoint,
+        the last one extends past the last breakpoint
+    """
+
+    def __init__(self, gross: np.ndarray, values: dict) -> None:
+        import numpy as np
+        self.gross = gross
+        self.values = values
+        self.slopes = {}
+        for name, value in values.items():
+            slope = np.diff(value) / np.diff(gross)
+            self.slopes[name] = np.append(slope, slope[-1] if len(slope) else 0.0)
+        self._bounds = gross.tolist()
+
+    def evaluate(self, income) -> dict:
+        """
+        Parameters
+        ----------
+        income : float or array-like of float
+            Annual gross income
+
+        Returns
+        -------
+        dict of float or np.ndarray
+            The `compute_batch` columns rounded to the cent, floats for a scalar income
+        """
+        import numpy as np
+        if isinstance(income, (int, float)):
+            index = max(bisect_right(self._bounds, income) - 1, 0)
+            offset = income - self._bounds[index]
+            return {
+                name: round(float(value[index] + self.slopes[name][index] * offset), 2)
+                for name, value in self.values.items()
+            }
+        income = np.asarray(income, dtype=float)
+        index = np.clip(np.searchsorted(self.gross, income, side='right') - 1, 0, None)
+        offset = income - self.gross[index]
+        return {
+            name: _round_cents(np.atleast_1d(value[index] + self.slopes[name][index] * offset)).reshape(income.shape)
+            for name, value in self.values.items()
+        }
+
+    def marginal_rate(self, income) -> float | np.ndarray:
+        """Total tax on the next euro of gross income."""
+        import numpy as np
+        index = np.clip(np.searchsorted(self.gross, income, side='right') - 1, 0, None)
+        rate = self.slopes['total_tax'][index]
+        return float(rate) if np.ndim(rate) == 0 else rate
+
+    def gross_for_net(self, net_income) -> float | np.ndarray:
+        """Inverse of the net income, see `gross_for_net`."""
+        import numpy as np
+        gross, net = self.gross, self.values['net_income']
+        target = np.asarray(net_income, dtype=float)
+        if (target < net[0]).any():
+            raise ValueError(
+                f"The net income can't be below {net[0]:,.2f} that a zero gross income already results in"
+            )
+        # extend the last segment linearly for targets beyond the last breakpoint
+        index = np.clip(np.searchsorted(net, target, side='right'), 1, len(net) - 1)
+        slope = (gross[index] - gross[index - 1]) / (net[index] - net[index - 1])
+        solution = np.round(gross[index - 1] + (target - net[index - 1]) * slope, 2)
+        return float(solution) if solution.ndim == 0 else solution
+
+
+@lru_cache(maxsize=256)
+def _compile_profile(version: str, key: tuple) -> CompiledProfile:
+    profile = dict(key)
+    gross = _gross_breakpoints(profile)
+    return CompiledProfile(gross, compute_batch(gross, **profile))
+
+
+def compile_profile(profile: dict) -> CompiledProfile:
+    """
+    Compiles the taxes of a taxpayer profile into piecewise-linear functions of the gross income.
+
+    Compiled profiles are cached by the profile and the version of the rates,
+    so curves, inverse solving and repeated what-if evaluations share them
+    and a reload of the rates compiles them again.
+
+    Parameters
+    ----------
+    profile : dict
+        `Income` arguments other than `income`
+
+    Returns
+    -------
+    CompiledProfile
+    """
+    # the version in the key is the one the profile is compiled with
+    token = pin_registry()
+    try:
+        return _compile_profile(get_registry().version, tuple(sorted(profile.items())))
+    finally:
+        unpin_registry(token)
+
+
+def gross_for_net(profile: dict, net_income) -> float | np.ndarray:
+    """
+    Annual gross income a taxpayer needs to be left with the given net income.
+
+    The tax is piecewise linear in the gross income for a fixed profile, so the inverse
+    is exact on every segment between the brackets, solidarity thresholds
+    and the switch between the specific deduction and social security.
+
+    Parameters
+    ----------
+    profile : dict
+        `Income` arguments other than `income`
+    net_income : float or array-like of float
+        Target annual net income, allowances received included
+
+    Returns
+    -------
+    float or np.ndarray
+        Required gross income rounded to the cent, one per target
+    """
+    return compile_profile(profile).gross_for_net(net_income)
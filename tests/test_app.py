@@ -2,10 +2,11 @@
 Integration tests for the Flask web application (app.py).
 Uses Flask's built-in test client; SQLite is created in-memory per test.
 """
+import datetime
 import json
 import pytest
 
-from app import app as flask_app, db, User
+from app import create_app, db, User
 
 
 # ---------------------------------------------------------------------------
@@ -14,14 +15,14 @@ from app import app as flask_app, db, User
 
 @pytest.fixture()
 def app():
-    flask_app.config.update(
-        TESTING=True,
-        SQLALCHEMY_DATABASE_URI="sqlite:///:memory:",
-        WTF_CSRF_ENABLED=False,
-        SECRET_KEY="testkey",
-    )
+    flask_app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+        "WTF_CSRF_ENABLED": False,
+        "SECRET_KEY": "testkey",
+        "WRITE_BEHIND_DELAY": 0,
+    })
     with flask_app.app_context():
-        db.create_all()
         yield flask_app
         db.drop_all()
 
@@ -239,6 +240,59 @@ class TestCalculator:
         resp = auth_client.get(f"/?load={calc_id}")
         assert resp.status_code == 200
 
+    def test_load_renders_stored_result(self, app, auth_client, monkeypatch):
+        import app as app_module
+        from app import Calculation
+        self._set_profile(auth_client, kids="5")
+        auth_client.post("/", data={"year": "2025", "income": "50000", "status": "single"})
+        calc = Calculation.query.first()
+        assert calc.result_schema == app_module.RESULT_SCHEMA
+        assert "No Kids" in [alt["desc"] for alt in app_module._stored_result(calc)["alternatives"]]
+        monkeypatch.setattr(app_module, "_calculate", lambda *args: pytest.fail("recomputed"))
+        resp = auth_client.get(f"/?load={Calculation.query.first().id}")
+        assert resp.status_code == 200
+        assert b"No Kids" in resp.data
+
+    def test_load_displays_stale_result_recalculated(self, app, auth_client):
+        from app import Calculation, _result_columns, _stored_result
+        self._set_profile(auth_client)
+        auth_client.post("/", data={"year": "2025", "income": "50000", "status": "single"})
+        calc = Calculation.query.first()
+        fresh = _stored_result(calc)
+        # a row stored as JSON, before results were versioned
+        for name in _result_columns(fresh):
+            setattr(calc, name, None)
+        calc.input_hash = None
+        calc.result_json = json.dumps({"meal_type": "card", "wages": 1})
+        db.session.commit()
+        resp = auth_client.get(f"/?load={calc.id}")
+        assert resp.status_code == 200
+        assert "{:,.2f} €".format(fresh["total_tax"]).encode() in resp.data
+        # the row itself is left to `flask reevaluate`
+        db.session.expire_all()
+        calc = Calculation.query.one()
+        assert calc.result_json is not None and calc.input_hash is None
+
+    def test_compact_result_round_trip(self, app, auth_client):
+        from app import Calculation, _stored_result
+        self._set_profile(auth_client, kids="5", category="B", activity_opened_month="01", activity_opened_year="22")
+        resp = auth_client.post("/", data={"year": "2025", "income": "50000", "expenses": "1000", "status": "joint"})
+        calc = Calculation.query.first()
+        assert calc.total_tax > 0 and len(calc.result_detail) < 300
+        # the page renders the same from the stored columns as right after the calculation
+        assert auth_client.get(f"/?load={calc.id}").data.count(b"No Kids") == resp.data.count(b"No Kids")
+        assert _stored_result(calc)["opened_at"] == "01/22"
+
+    def test_repeated_calculation_counts_hits(self, app, auth_client):
+        from app import Calculation
+        self._set_profile(auth_client)
+        for income in ("50000", "50,000", "60000", "50000"):
+            auth_client.post("/", data={"year": "2025", "income": income, "status": "single"})
+        calcs = Calculation.query.order_by(Calculation.timestamp.desc(), Calculation.id.desc()).all()
+        assert [(calc.income, calc.hit_count) for calc in calcs] == [(50000, 3), (60000, 1)]
+        items = auth_client.get("/api/v1/history").get_json()["items"]
+        assert [item["hit_count"] for item in items] == [3, 1]
+
     def test_joint_declaration(self, auth_client):
         self._set_profile(auth_client)
         resp = auth_client.post("/", data={"year": "2025", "income": "60000", "status": "joint"})
@@ -248,3 +302,462 @@ class TestCalculator:
         self._set_profile(auth_client, kids="5,8")
         resp = auth_client.post("/", data={"year": "2025", "income": "60000", "status": "single"})
         assert resp.status_code == 200
+        assert b"No Kids" in resp.data
+        assert b"Joint Declaration" in resp.data
+
+
+class TestCurve:
+    def test_requires_login(self, client):
+        resp = client.get("/curve", follow_redirects=False)
+        assert resp.status_code == 302
+
+    def test_returns_columns(self, auth_client):
+        resp = auth_client.get("/curve?start=0&stop=100000&step=1000&year=2025")
+        assert resp.status_code == 200
+        data = resp.get_json()
+        assert len(data["gross"]) == 101
+        assert set(data) == {"gross", "net_income", "total_tax", "effective_rate", "marginal_rate"}
+        assert data["net_income"][50] == round(50000 - data["total_tax"][50], 2)
+
+    def test_components_on_request(self, auth_client):
+        resp = auth_client.get("/curve?stop=1000&step=100&components=1")
+        assert "solidarity_tax" in resp.get_json()
+
+    def test_too_many_points_rejected(self, auth_client):
+        resp = auth_client.get("/curve?stop=10000000&step=1")
+        assert resp.status_code == 400
+
+    def test_invalid_grid_rejected(self, auth_client):
+        resp = auth_client.get("/curve?step=abc")
+        assert resp.status_code == 400
+
+
+class TestNetToGross:
+    def test_single_and_batch_targets(self, auth_client):
+        resp = auth_client.get("/net-to-gross?monthly_net=2000&monthly_net=3000&year=2025")
+        assert resp.status_code == 200
+        data = resp.get_json()
+        assert data["monthly_net"] == [2000, 3000]
+        assert data["gross"][0] < data["gross"][1]
+
+    def test_missing_target_rejected(self, auth_client):
+        assert auth_client.get("/net-to-gross").status_code == 400
+
+
+class TestApiCalculate:
+    def test_requires_auth(self, client):
+        resp = client.post("/api/v1/calculate", json={"income": 50000})
+        assert resp.status_code == 401
+        assert resp.get_json() == {"error": "unauthorized"}
+
+    def test_bearer_token(self, client, monkeypatch):
+        monkeypatch.setenv("API_TOKEN", "secret")
+        resp = client.post(
+            "/api/v1/calculate", json={"income": 50000}, headers={"Authorization": "Bearer secret"}
+        )
+        assert resp.status_code == 200
+        resp = client.post(
+            "/api/v1/calculate", json={"income": 50000}, headers={"Authorization": "Bearer wrong"}
+        )
+        assert resp.status_code == 401
+
+    def test_single_profile_matches_income(self, auth_client):
+        from model import Income
+        resp = auth_client.post("/api/v1/calculate", json={"income": 50000, "year": 2025, "kids": "3"})
+        assert resp.status_code == 200
+        data = resp.get_json()
+        expected = Income(income=50000, year=2025, kids="3").breakdown
+        assert data["income_tax"] == round(expected.income_tax, 2)
+        assert data["total_tax"] == round(expected.total_tax, 2)
+        assert "alternatives" not in data
+
+    def test_batch_with_alternatives(self, auth_client):
+        from model import Income, alternative_scenarios, compare_scenarios
+        profiles = [
+            {"income": 30000, "year": 2024},
+            {"income": 80000, "year": 2025, "status": "joint", "kids": "2,5", "residence": "nhr"},
+        ]
+        resp = auth_client.post("/api/v1/calculate?alternatives=1", json=profiles)
+        assert resp.status_code == 200
+        data = resp.get_json()
+        assert len(data) == 2
+        for profile, row in zip(profiles, data):
+            scenarios = alternative_scenarios(profile.get("residence", "r"), profile.get("status", "single"), profile.get("kids"))
+            _, expected = compare_scenarios(profile, scenarios)
+            assert [alt["desc"] for alt in row["alternatives"]] == [alt["desc"] for alt in expected]
+            assert [alt["gain"] for alt in row["alternatives"]] == [round(alt["gain"], 2) for alt in expected]
+            assert row["total_tax"] == round(Income(**profile).breakdown.total_tax, 2)
+
+    def test_alternatives_of_null_arguments(self, auth_client):
+        resp = auth_client.post("/api/v1/calculate?alternatives=1", json={"income": 50000, "year": 2025, "status": None})
+        assert [alt["desc"] for alt in resp.get_json()["alternatives"]] == ["Non-Habitual Resident", "Joint Declaration"]
+
+    def test_doesnt_store_calculations(self, auth_client):
+        from app import Calculation
+        auth_client.post("/api/v1/calculate", json={"income": 50000})
+        assert Calculation.query.count() == 0
+
+    def test_invalid_payloads_rejected(self, auth_client):
+        assert auth_client.post("/api/v1/calculate", json=[]).status_code == 400
+        assert auth_client.post("/api/v1/calculate", json={"year": 2025}).status_code == 400
+        assert auth_client.post("/api/v1/calculate", json={"income": 1, "foo": 1}).status_code == 400
+        assert auth_client.post("/api/v1/calculate", json={"income": 1, "residence": "xx"}).status_code == 400
+
+    @pytest.mark.parametrize("body, error", [
+        ('{"year": "2025", "income": 50000}', "year must be an integer"),
+        ('{"income": "50000"}', "income must be a number"),
+        ('{"income": true}', "income must be a number"),
+        ('{"income": 50000, "kids": 3}', "kids must be a string"),
+        ('{"income": 1e400}', "income must be a finite number"),
+        ('{"income": NaN}', "income must be a finite number"),
+        ('[{"income": 1}, {"income": 1, "expenses": "x"}]', "Profile 1: expenses must be a number"),
+        pytest.param(
+            '{"income": 1e307}', "The amounts are too large to calculate",
+            marks=pytest.mark.filterwarnings("ignore::RuntimeWarning"),
+        ),
+    ])
+    def test_wrong_types_rejected(self, auth_client, body, error):
+        resp = auth_client.post("/api/v1/calculate", data=body, content_type="application/json")
+        assert resp.status_code == 400
+        assert resp.get_json() == {"error": error}
+
+    @pytest.mark.parametrize("flag, expected", [("1", True), ("true", True), ("0", False), ("false", False), ("", False)])
+    def test_alternatives_flag(self, auth_client, flag, expected):
+        resp = auth_client.post(f"/api/v1/calculate?alternatives={flag}", json={"income": 50000})
+        assert ("alternatives" in resp.get_json()) == expected
+
+    def test_batch_size_limited(self, auth_client):
+        from app import API_MAX_BATCH
+        resp = auth_client.post("/api/v1/calculate", json=[{"income": 1}] * (API_MAX_BATCH + 1))
+        assert resp.status_code == 400
+
+
+class TestResultCache:
+    def test_identical_calculations_hit_the_cache(self, auth_client):
+        from app import result_cache
+        result_cache.clear()
+        before = result_cache.stats()
+        for _ in range(2):
+            resp = auth_client.post("/", data={"income": "43210", "year": "2025"})
+            assert resp.status_code == 200
+        after = result_cache.stats()
+        assert after["misses"] - before["misses"] == 1
+        assert after["hits"] - before["hits"] == 1
+
+    def test_stats_endpoint(self, auth_client):
+        resp = auth_client.get("/api/v1/stats")
+        assert resp.status_code == 200
+        assert {"hits", "misses", "evictions", "size"} <= set(resp.get_json()["result_cache"])
+
+
+class TestHistory:
+    def _add_calculations(self, count, timestamp=None):
+        from app import Calculation, User
+        user = User.query.filter_by(email="test@example.com").first()
+        for k in range(count):
+            db.session.add(Calculation(
+                user_id=user.id, year=2025, income=1000 * (k + 1), status="single",
+                timestamp=timestamp or datetime.datetime(2025, 1, 1) + datetime.timedelta(minutes=k // 3),
+                result_json=json.dumps({"total_tax": k, "monthly_net": k}),
+            ))
+        db.session.commit()
+
+    def _pages(self, client, limit):
+        incomes, before = [], None
+        while True:
+            url = f"/api/v1/history?limit={limit}" + (f"&before={before}" if before else "")
+            data = client.get(url).get_json()
+            incomes.append([item["income"] for item in data["items"]])
+            before = data["next_before"]
+            if before is None:
+                return incomes
+
+    def test_index_migrated(self, app):
+        from app import _migrate
+        db.session.execute(db.text("DROP INDEX ix_calculation_user_history"))
+        db.session.commit()
+        _migrate()
+        _migrate()
+        indexes = {index["name"] for index in db.inspect(db.engine).get_indexes("calculation")}
+        assert "ix_calculation_user_history" in indexes
+
+    def test_keyset_pages_cover_history_in_order(self, auth_client):
+        self._add_calculations(25)
+        pages = self._pages(auth_client, 10)
+        assert [len(page) for page in pages] == [10, 10, 5]
+        # newest first, rows sharing a timestamp ordered by id
+        assert sum(pages, []) == [1000.0 * k for k in range(25, 0, -1)]
+
+    def test_same_timestamp_rows_not_skipped(self, auth_client):
+        self._add_calculations(7, timestamp=datetime.datetime(2025, 1, 1))
+        assert sum(self._pages(auth_client, 3), []) == [1000.0 * k for k in range(7, 0, -1)]
+
+    def test_only_own_calculations(self, auth_client, app):
+        from app import Calculation
+        db.session.add(Calculation(user_id=999, year=2025, income=1))
+        db.session.commit()
+        assert auth_client.get("/api/v1/history").get_json()["items"] == []
+
+    def test_requires_login(self, client):
+        assert client.get("/api/v1/history").status_code == 401
+        assert client.get("/history").status_code == 302
+
+    def test_history_page(self, auth_client):
+        self._add_calculations(25)
+        resp = auth_client.get("/history")
+        assert resp.status_code == 200
+        assert b"Older" in resp.data
+        assert resp.data.count(b"?load=") == 20
+
+
+class TestWriteBehind:
+    def test_calculation_saved_by_the_writer(self, app, auth_client, monkeypatch):
+        import functools
+        from app import Calculation, _save_calculations
+        from writebehind import WriteBehind
+        writer = WriteBehind(functools.partial(_save_calculations, app), max_delay=60)
+        monkeypatch.setitem(app.extensions, "write_behind", writer)
+        resp = auth_client.post("/", data={"income": "50000", "year": "2025"})
+        assert resp.status_code == 200
+        assert writer.flush(5)
+        calc = Calculation.query.one()
+        assert calc.income == 50000
+        assert calc.timestamp is not None
+        writer.close()
+
+
+class TestMetrics:
+    @pytest.fixture()
+    def metrics_client(self):
+        flask_app = create_app({
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+            "SECRET_KEY": "testkey",
+            "WRITE_BEHIND_DELAY": 0,
+            "METRICS_ENABLED": True,
+        })
+        # no app context held across requests, so that every request loads its user
+        client = flask_app.test_client()
+        client.post("/register", data={"email": "test@example.com", "password": "password123"})
+        client.post("/login", data={"email": "test@example.com", "password": "password123"})
+        yield client
+        with flask_app.app_context():
+            db.drop_all()
+
+    def test_disabled_by_default(self, auth_client):
+        assert auth_client.get("/metrics").status_code == 404
+        assert "Server-Timing" not in auth_client.get("/").headers
+
+    def test_server_timing_phases(self, metrics_client):
+        from app import result_cache
+        result_cache.clear()
+        resp = metrics_client.post("/", data={"income": "51234", "year": "2025"})
+        phases = [entry.split(";")[0] for entry in resp.headers["Server-Timing"].split(", ")]
+        assert {"load_user", "calculate", "alternatives", "save", "history", "render", "db", "total"} <= set(phases)
+
+    def test_metrics_endpoint(self, metrics_client):
+        metrics_client.post("/", data={"income": "51234", "year": "2025"})
+        text = metrics_client.get("/metrics").get_data(as_text=True)
+        assert 'http_requests_total{method="POST",route="/",status="200"} ' in text
+        assert 'http_request_phase_seconds_count{phase="render",route="/"}' in text
+        assert "result_cache_hits_total" in text
+        assert "db_queries_total" in text
+
+
+class TestRatesReload:
+    @pytest.fixture()
+    def rates_file(self, tmp_path, monkeypatch):
+        import config
+        path = tmp_path / "rates.json"
+        path.write_text(open(config.RATES_PATH).read())
+        monkeypatch.setattr(config, "RATES_PATH", str(path))
+        monkeypatch.setattr(config, "SNAPSHOT_PATH", str(tmp_path / "rates.bin"))
+        monkeypatch.setattr(config, "_registry", None)
+        monkeypatch.setattr(config, "_registry_stamp", None)
+        return path
+
+    def change_rate(self, path):
+        data = json.loads(path.read_text())
+        data["2025"]["Mainland"]["rates"][0] += 0.05
+        path.write_text(json.dumps(data))
+
+    def test_deploy_reloads_rates(self, rates_file, client, monkeypatch):
+        import subprocess
+        from config import get_registry
+        monkeypatch.setenv("DEPLOY_TOKEN", "secret")
+        monkeypatch.setattr(subprocess, "run", lambda *a, **k: subprocess.CompletedProcess(a, 0, "Updated", ""))
+        before = get_registry().version
+        self.change_rate(rates_file)
+        data = client.post("/deploy", headers={"Authorization": "Bearer secret"}).get_json()
+        assert data["rates_reloaded"] is True
+        assert data["rates_version"] == get_registry().version != before
+
+    def test_requests_pick_up_changed_rates(self, rates_file, auth_client, app):
+        app.config["RATES_RELOAD_INTERVAL"] = 0.001
+        profile = {"income": 30000, "year": 2025}
+        before = auth_client.post("/api/v1/calculate", json=profile).get_json()
+        self.change_rate(rates_file)
+        after = auth_client.post("/api/v1/calculate", json=profile).get_json()
+        assert after["total_tax"] > before["total_tax"]
+
+
+class TestReevaluate:
+    @pytest.fixture()
+    def calculations(self, app, auth_client):
+        """Four calculations: current, from other rates with the same and a wrong total, and an invalid one."""
+        from app import Calculation
+        for income in (20000, 40000, 60000, 80000):
+            auth_client.post("/", data={"income": str(income), "year": "2025"})
+        calcs = Calculation.query.order_by(Calculation.id).all()
+        for calc in calcs[1:]:
+            calc.rates_version = "0000000000000000"
+        calcs[2].total_tax += 100
+        calcs[3].year = 2019
+        db.session.commit()
+        return [calc.id for calc in calcs]
+
+    def run(self, app, *args):
+        result = app.test_cli_runner().invoke(args=["reevaluate", *args])
+        assert result.exit_code == 0, result.output
+        return result.output
+
+    def test_recalculates_stale_results(self, app, calculations, tmp_path):
+        from app import Calculation, _stored_result
+        report = tmp_path / "report.csv"
+        output = self.run(app, "--chunk-size", "2", "--report", str(report))
+        assert "up to id" in output and "4 scanned, 2 recalculated, 1 changed, 1 failed" in output
+        rows = report.read_text().splitlines()
+        assert rows[0].startswith("id,user_id") and len(rows) == 2
+        assert rows[1].startswith(f"{calculations[2]},") and rows[1].endswith(",-100.0")
+        db.session.expire_all()
+        for calc_id in calculations[:3]:
+            assert _stored_result(db.session.get(Calculation, calc_id)) is not None
+
+    def test_matches_page_result(self, app, auth_client, calculations):
+        from app import Calculation, _stored_result
+        expected = _stored_result(db.session.get(Calculation, calculations[0]))
+        self.run(app, "--all")
+        db.session.expire_all()
+        saved = _stored_result(db.session.get(Calculation, calculations[0]))
+        # the batch engine gives the same result as the calculator page
+        alternatives = saved.pop("alternatives")
+        for alternative, page in zip(alternatives, expected.pop("alternatives"), strict=True):
+            assert alternative == pytest.approx(page)
+        assert saved.keys() == expected.keys()
+        for key, value in expected.items():
+            assert saved[key] == (pytest.approx(value) if isinstance(value, float) else value)
+
+    def test_not_counted_as_page_traffic(self, app, calculations):
+        from app import metrics_registry
+
+        def page_calculations():
+            lines = metrics_registry.render().splitlines()
+            return [line for line in lines if line.startswith('calculations_total{source="page"}')]
+
+        before = page_calculations()
+        # the invalid row makes its chunk fall back to the calculation one by one
+        assert "1 failed" in self.run(app, "--all", "--chunk-size", "4")
+        assert page_calculations() == before
+
+    def test_dry_run_saves_nothing(self, app, calculations):
+        from app import Calculation
+        before = [db.session.get(Calculation, calc_id).rates_version for calc_id in calculations]
+        assert "1 changed" in self.run(app, "--dry-run")
+        db.session.expire_all()
+        assert [db.session.get(Calculation, calc_id).rates_version for calc_id in calculations] == before
+
+    def test_resumes_from_checkpoint(self, app, calculations, tmp_path):
+        checkpoint = tmp_path / "checkpoint"
+        checkpoint.write_text(str(calculations[1]))
+        output = self.run(app, "--checkpoint", str(checkpoint))
+        assert "2 scanned, 1 recalculated, 1 changed, 1 failed" in output
+        assert checkpoint.read_text() == str(calculations[3])
+        assert "0 recalculated" in self.run(app, "--checkpoint", str(checkpoint))
+
+
+class TestCompact:
+    def _json_rows(self, auth_client):
+        """Calculations saved as before the compact columns: current, stale and repeated."""
+        from app import Calculation, _result_columns, _stored_result
+        from config import get_registry
+        for income in (30000, 40000, 30000):
+            auth_client.post("/", data={"income": str(income), "year": "2025", "meal_allowance": "8"})
+        # the repeat was merged when saved, split it again as older versions stored it
+        calcs = Calculation.query.order_by(Calculation.id).all()
+        calcs.append(Calculation(user_id=calcs[0].user_id, year=2025, income=30000, residence="r",
+                                 region="Mainland", category="A", status="single", expenses=0))
+        db.session.add(calcs[-1])
+        results = [_stored_result(calcs[0]), _stored_result(calcs[1]), _stored_result(calcs[0])]
+        for k, (calc, result) in enumerate(zip(calcs, results)):
+            for name in _result_columns(result):
+                setattr(calc, name, None)
+            calc.input_hash, calc.hit_count = None, 1
+            version = get_registry().version if k != 1 else "0000000000000000"
+            calc.result_json = json.dumps({**result, "schema": 2, "rates_version": version})
+        db.session.commit()
+        return [calc.id for calc in calcs]
+
+    def test_json_rows_compacted_and_merged(self, app, auth_client):
+        from app import Calculation, _stored_result
+        ids = self._json_rows(auth_client)
+        result = app.test_cli_runner().invoke(args=["compact"])
+        assert result.exit_code == 0, result.output
+        assert "0 deleted, 3 converted, 1 merged" in result.output
+        db.session.expire_all()
+        calcs = Calculation.query.order_by(Calculation.id).all()
+        assert [calc.id for calc in calcs] == ids[1:]
+        assert all(calc.result_json is None and calc.input_hash for calc in calcs)
+        assert [calc.hit_count for calc in calcs] == [1, 2]
+        # the stale row keeps its totals and inputs, and is recalculated when loaded
+        assert _stored_result(calcs[0]) is None and calcs[0].total_tax and calcs[0].meal_allowance_daily == 8
+        assert _stored_result(calcs[1])["meal_allowance_daily"] == 8
+        resp = auth_client.get(f"/?load={calcs[0].id}")
+        assert resp.status_code == 200
+        assert "{:,.2f} €".format(calcs[0].total_tax).encode() in resp.data
+
+    def test_retention(self, app, auth_client):
+        from app import Calculation, _compact_calculations
+        for income in (30000, 40000):
+            auth_client.post("/", data={"income": str(income), "year": "2025"})
+        Calculation.query.filter_by(income=30000).one().timestamp = datetime.datetime(2020, 1, 1)
+        db.session.commit()
+        stats = _compact_calculations(keep_days=365, vacuum=False)
+        assert stats["deleted"] == 1
+        assert [calc.income for calc in Calculation.query.all()] == [40000]
+
+    def test_columns_migrated(self, app):
+        from app import _migrate
+        db.session.execute(db.text("DROP TABLE calculation"))
+        db.session.execute(db.text(
+            "CREATE TABLE calculation (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, timestamp DATETIME, "
+            "year INTEGER, income FLOAT, residence VARCHAR(10), region VARCHAR(20), category VARCHAR(2), "
+            "kids VARCHAR(100), activity_opened VARCHAR(10), expenses FLOAT, status VARCHAR(10), result_json TEXT)"
+        ))
+        db.session.execute(db.text("INSERT INTO calculation (user_id, income) VALUES (1, 1000)"))
+        db.session.commit()
+        _migrate()
+        _migrate()
+        columns = {column["name"] for column in db.inspect(db.engine).get_columns("calculation")}
+        assert {"input_hash", "hit_count", "total_tax", "result_detail", "rates_version"} <= columns
+        assert db.session.execute(db.text("SELECT hit_count FROM calculation")).scalar() == 1
+
+
+# ---------------------------------------------------------------------------
+# WSGI entry points
+# ---------------------------------------------------------------------------
+
+class TestEntryPoints:
+    @pytest.mark.parametrize("statement", [
+        "from app import app as application",
+        "from wsgi import application",
+    ])
+    def test_deployed_wsgi_files_import(self, tmp_path, statement):
+        import os
+        import subprocess
+        import sys
+
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{tmp_path / 'taxes.db'}"}
+        code = f"{statement}; print(application.test_client().get('/login').status_code)"
+        result = subprocess.run([sys.executable, "-c", code], cwd=root, env=env, capture_output=True, text=True)
+        assert result.stdout.strip() == "200", result.stderr
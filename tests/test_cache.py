@@ -0,0 +1,119 @@
+"""
+Tests for the calculation result cache (cache.py).
+"""
+import threading
+
+import pytest
+
+from cache import ResultCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+# ---------------------------------------------------------------------------
+# LRU and TTL
+# ---------------------------------------------------------------------------
+
+class TestResultCache:
+    def test_hit_after_miss(self):
+        cache = ResultCache(maxsize=2)
+        calls = []
+        for _ in range(3):
+            assert cache.get_or_compute("a", lambda: calls.append(1) or 42) == 42
+        assert len(calls) == 1
+        assert cache.stats()["hits"] == 2
+        assert cache.stats()["misses"] == 1
+
+    def test_least_recently_used_evicted(self):
+        cache = ResultCache(maxsize=2)
+        cache.get_or_compute("a", lambda: 1)
+        cache.get_or_compute("b", lambda: 2)
+        cache.get_or_compute("a", lambda: 1)
+        cache.get_or_compute("c", lambda: 3)
+        assert cache.get_or_compute("a", lambda: "recomputed") == 1
+        assert cache.get_or_compute("b", lambda: "recomputed") == "recomputed"
+        assert cache.stats()["evictions"] == 2
+        assert cache.stats()["size"] == 2
+
+    def test_zero_size_disables_caching(self):
+        cache = ResultCache(maxsize=0)
+        cache.get_or_compute("a", lambda: 1)
+        assert cache.get_or_compute("a", lambda: 2) == 2
+
+    def test_ttl_expiry(self):
+        clock = FakeClock()
+        cache = ResultCache(ttl=10, clock=clock)
+        cache.get_or_compute("a", lambda: 1)
+        clock.now = 9
+        assert cache.get_or_compute("a", lambda: 2) == 1
+        clock.now = 10
+        assert cache.get_or_compute("a", lambda: 2) == 2
+        assert cache.stats()["expirations"] == 1
+
+    def test_errors_are_not_cached(self):
+        cache = ResultCache()
+        with pytest.raises(ValueError):
+            cache.get_or_compute("a", lambda: int("x"))
+        assert cache.get_or_compute("a", lambda: 1) == 1
+
+
+# ---------------------------------------------------------------------------
+# Single-flight
+# ---------------------------------------------------------------------------
+
+class TestSingleFlight:
+    def run_concurrently(self, cache, compute, threads=8):
+        results = []
+
+        def call():
+            try:
+                results.append(cache.get_or_compute("key", compute))
+            except ValueError as e:
+                results.append(e)
+
+        workers = [threading.Thread(target=call) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        return workers, results
+
+    def test_identical_requests_computed_once(self):
+        cache = ResultCache()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return "value"
+
+        workers, results = self.run_concurrently(cache, compute)
+        while cache.stats()["coalesced"] < len(workers) - 1:
+            threading.Event().wait(0.001)
+        release.set()
+        for worker in workers:
+            worker.join()
+        assert calls == [1]
+        assert results == ["value"] * len(workers)
+
+    def test_waiters_get_the_error(self):
+        cache = ResultCache()
+        release = threading.Event()
+
+        def compute():
+            release.wait(5)
+            raise ValueError("boom")
+
+        workers, results = self.run_concurrently(cache, compute, threads=3)
+        while cache.stats()["coalesced"] < 2:
+            threading.Event().wait(0.001)
+        release.set()
+        for worker in workers:
+            worker.join()
+        assert [str(result) for result in results] == ["boom"] * 3
+        assert cache.stats()["size"] == 0
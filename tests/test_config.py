@@ -0,0 +1,249 @@
+"""
+Tests for the rate table registry (config.py).
+"""
+import json
+
+import pytest
+
+import config
+from config import compile_schedule, get_allowance_limits, get_registry, get_tax_data, get_tax_table
+from model import Income
+
+
+# ---------------------------------------------------------------------------
+# Compiled schedules
+# ---------------------------------------------------------------------------
+
+class TestCompileSchedule:
+    def test_cumulative_tax_at_each_threshold(self):
+        schedule = compile_schedule([10, 30], [0.1, 0.2, 0.5])
+        assert schedule.cumulative == (0, 10 * 0.1, 10 * 0.1 + 20 * 0.2)
+
+    def test_rates_length_mismatch_raises(self):
+        with pytest.raises(ValueError, match="one rate more"):
+            compile_schedule([10, 30], [0.1, 0.2])
+
+    def test_schedule_is_immutable(self):
+        schedule = compile_schedule([10], [0.1, 0.2])
+        assert isinstance(schedule.thresholds, tuple)
+        with pytest.raises(AttributeError):
+            schedule.rates = (0.3, 0.4)
+
+
+# ---------------------------------------------------------------------------
+# Registry
+# ---------------------------------------------------------------------------
+
+class TestRegistry:
+    def test_rates_file_parsed_once(self, tmp_path, monkeypatch):
+        calls = []
+        original = config.decode_tax_data
+        monkeypatch.setattr(config, "SNAPSHOT_PATH", str(tmp_path / "rates.bin"))
+        monkeypatch.setattr(config, "_registry", None)
+        monkeypatch.setattr(
+            config, "decode_tax_data", lambda source: calls.append(source) or original(source)
+        )
+        for _ in range(3):
+            get_tax_table(2025, "Mainland")
+            get_allowance_limits(2025)
+        assert len(calls) == 1
+
+    def test_table_contents(self):
+        table = get_tax_table(2025, "Mainland")
+        assert table.ias == 522.5
+        assert table.schedule.thresholds[0] == 8059
+        assert table.allowances["meal_card_daily"] == 10.2
+
+    def test_unknown_table_returns_none(self):
+        assert get_tax_table(2019, "Mainland") is None
+        assert get_tax_data(2025, "Algarve") is None
+
+    def test_tax_data_matches_registry(self):
+        data = get_tax_data(2024, "Madeira")
+        table = get_registry().table(2024, "Madeira")
+        assert data["brackets"] == list(table.schedule.thresholds)
+        assert data["rates"] == list(table.schedule.rates)
+        assert data["ias"] == table.ias
+
+    def test_allowance_limits_are_copies(self):
+        limits = get_allowance_limits(2025)
+        limits["telework_daily"] = 99
+        assert get_allowance_limits(2025)["telework_daily"] == 1.0
+
+    def test_allowance_limits_fallback(self):
+        assert get_allowance_limits(2019) == {
+            "meal_cash_daily": 6.00, "meal_card_daily": 10.20, "telework_daily": 1.00
+        }
+
+    def test_version_follows_content(self):
+        assert get_registry().version == config.RateRegistry(
+            config.load_tax_data_from_json(config.RATES_PATH)
+        ).version
+        changed = config.load_tax_data_from_json(config.RATES_PATH)
+        changed["2025"]["Mainland"]["rates"][0] += 0.01
+        assert config.RateRegistry(changed).version != get_registry().version
+
+
+# ---------------------------------------------------------------------------
+# Validation and snapshot
+# ---------------------------------------------------------------------------
+
+def rates_data():
+    return config.load_tax_data_from_json(config.RATES_PATH)
+
+
+class TestValidate:
+    def test_shipped_rates_are_valid(self):
+        config.validate_tax_data(rates_data())
+
+    @pytest.mark.parametrize("change, message", [
+        (lambda data: data["2025"]["Mainland"]["rates"].pop(), "one value more"),
+        (lambda data: data["2025"]["Mainland"]["brackets"].reverse(), "increasing"),
+        (lambda data: data["2025"]["Madeira"].update(rates=[0.1, "x"]), "fractions"),
+        (lambda data: data["2025"]["Azores"].pop("ias"), "brackets, rates and ias"),
+        (lambda data: data["2025"]["allowances"].pop("telework_daily"), "exactly"),
+        (lambda data: data.update(next={}), "years"),
+    ])
+    def test_invalid_rates_raise(self, change, message):
+        data = rates_data()
+        change(data)
+        with pytest.raises(ValueError, match=message):
+            config.validate_tax_data(data)
+
+    def test_every_problem_listed(self):
+        data = rates_data()
+        data["2024"]["Mainland"]["ias"] = 0
+        data["2023"]["Azores"]["rates"].append(0.5)
+        with pytest.raises(ValueError) as error:
+            config.validate_tax_data(data)
+        assert "2024/Mainland" in str(error.value) and "2023/Azores" in str(error.value)
+
+
+class TestSnapshot:
+    @pytest.fixture()
+    def source(self):
+        with open(config.RATES_PATH, "rb") as file:
+            return file.read()
+
+    def test_round_trip(self, source, tmp_path):
+        path = str(tmp_path / "rates.bin")
+        registry = config.RateRegistry(rates_data())
+        config.write_snapshot(registry, source, path)
+        loaded = config.read_snapshot(source, path)
+        assert loaded.version == registry.version
+        assert dict(loaded.tables) == dict(registry.tables)
+        assert {year: dict(limits) for year, limits in loaded.allowances.items()} == {
+            year: dict(limits) for year, limits in registry.allowances.items()
+        }
+
+    def test_other_source_rejected(self, source, tmp_path):
+        path = str(tmp_path / "rates.bin")
+        config.write_snapshot(config.RateRegistry(rates_data()), source, path)
+        assert config.read_snapshot(source + b" ", path) is None
+
+    def test_corrupt_snapshot_rejected(self, source, tmp_path):
+        path = tmp_path / "rates.bin"
+        config.write_snapshot(config.RateRegistry(rates_data()), source, str(path))
+        data = bytearray(path.read_bytes())
+        data[-1] ^= 0xFF
+        path.write_bytes(bytes(data))
+        assert config.read_snapshot(source, str(path)) is None
+        assert config.read_snapshot(source, str(tmp_path / "missing.bin")) is None
+
+    def test_registry_written_then_loaded_without_json(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(config, "SNAPSHOT_PATH", str(tmp_path / "rates.bin"))
+        monkeypatch.setattr(config, "_registry", None)
+        version = get_registry().version
+        assert (tmp_path / "rates.bin").exists()
+        monkeypatch.setattr(config, "_registry", None)
+        monkeypatch.setattr(config, "decode_tax_data", lambda source: pytest.fail("JSON decoded"))
+        assert get_registry().version == version
+
+    def test_snapshot_built_from_the_bytes_it_is_keyed_on(self, tmp_path, monkeypatch):
+        path = tmp_path / "rates.json"
+        source = open(config.RATES_PATH, "rb").read()
+        path.write_bytes(source)
+        monkeypatch.setattr(config, "RATES_PATH", str(path))
+        monkeypatch.setattr(config, "SNAPSHOT_PATH", str(tmp_path / "rates.bin"))
+        original = config.decode_tax_data
+
+        def edited_meanwhile(data):
+            # rates.json changes between the read of its bytes and their decoding
+            changed = json.loads(data)
+            changed["2025"]["Mainland"]["rates"][0] += 0.01
+            path.write_text(json.dumps(changed))
+            return original(data)
+
+        monkeypatch.setattr(config, "decode_tax_data", edited_meanwhile)
+        registry = config._load_registry()
+        snapshot = config.read_snapshot(source, str(tmp_path / "rates.bin"))
+        assert snapshot.version == registry.version
+        assert snapshot.table(2025, "Mainland").schedule.rates[0] == get_tax_table(2025, "Mainland").schedule.rates[0]
+
+
+# ---------------------------------------------------------------------------
+# Reload
+# ---------------------------------------------------------------------------
+
+class TestReload:
+    @pytest.fixture()
+    def rates_file(self, tmp_path, monkeypatch):
+        path = tmp_path / "rates.json"
+        path.write_text(open(config.RATES_PATH).read())
+        monkeypatch.setattr(config, "RATES_PATH", str(path))
+        monkeypatch.setattr(config, "SNAPSHOT_PATH", str(tmp_path / "rates.bin"))
+        monkeypatch.setattr(config, "_registry", None)
+        monkeypatch.setattr(config, "_registry_stamp", None)
+        get_registry()
+        return path
+
+    def change_rate(self, path, delta=0.01):
+        data = json.loads(path.read_text())
+        data["2025"]["Mainland"]["rates"][0] += delta
+        path.write_text(json.dumps(data))
+
+    def test_unchanged_file_not_parsed(self, rates_file, monkeypatch):
+        monkeypatch.setattr(config, "decode_tax_data", lambda source: pytest.fail("parsed again"))
+        assert config.reload_registry() is None
+
+    def test_changed_file_swaps_registry(self, rates_file):
+        before = get_registry()
+        self.change_rate(rates_file)
+        registry = config.reload_registry()
+        assert registry is get_registry()
+        assert registry.version != before.version
+        rate = before.table(2025, "Mainland").schedule.rates[0]
+        assert registry.table(2025, "Mainland").schedule.rates[0] == pytest.approx(rate + 0.01)
+
+    def test_same_content_keeps_registry(self, rates_file):
+        before = get_registry()
+        assert config.reload_registry(force=True) is None
+        assert get_registry() is before
+
+    def test_invalid_file_keeps_registry(self, rates_file):
+        before = get_registry()
+        rates_file.write_text("{not json")
+        assert config.reload_registry() is None
+        rates_file.write_text('{"2025": {"Mainland": {"brackets": [1], "rates": [0.1]}}}')
+        assert config.reload_registry() is None
+        assert get_registry() is before
+
+    def test_pinned_registry_survives_reload(self, rates_file):
+        before = get_registry()
+        token = config.pin_registry()
+        try:
+            self.change_rate(rates_file)
+            assert config.reload_registry() is not None
+            assert get_registry() is before
+            assert Income(year=2025, income=30000)._registry is before
+        finally:
+            config.unpin_registry(token)
+        assert get_registry() is not before
+
+    def test_income_keeps_its_registry(self, rates_file):
+        income = Income(year=2025, income=30000)
+        tax = income.income_tax
+        self.change_rate(rates_file, 0.05)
+        config.reload_registry()
+        assert income.evolve(income=30000).income_tax == tax
+        assert Income(year=2025, income=30000).income_tax > tax
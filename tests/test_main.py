@@ -0,0 +1,91 @@
+"""
+Tests for the command line front-end (main.py), batch mode in particular.
+"""
+import csv
+import io
+
+import pytest
+
+from main import main, read_rows, run_batch
+from model import Income
+
+
+def run(text, defaults=None, chunk_size=2, workers=1):
+    out = io.StringIO()
+    run_batch(read_rows(io.StringIO(text)), defaults or {}, chunk_size, out, workers)
+    return list(csv.DictReader(io.StringIO(out.getvalue())))
+
+
+class TestBatch:
+    def test_csv_rows_match_income(self):
+        rows = run(
+            "income,year,status,kids,opened_at\n"
+            "50000,2025,single,,\n"
+            '60000,2024,joint,"2,5",\n'
+            "40000,2025,,,01/24\n"
+        )
+        expected = [
+            Income(year=2025, income=50000),
+            Income(year=2024, income=60000, status="joint", kids="2,5"),
+            Income(year=2025, income=40000, opened_at="01/24"),
+        ]
+        assert len(rows) == 3
+        for row, inc in zip(rows, expected):
+            assert float(row["income_tax"]) == round(inc.income_tax, 2)
+            assert float(row["total_tax"]) == round(inc.breakdown.total_tax, 2)
+
+    def test_json_lines_with_defaults(self):
+        rows = run('{"income": 40000}\n\n{"income": 30000, "residence": "r"}\n', {"year": 2025, "residence": "nr"})
+        assert float(rows[0]["income_tax"]) == 10000
+        assert float(rows[1]["income_tax"]) == round(Income(year=2025, income=30000).income_tax, 2)
+
+    def test_workers_keep_input_order(self):
+        text = "income,year\n" + "".join(f"{1000 * k},2025\n" for k in range(1, 30))
+        assert run(text, chunk_size=3, workers=2) == run(text, chunk_size=3)
+
+    def test_empty_input_writes_header_only(self):
+        assert run("") == []
+
+    def test_invalid_row_reports_its_chunk(self):
+        with pytest.raises(ValueError, match="rows 3-4: .*residence"):
+            run("income,residence\n1,r\n2,r\n3,r\n4,xx\n")
+
+    def test_unknown_column_raises(self):
+        with pytest.raises(ValueError, match="Unknown arguments: yaer"):
+            run("income,yaer\n50000,2026\n")
+
+    def test_missing_income_raises(self):
+        with pytest.raises(ValueError, match="gross income"):
+            run("year\n2025\n")
+
+
+class TestMain:
+    def test_batch_from_file(self, tmp_path, capsys):
+        path = tmp_path / "rows.csv"
+        path.write_text("income\n50000\n")
+        main(["--batch", str(path), "-y", "2025"])
+        out = capsys.readouterr().out.splitlines()
+        assert out[0].startswith("income,income_tax")
+        assert out[1].startswith("50000.00,")
+
+    @pytest.mark.parametrize("size", ["0", "-5"])
+    def test_chunk_size_below_one_rejected(self, tmp_path, size):
+        path = tmp_path / "rows.csv"
+        path.write_text("income\n50000\n")
+        with pytest.raises(SystemExit):
+            main(["--batch", str(path), "--chunk-size", size])
+
+    def test_single_income_requires_category(self):
+        with pytest.raises(SystemExit):
+            main(["50000"])
+
+    def test_unreachable_target_net(self, capsys):
+        with pytest.raises(SystemExit):
+            main(["-a", "--target-net", "-100"])
+        assert "Traceback" not in capsys.readouterr().err
+
+    def test_explain(self, capsys):
+        main(["50000", "-a", "-y", "2025", "--explain"])
+        out = capsys.readouterr().out
+        assert "taxable_base" in out
+        assert "Computed:" in out
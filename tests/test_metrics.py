@@ -0,0 +1,64 @@
+"""
+Tests for the request timing and metrics registry (metrics.py).
+"""
+from metrics import Registry, add_time, server_timing, start_timing, stop_timing, timed
+
+
+# ---------------------------------------------------------------------------
+# Phase timing
+# ---------------------------------------------------------------------------
+
+class TestTiming:
+    def test_phases_accumulate(self):
+        token = start_timing()
+        for _ in range(2):
+            with timed("calculate"):
+                pass
+        add_time("db", 0.5)
+        add_time("db", 0.25)
+        timings = stop_timing(token)
+        assert set(timings) == {"calculate", "db"}
+        assert timings["db"] == 0.75
+
+    def test_noop_outside_a_timed_request(self):
+        with timed("calculate"):
+            add_time("db", 1)
+        token = start_timing()
+        assert stop_timing(token) == {}
+
+    def test_server_timing_header(self):
+        assert server_timing({"db": 0.0012}, 0.01) == "db;dur=1.20, total;dur=10.00"
+
+
+# ---------------------------------------------------------------------------
+# Registry
+# ---------------------------------------------------------------------------
+
+class TestRegistry:
+    def test_counters(self):
+        registry = Registry()
+        registry.describe("requests_total", "counter", "Requests")
+        registry.inc("requests_total", route="/", status=200)
+        registry.inc("requests_total", 2, route="/", status=200)
+        text = registry.render()
+        assert "# HELP requests_total Requests" in text
+        assert "# TYPE requests_total counter" in text
+        assert 'requests_total{route="/",status="200"} 3' in text
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry()
+        for seconds in (0.0005, 0.003, 0.003, 20):
+            registry.observe("latency_seconds", seconds, route="/")
+        lines = registry.render().splitlines()
+        assert 'latency_seconds_bucket{route="/",le="0.001"} 1' in lines
+        assert 'latency_seconds_bucket{route="/",le="0.005"} 3' in lines
+        assert 'latency_seconds_bucket{route="/",le="10.0"} 3' in lines
+        assert 'latency_seconds_bucket{route="/",le="+Inf"} 4' in lines
+        assert 'latency_seconds_count{route="/"} 4' in lines
+
+    def test_collectors_read_at_render(self):
+        registry = Registry()
+        value = {"size": 1}
+        registry.collector(lambda: [("cache_entries", "gauge", "Entries", value["size"], {})])
+        value["size"] = 7
+        assert "cache_entries 7" in registry.render()
@@ -5,8 +5,12 @@ Reference values are computed from the 2025 Mainland brackets/rates and IAS=522.
   specific_deduction = 8.54 * 522.5 = 4462.15
   SS (Cat A)          = income * 0.11
 """
+import numpy as np
 import pytest
-from model import Income
+from model import (
+    Income, Scenario, alternative_scenarios, compare_scenarios, compile_profile, compute_batch, gross_for_net,
+    income_curve, map_batches, tracing,
+)
 
 
 # ---------------------------------------------------------------------------
@@ -165,6 +169,37 @@ class TestResidentProgressiveTax:
         assert mainland.income_tax > azores.income_tax
 
 
+def numpy_progressive_taxation(income, thresholds, rates):
+    """The original array-based implementation, kept as a reference."""
+    thresholds = np.array(thresholds)
+    rates = np.array(rates)
+    difference = thresholds - np.hstack((0, thresholds[:-1]))
+    indexes = thresholds <= income
+    return round(
+        sum([threshold * rate for threshold, rate in zip(difference[indexes], rates[:-1][indexes])])
+        + rates[sum(indexes)] * (income - (thresholds[sum(indexes) - 1] if sum(indexes) != 0 else 0)),
+        2,
+    )
+
+
+class TestProgressiveTaxation:
+    def test_bit_identical_to_numpy_implementation(self):
+        rng = np.random.default_rng(42)
+        incomes = np.concatenate([
+            rng.uniform(0, 400000, 2000),
+            np.round(rng.uniform(0, 400000, 2000), 2),
+            [0, 8059, 8059.005, 83696, 75000, 80000, 300000],
+        ])
+        brackets = [8059, 12160, 17233, 22306, 28400, 41629, 44987, 83696]
+        rates = [0.125, 0.16, 0.215, 0.244, 0.314, 0.349, 0.431, 0.446, 0.48]
+        for income in incomes.tolist():
+            expected = numpy_progressive_taxation(income, brackets, rates)
+            assert Income.progressive_taxation(income, brackets, rates) == expected
+
+    def test_zero_income(self):
+        assert Income.progressive_taxation(0, [100], [0.1, 0.2]) == 0
+
+
 # ---------------------------------------------------------------------------
 # Category B taxable base
 # ---------------------------------------------------------------------------
@@ -246,3 +281,304 @@ class TestYears:
     def test_specific_deduction_fixed_2023(self):
         inc = Income(year=2023, income=50000)
         assert inc.specific_deduction == 4104
+
+
+# ---------------------------------------------------------------------------
+# Breakdown
+# ---------------------------------------------------------------------------
+
+class TestBreakdown:
+    def test_properties_are_views_of_breakdown(self):
+        inc = make(60000, status="joint", kids="2")
+        b = inc.breakdown
+        assert inc.income_tax == b.income_tax
+        assert inc.taxable_base == b.taxable_base
+        assert inc.family_quotient == b.family_quotient
+        assert b.total_tax == b.income_tax + b.social_security_tax + b.solidarity_tax
+        assert b.net_income == 60000 - b.total_tax
+
+    def test_each_step_evaluated_once(self, monkeypatch):
+        calls = []
+        original = Income._social_security_tax
+        monkeypatch.setattr(
+            Income, "_social_security_tax", lambda self, *a: calls.append(1) or original(self, *a)
+        )
+        inc = make(60000, opened_at="01/24")
+        inc.income_tax, inc.taxable_base, inc.social_security_tax, inc.solidarity_tax
+        assert len(calls) == 1
+
+    def test_breakdown_is_immutable(self):
+        b = make(30000).breakdown
+        with pytest.raises(AttributeError):
+            b.income_tax = 0
+
+
+# ---------------------------------------------------------------------------
+# Alternative scenarios
+# ---------------------------------------------------------------------------
+
+class TestScenarios:
+    ARGUMENTS = dict(year=2025, income=60000, residence="r", region="Madeira", status="single", kids="2,5")
+
+    def test_default_alternatives(self):
+        descs = [s.desc for s in alternative_scenarios("r", "single", "2,5")]
+        assert descs == ["Non-Habitual Resident", "Joint Declaration", "No Kids"]
+        assert [s.desc for s in alternative_scenarios("nr")] == ["Non-Habitual Resident"]
+        assert alternative_scenarios("nhr", "joint") == []
+
+    def test_rows_match_independent_calculations(self):
+        scenarios = alternative_scenarios("r", "single", "2,5")
+        base, rows = compare_scenarios(self.ARGUMENTS, scenarios)
+        for scenario, row in zip(scenarios, rows):
+            expected = Income(**{**self.ARGUMENTS, **scenario.overrides}).breakdown.total_tax
+            assert row["total_tax"] == expected
+            assert row["gain"] == base.breakdown.total_tax - expected
+            assert row["monthly_net"] == (60000 - expected) / 12
+
+    def test_invariant_steps_are_shared(self, monkeypatch):
+        calls = []
+        original = Income._social_security_tax
+        monkeypatch.setattr(
+            Income, "_social_security_tax", lambda self, *a: calls.append(1) or original(self, *a)
+        )
+        compare_scenarios(self.ARGUMENTS, alternative_scenarios("r", "single", "2,5"))
+        assert len(calls) == 1
+
+    def test_invalid_scenario_is_skipped(self):
+        _, rows = compare_scenarios(self.ARGUMENTS, [Scenario("Bad", {"status": "married"})])
+        assert rows == []
+
+
+# ---------------------------------------------------------------------------
+# Vectorized batch engine
+# ---------------------------------------------------------------------------
+
+BATCH_PROFILES = [
+    dict(year=2025, income=50000),
+    dict(year=2023, income=8000),
+    dict(year=2024, income=120000, region="Madeira", status="joint", kids="2,5"),
+    dict(year=2026, income=310000, region="Azores", kids="1"),
+    dict(year=2025, income=40000, residence="nr"),
+    dict(year=2025, income=40000, residence="nhr", region="Azores"),
+    dict(year=2025, income=60000, opened_at="01/24", expenses=5000),
+    dict(year=2025, income=60000, opened_at="07/25", status="joint", kids="3"),
+    dict(year=2024, income=35000, telework_allowance=600, meal_allowance=2900, meal_type="cash"),
+    dict(year=2025, income=12345.67, meal_allowance=2692.8),
+]
+
+
+def compute_chunk(columns):
+    """Module-level so that worker processes can unpickle it."""
+    return compute_batch(**columns)
+
+
+class TestComputeBatch:
+    def test_matches_scalar_income(self):
+        columns = {
+            key: [profile.get(key, default) for profile in BATCH_PROFILES]
+            for key, default in [
+                ("income", None), ("year", 2023), ("residence", "r"), ("region", "Mainland"),
+                ("opened_at", None), ("expenses", 0), ("status", "single"), ("kids", None),
+                ("telework_allowance", 0), ("meal_allowance", 0), ("meal_type", "card"),
+            ]
+        }
+        out = compute_batch(**columns)
+        for k, profile in enumerate(BATCH_PROFILES):
+            inc = Income(**profile)
+            assert out["income_tax"][k] == inc.income_tax
+            assert out["social_security"][k] == inc.social_security_tax
+            assert out["solidarity_tax"][k] == inc.solidarity_tax
+
+    def test_scalar_columns_are_broadcast(self):
+        out = compute_batch([30000, 60000], year=2025, status="joint")
+        assert out["income_tax"][1] == make(60000, status="joint").income_tax
+        assert len(out["net_income"]) == 2
+
+    def test_net_income_includes_allowances(self):
+        out = compute_batch(30000, year=2025, meal_allowance=1000)
+        assert out["net_income"][0] == 30000 + 1000 - out["total_tax"][0]
+
+    def test_length_mismatch_raises(self):
+        with pytest.raises(ValueError, match="same length"):
+            compute_batch([30000, 40000], year=[2024, 2025, 2025])
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_map_batches_keeps_order(self, workers):
+        chunks = [{"income": [10000.0 * k, 10000.0 * k + 5000], "year": 2025} for k in range(1, 8)]
+        results = list(map_batches(compute_chunk, chunks, workers))
+        assert [r["income_tax"][0] for r in results] == [make(10000.0 * k).income_tax for k in range(1, 8)]
+
+    def test_map_batches_raises_in_order(self):
+        chunks = [{"income": [1000.0]}, {"income": [1000.0], "year": 2022}]
+        results = map_batches(compute_chunk, chunks, 2)
+        assert next(results)["income_tax"][0] == Income(income=1000).income_tax
+        with pytest.raises(ValueError, match="years"):
+            next(results)
+
+    def test_invalid_values_raise(self):
+        with pytest.raises(ValueError, match="years"):
+            compute_batch(np.array([30000.0]), year=2022)
+        with pytest.raises(ValueError, match="region"):
+            compute_batch([30000], region=["Algarve"])
+        with pytest.raises(ValueError, match="ages"):
+            compute_batch([30000], kids="young")
+        with pytest.raises(ValueError, match="prior"):
+            compute_batch([30000], year=2025, opened_at="01/26")
+
+
+class TestIncomeCurve:
+    def test_grid_includes_stop(self):
+        curve = income_curve({"year": 2025}, 0, 1000, 10)
+        assert curve["gross"][0] == 0 and curve["gross"][-1] == 1000
+        assert len(curve["net_income"]) == 101
+
+    def test_matches_scalar_income(self):
+        curve = income_curve({"year": 2025, "status": "joint", "kids": "3"}, 20000, 100000, 20000)
+        for gross, tax in zip(curve["gross"], curve["total_tax"]):
+            assert tax == make(gross, status="joint", kids="3").breakdown.total_tax
+
+    def test_rates(self):
+        curve = income_curve({"year": 2025, "residence": "nr"}, 0, 50000, 1000)
+        assert curve["effective_rate"][0] == 0
+        # flat 25% IRS + 11% social security for non-residents
+        assert np.allclose(curve["marginal_rate"], 0.36)
+        assert np.allclose(curve["effective_rate"][1:], 0.36)
+
+    def test_invalid_grid_raises(self):
+        with pytest.raises(ValueError, match="step"):
+            income_curve({}, 0, 1000, 0)
+
+
+class TestGrossForNet:
+    @pytest.mark.parametrize("profile", [
+        {"year": 2025},
+        {"year": 2025, "status": "joint", "kids": "2,5"},
+        {"year": 2024, "residence": "nhr", "region": "Azores"},
+        {"year": 2025, "residence": "nr"},
+        {"year": 2025, "residence": "nr", "opened_at": "03/22"},
+        {"year": 2026, "opened_at": "03/25", "expenses": 2000},
+        {"year": 2025, "opened_at": "01/20"},
+        {"year": 2023, "meal_allowance": 3000, "telework_allowance": 500},
+    ])
+    def test_inverts_net_income(self, profile):
+        gross = np.concatenate([np.linspace(1000, 120000, 600), [75000, 80000, 250000, 450000]])
+        net = compute_batch(gross, **profile)["net_income"]
+        solution = gross_for_net(profile, net)
+        # both directions are exact up to the rounding of each tax to the cent
+        assert np.abs(compute_batch(solution, **profile)["net_income"] - net).max() < 0.05
+        assert np.abs(solution - gross).max() < 0.25
+
+    def test_scalar_target(self):
+        gross = gross_for_net({"year": 2025}, 36000)
+        assert isinstance(gross, float)
+        assert abs(make(gross).breakdown.net_income - 36000) < 0.05
+
+    def test_unreachable_target_raises(self):
+        with pytest.raises(ValueError, match="zero gross"):
+            gross_for_net({"year": 2025, "opened_at": "01/25"}, -1000)
+
+    @pytest.mark.parametrize("profile", [
+        {"year": 2025, "residence": "nr"},
+        {"year": 2024, "residence": "nr", "meal_allowance": 3000},
+        {"year": 2025, "residence": "nr", "opened_at": "03/22"},
+        {"year": 2026, "residence": "nr", "opened_at": "06/25", "expenses": 1000},
+    ])
+    @pytest.mark.parametrize("net", [12000, 36000, 100000, 500000])
+    def test_non_resident_round_trip(self, profile, net):
+        # no breakpoint at all, the single segment has to hold up to any income
+        gross = gross_for_net(profile, net)
+        assert Income(**profile, income=gross).breakdown.net_income == pytest.approx(net, abs=0.01)
+
+
+class TestCompileProfile:
+    @pytest.mark.parametrize("profile", [
+        {"year": 2025},
+        {"year": 2025, "status": "joint", "kids": "2,5"},
+        {"year": 2024, "residence": "nhr", "region": "Azores"},
+        {"year": 2025, "residence": "nr"},
+        {"year": 2025, "residence": "nr", "opened_at": "03/22"},
+        {"year": 2026, "opened_at": "03/25", "expenses": 2000},
+        {"year": 2023, "meal_allowance": 3000, "telework_allowance": 500},
+    ])
+    def test_matches_compute_batch(self, profile):
+        gross = np.linspace(0, 500000, 5001)
+        compiled, exact = compile_profile(profile).evaluate(gross), compute_batch(gross, **profile)
+        # the compiled functions skip the rounding of the intermediate taxes to the cent
+        for name, column in exact.items():
+            assert np.abs(compiled[name] - column).max() < 0.05
+
+    def test_exact_at_breakpoints(self):
+        compiled = compile_profile({"year": 2025, "kids": "3"})
+        exact = compute_batch(compiled.gross, year=2025, kids="3")
+        assert np.allclose(compiled.evaluate(compiled.gross)["total_tax"], exact["total_tax"], rtol=0, atol=1e-6)
+
+    def test_scalar_income(self):
+        values = compile_profile({"year": 2025}).evaluate(42000.0)
+        assert isinstance(values["total_tax"], float)
+        assert abs(values["total_tax"] - make(42000).breakdown.total_tax) < 0.05
+
+    def test_cached_by_profile(self):
+        assert compile_profile({"year": 2025, "status": "joint"}) is compile_profile({"status": "joint", "year": 2025})
+        assert compile_profile({"year": 2025}) is not compile_profile({"year": 2024})
+
+    def test_marginal_rate(self):
+        compiled = compile_profile({"year": 2025, "residence": "nr"})
+        assert compiled.marginal_rate(30000) == pytest.approx(0.36)
+        assert np.allclose(compiled.marginal_rate([0, 1e6]), 0.36)
+
+    def test_marginal_rate_non_resident_category_b(self):
+        # flat 25% plus the self-employed Social Security, from the true rates rather than the cents
+        compiled = compile_profile({"year": 2025, "residence": "nr", "opened_at": "03/22"})
+        assert compiled.marginal_rate(500000) == pytest.approx(0.3625, abs=1e-6)
+
+
+# ---------------------------------------------------------------------------
+# Trace
+# ---------------------------------------------------------------------------
+
+class TestTrace:
+    STEPS = [
+        "allowance_excess", "specific_deduction", "social_security_tax", "taxable_base",
+        "family_quotient", "family_deduction", "income_tax", "progressive_taxation",
+        "solidarity_tax", "progressive_taxation",
+    ]
+
+    def test_explain_lists_steps_in_order(self):
+        inc = make(90000, status="joint", kids="3")
+        trace = inc.explain()
+        assert [step.name for step in trace.steps] == self.STEPS
+        values = {step.name: step.value for step in trace.steps if step.depth == 0}
+        breakdown = inc.breakdown
+        for name in ("taxable_base", "family_quotient", "income_tax", "solidarity_tax"):
+            assert values[name] == getattr(breakdown, name)
+        assert trace.counts["progressive_taxation"] == 2
+        assert all(step.seconds >= 0 for step in trace.steps)
+
+    def test_nested_steps(self):
+        steps = make(50000).explain().steps
+        assert [step.depth for step in steps if step.name == "progressive_taxation"] == [1, 1]
+        assert all(step.depth == 0 for step in steps if step.name != "progressive_taxation")
+
+    def test_shared_steps_of_variants(self):
+        with tracing() as trace:
+            compare_scenarios(
+                {"year": 2025, "income": 60000, "kids": "3"}, alternative_scenarios("r", "single", "3")
+            )
+        assert trace.counts["taxable_base"] == 1
+        assert trace.counts["income_tax"] == 4
+        shared = [step for step in trace.steps if step.shared]
+        assert {step.taxpayer for step in shared} == {1, 2, 3}
+        assert all(step.seconds == 0 for step in shared)
+
+    def test_no_recording_outside_tracing(self):
+        with tracing() as trace:
+            pass
+        make(50000).breakdown
+        assert trace.steps == []
+
+    def test_as_dict_and_text(self):
+        trace = make(50000).explain()
+        data = trace.as_dict()
+        assert data["steps"][0]["name"] == "allowance_excess"
+        assert data["counts"]["income_tax"] == 1
+        assert "progressive_taxation" in str(trace)
@@ -0,0 +1,75 @@
+"""
+Tests for the write-behind queue (writebehind.py).
+"""
+import threading
+import time
+
+from writebehind import WriteBehind
+
+
+class Recorder:
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.fail_on = fail_on
+        self.written = threading.Event()
+
+    def __call__(self, batch):
+        if self.fail_on in batch:
+            raise ValueError("bad item")
+        self.batches.append(list(batch))
+        self.written.set()
+
+
+# ---------------------------------------------------------------------------
+# Batching
+# ---------------------------------------------------------------------------
+
+class TestWriteBehind:
+    def test_put_doesnt_wait_and_flush_writes(self):
+        recorder = Recorder()
+        writer = WriteBehind(recorder, max_delay=60)
+        for k in range(5):
+            writer.put(k)
+        assert recorder.batches == []
+        assert writer.flush(5)
+        assert recorder.batches == [[0, 1, 2, 3, 4]]
+        writer.close()
+
+    def test_written_within_max_delay(self):
+        recorder = Recorder()
+        writer = WriteBehind(recorder, max_delay=0.05)
+        start = time.monotonic()
+        writer.put("a")
+        assert recorder.written.wait(5)
+        assert time.monotonic() - start < 5
+        assert recorder.batches == [["a"]]
+        writer.close()
+
+    def test_batches_bounded(self):
+        recorder = Recorder()
+        writer = WriteBehind(recorder, max_delay=60, max_batch=3)
+        for k in range(7):
+            writer.put(k)
+        writer.flush(5)
+        assert recorder.batches == [[0, 1, 2], [3, 4, 5], [6]]
+        writer.close()
+
+    def test_close_writes_the_rest(self):
+        recorder = Recorder()
+        writer = WriteBehind(recorder, max_delay=60)
+        writer.put(1)
+        writer.close()
+        assert recorder.batches == [[1]]
+        # after close items are written synchronously
+        writer.put(2)
+        assert recorder.batches == [[1], [2]]
+
+    def test_failed_batch_written_item_by_item(self):
+        recorder = Recorder(fail_on="bad")
+        writer = WriteBehind(recorder, max_delay=60)
+        for item in ("a", "bad", "b"):
+            writer.put(item)
+        writer.flush(5)
+        assert recorder.batches == [["a"], ["b"]]
+        assert writer.stats() == {"pending": 0, "written": 2, "failed": 1}
+        writer.close()
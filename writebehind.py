@@ -0,0 +1,123 @@
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteBehind:
+    """
+    Queues items in memory and writes them from a background thread in batches,
+    so that the caller never waits on the storage.
+
+    A batch is written once it holds `max_batch` items or `max_delay` seconds after its first item,
+    whichever comes first, which bounds how late an item becomes visible.
+    If writing a batch fails, its items are written one by one so that a bad item can't lose the others.
+
+    Args:
+        write (Callable): Writes a list of items in a single transaction.
+        max_delay (float): Seconds an item may wait in the queue.
+        max_batch (int): Most items written at once.
+    """
+
+    def __init__(self, write: Callable[[list], Any], max_delay: float = 1.0, max_batch: int = 500) -> None:
+        self._write = write
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self.written = 0
+        self.failed = 0
+
+    def _start(self) -> None:
+        # started on first use, and again in a forked child which doesn't inherit the thread
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def put(self, item: Any) -> None:
+        """Queues an item, or writes it right away once the queue is closed."""
+        if self._closed:
+            self._write_batch([item])
+            return
+        self._start()
+        self._queue.put(item)
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Waits until every item queued so far is written.
+
+        Returns:
+            bool: False if the timeout expired first.
+        """
+        if self._pid != os.getpid() or self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self) -> None:
+        """Writes what is left and stops the thread, later items are written synchronously."""
+        self._closed = True
+        if self._pid == os.getpid():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Items waiting in the queue, written and failed since start.
+        """
+        pending = self._queue.qsize() if self._pid == os.getpid() else 0
+        return {"pending": pending, "written": self.written, "failed": self.failed}
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            batch, flushed = [], []
+            deadline = time.monotonic() + self.max_delay
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    flushed.append(item)
+                    break
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.max_batch or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self._write_batch(batch)
+            for done in flushed:
+                done.set()
+
+    def _write_batch(self, batch: list) -> None:
+        try:
+            self._write(batch)
+            self.written += len(batch)
+            return
+        except Exception:
+            if len(batch) == 1:
+                logger.exception("Dropped an item that couldn't be written")
+                self.failed += 1
+                return
+        for item in batch:
+            self._write_batch([item])
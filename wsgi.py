@@ -0,0 +1,4 @@
+"""WSGI entry point: `from wsgi import application` (PythonAnywhere) or `gunicorn wsgi:app`."""
+from app import create_app
+
+app = application = create_app()